@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+
+"""
+Benchmark the analysis pipeline on a data directory, e.g. one written by gen_synthetic_runs.py.
+
+The stages of parse_all_data_points.py are timed one by one in a fresh process, so that its RSS is
+not inflated by the benchmark itself. The RSS reported for a stage is the high-water mark of that
+process at the end of the stage, i.e. of the stage and all before it:
+
+  scan        catalog the run directories
+  parse.eve / parse.sysstat / parse.psstat
+              parse every file of the kind with the parser of the pipeline, without the cache
+  aggregate   align the runs of every collection and compute the median over them
+  output      write the workbooks and summaries of every collection
+
+The whole pipeline is then run as parse_all_data_points.py, with its worker processes, for the
+end-to-end time and the high-water mark RSS of its largest process. Throughput is reported in MB/s of input (as stored, so compressed
+files count their compressed size) and in records, i.e. rows and stats records, per second.
+
+Example:
+
+$ python3 suricata/gen_synthetic_runs.py /tmp/synthetic --repeats 10
+$ python3 suricata/bench_analysis.py /tmp/synthetic 1 --json before.json
+"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from colors import Colors
+from dataparser import align
+from dataparser import catalog
+from dataparser import compressed
+from dataparser import exceptions
+from dataparser import statschema
+from dataparser import summary
+from parse_all_data_points import RUN_FILES, entry_args, get_collection_name, run_file_path
+
+
+# Kinds of run files of the pipeline: (kind, file names, parser class, align key).
+KINDS = tuple((kind, filenames, type(parser), collection_class.ALIGN_KEY)
+              for kind, filenames, parser, _, collection_class in RUN_FILES)
+
+
+def rss_hwm_kb():
+    """ High-water mark RSS of this process so far, in KB. """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def stage(name, start, nbytes=0, nrecords=0):
+    elapsed = time.perf_counter() - start
+    return collections.OrderedDict([
+        ('stage', name), ('sec', elapsed), ('MB', nbytes / 1e6),
+        ('MB/s', nbytes / 1e6 / elapsed if elapsed > 0 and nbytes else float('nan')),
+        ('records/s', nrecords / elapsed if elapsed > 0 and nrecords else float('nan')),
+        ('rss_hwm_MB', rss_hwm_kb() / 1024.0),
+    ])
+
+
+def _nrecords(data):
+    return max((len(v) for v in data.values()), default=0)
+
+
+def run_stages(data_dir, scan_depth, output_dir, eve_columns='default'):
+    """ Run the stages of the pipeline one after another. Returns the list of their results. """
+    results = []
+    start = time.perf_counter()
+    with catalog.Catalog(data_dir, os.path.join(output_dir, 'catalog.sqlite')) as runs:
+        runs.update(scan_depth)
+        entries = runs.select()
+        paths = [runs.abspath(entry) for entry in entries]
+    results.append(stage('scan', start, nrecords=len(entries)))
+    collections_by_kind = collections.OrderedDict()
+    for kind, filenames, parser_class, _ in KINDS:
+        parser = parser_class()
+        if kind == 'eve' and eve_columns == 'all':
+            parser.schema = statschema.ALL_NUMERIC
+        groups = collections_by_kind[kind] = collections.OrderedDict()
+        nbytes = nrecords = 0
+        start = time.perf_counter()
+        for entry, dirpath in zip(entries, paths):
+            path = run_file_path(dirpath, filenames)
+            found = compressed.find(path)
+            if found is None:
+                continue
+            try:
+                data = parser.parse(path)
+            except exceptions.NoContentException:
+                continue
+            nbytes += os.path.getsize(found)
+            nrecords += _nrecords(data)
+            groups.setdefault(get_collection_name(*entry_args(entry)), dict())[entry.ts] = data
+        results.append(stage('parse.' + kind, start, nbytes, nrecords))
+    stats = []
+    nrecords = 0
+    start = time.perf_counter()
+    for kind, _, _, key in KINDS:
+        aligner = align.Aligner(key, *align.DEFAULT_OPTIONS)
+        for name, all_data in collections_by_kind[kind].items():
+            runs = [all_data[k] for k in sorted(all_data.keys())]
+            names = []
+            for run in runs:
+                names.extend(n for n in run.keys() if n not in names)
+            _, aligned = aligner.align(runs)
+            stats.append(summary.summarize(aligned, names))
+            nrecords += sum(_nrecords(run) for run in runs)
+    results.append(stage('aggregate', start, nrecords=nrecords))
+    del stats
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as log:
+        for kind, _, _, key in KINDS:
+            aligner = align.Aligner(key, *align.DEFAULT_OPTIONS)
+            for name, all_data in collections_by_kind[kind].items():
+                summary.write_workbook(os.path.join(output_dir, '%s,%s' % (name, kind)), all_data, log,
+                                       integer=kind == 'eve', aligner=aligner)
+    results.append(stage('output', start, nrecords=nrecords))
+    return results
+
+
+def run_pipeline(data_dir, scan_depth, output_dir, workers, eve_columns='default'):
+    """ Run parse_all_data_points.py. Returns its wall time and the high-water mark RSS of its largest process. """
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parse_all_data_points.py'),
+           os.path.abspath(data_dir), output_dir, str(scan_depth), '--no-cache', '--workers', str(workers),
+           '--catalog', os.path.join(output_dir, 'catalog.sqlite'), '--eve-columns', eve_columns]
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        p = subprocess.Popen(cmd, stdout=devnull, stderr=subprocess.STDOUT)
+        # The rusage of a child covers the largest of the processes it waited for.
+        _, status, rusage = os.wait4(p.pid, 0)
+        p.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    if p.returncode != 0:
+        raise RuntimeError('parse_all_data_points.py exited with %d.' % p.returncode)
+    return collections.OrderedDict([('stage', 'pipeline'), ('sec', elapsed), ('MB', float('nan')),
+                                    ('MB/s', float('nan')), ('records/s', float('nan')),
+                                    ('rss_hwm_MB', rusage.ru_maxrss / 1024.0)])
+
+
+def print_table(results):
+    names = list(results[0].keys())
+    print(Colors.CYAN + ''.join('%-14s' % n for n in names) + Colors.ENDC)
+    for r in results:
+        print(''.join('%-14s' % (v if isinstance(v, str) else '%.3f' % v) for v in r.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the analysis pipeline.')
+    parser.add_argument('data_dir', type=str, help='Directory holding the run directories.')
+    parser.add_argument('scan_depth', type=int, help='Depth of the run directories under data_dir.')
+    parser.add_argument('--workers', type=int, default=catalog.NUM_WORKERS,
+                        help='Number of worker processes of the pipeline. Default: number of CPUs.')
+    parser.add_argument('--eve-columns', type=str, choices=('default', 'all'), default='default',
+                        help='Eve stats counters to extract, see parse_all_data_points.py. Default: "default".')
+    parser.add_argument('--no-pipeline', default=False, action='store_true',
+                        help='If present, only benchmark the stages and do not run the whole pipeline.')
+    parser.add_argument('--json', type=str, default=None, help='File to save the results to, to compare them later.')
+    args = parser.parse_args()
+    tmpdir = tempfile.mkdtemp(prefix='bench_analysis.')
+    try:
+        stages_dir = os.path.join(tmpdir, 'stages')
+        os.makedirs(stages_dir)
+        # A fresh process, so that the RSS high-water mark is the one of the stages.
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            results = pool.apply(run_stages, (os.path.abspath(args.data_dir), args.scan_depth, stages_dir,
+                                              args.eve_columns))
+        if not args.no_pipeline:
+            pipeline_dir = os.path.join(tmpdir, 'pipeline')
+            os.makedirs(pipeline_dir)
+            results.append(run_pipeline(args.data_dir, args.scan_depth, pipeline_dir, args.workers, args.eve_columns))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    print_table(results)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'data_dir': os.path.abspath(args.data_dir), 'workers': args.workers,
+                       'eve_columns': args.eve_columns,
+                       'stages': [{k: None if isinstance(v, float) and v != v else v for k, v in r.items()}
+                                  for r in results]}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+"""
+Compare two campaigns of the same test matrix, e.g. before and after a Suricata or kernel upgrade,
+and flag the statistically significant regressions and improvements per configuration:
+
+  <output_dir>/compare.csv    one row per configuration and metric, regressions first
+  <output_dir>/compare.xlsx   the same, with filters to sort and select rows
+"""
+
+import argparse
+import os
+import sys
+
+import xlsxwriter
+
+from colors import Colors
+from dataparser import catalog
+from dataparser import compare
+from scaling_report import collect_run_metrics, save_csv
+
+
+def save_xlsx(path, rows):
+    workbook = xlsxwriter.Workbook(path, {'nan_inf_to_errors': True})
+    sheet = workbook.add_worksheet('Compare')
+    red = workbook.add_format({'bg_color': '#FFC7CE'})
+    green = workbook.add_format({'bg_color': '#C6EFCE'})
+    names = list(rows[0].keys())
+    sheet.write_row(0, 0, names)
+    for i, row in enumerate(rows, start=1):
+        fmt = red if row['verdict'] == 'regression' else green if row['verdict'] == 'improvement' else None
+        sheet.write_row(i, 0, ['' if v is None else v for v in row.values()], fmt)
+    sheet.autofilter(0, 0, len(rows), len(names) - 1)
+    sheet.freeze_panes(1, 0)
+    workbook.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find regressions between two campaigns of the same test matrix.')
+    parser.add_argument('old_dir', type=str, help='Data directory of the old (baseline) campaign.')
+    parser.add_argument('new_dir', type=str, help='Data directory of the new campaign.')
+    parser.add_argument('output_dir', type=str, help='Directory to write the report to.')
+    parser.add_argument('scan_depth', type=int, help='Depth of the run directories under the data directories.')
+    parser.add_argument('--where', type=str, default=None,
+                        help='SQL condition on the catalog columns to select runs in both campaigns.')
+    catalog.add_catalog_argument(parser, '--old-catalog', 'old_dir')
+    catalog.add_catalog_argument(parser, '--new-catalog', 'new_dir')
+    parser.add_argument('--resamples', type=int, default=compare.DEFAULT_RESAMPLES,
+                        help='Number of bootstrap resamples. Default: %(default)s.')
+    parser.add_argument('--alpha', type=float, default=compare.DEFAULT_ALPHA,
+                        help='Significance level; the confidence intervals are 1 - alpha. Default: %(default)s.')
+    parser.add_argument('--min-change', type=float, default=0.0,
+                        help='Smallest change to flag, relative except for the drop ratio. Default: %(default)s.')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the bootstrap, for reproducible reports.')
+    parser.add_argument('--step', type=float, default=None,
+                        help='Interval, in sec, of the joined series. Default: the sampling interval of resmon.')
+    parser.add_argument('--workers', type=int, default=catalog.NUM_WORKERS,
+                        help='Number of worker processes. Default: number of CPUs.')
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    old_runs, old_errors = collect_run_metrics(args.old_dir, args.scan_depth, args.where, args.step, args.workers,
+                                               args.old_catalog)
+    new_runs, new_errors = collect_run_metrics(args.new_dir, args.scan_depth, args.where, args.step, args.workers,
+                                               args.new_catalog)
+    for data_dir, errors in ((args.old_dir, old_errors), (args.new_dir, new_errors)):
+        for path, e in errors:
+            print(Colors.RED + 'Error: %s: %s' % (os.path.join(data_dir, path), e) + Colors.ENDC)
+    rows = compare.sort_rows(compare.compare(old_runs, new_runs, args.resamples, args.alpha, args.min_change, args.seed))
+    if len(rows) == 0:
+        print(Colors.RED + 'No configuration is in both campaigns.' + Colors.ENDC)
+        return 1
+    save_csv(os.path.join(args.output_dir, 'compare.csv'), rows)
+    save_xlsx(os.path.join(args.output_dir, 'compare.xlsx'), rows)
+    nregressions = sum(1 for r in rows if r['verdict'] == 'regression')
+    nimprovements = sum(1 for r in rows if r['verdict'] == 'improvement')
+    for r in rows[:nregressions]:
+        print(Colors.RED + 'Regression: %s %dc%dd %s: %+.4g [%+.4g, %+.4g]' % (
+              r['runmode'], r['nc'], r['nd'], r['metric'], r['change'], r['ci_low'], r['ci_high']) + Colors.ENDC)
+    print('Saved the comparison of %d configuration metrics to "%s".' % (len(rows), args.output_dir))
+    print(Colors.RED + 'Regressions:\t%d' % nregressions + Colors.ENDC)
+    print(Colors.GREEN + 'Improvements:\t%d' % nimprovements + Colors.ENDC)
+    print(Colors.RED + 'Failures:\t%d' % (len(old_errors) + len(new_errors)) + Colors.ENDC)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+"""
+Report how evenly the load of every run spreads over the cores of the receiver:
+
+  <output_dir>/cores.csv        imbalance metrics of every run over its steady window, its busiest core, the
+                                saturated cores and which of the capture and worker CPU sets they belong to
+  <output_dir>/cores.util.csv   mean utilization of every core of every run over its steady window
+"""
+
+import argparse
+import collections
+import os
+import sys
+
+import numpy as np
+
+from colors import Colors
+from dataparser import catalog
+from dataparser import imbalance
+from scaling_report import print_outcome, save_csv
+
+
+def utilization_one(dirpath, step, saturation):
+    core_ids, mean, saturated = imbalance.core_utilization(dirpath, step, saturation)
+    return core_ids, mean, saturated, imbalance.load_core_sets(dirpath)
+
+
+def cpu_list(cpus):
+    return ' '.join(str(c) for c in cpus)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-core utilization imbalance and saturated cores of every run.')
+    parser.add_argument('data_dir', type=str, help='Directory holding the run directories.')
+    parser.add_argument('output_dir', type=str, help='Directory to write the report to.')
+    parser.add_argument('scan_depth', type=int, help='Depth of the run directories under data_dir.')
+    parser.add_argument('--where', type=str, default=None,
+                        help='SQL condition on the catalog columns to select runs.')
+    catalog.add_catalog_argument(parser)
+    parser.add_argument('--saturation', type=float, default=imbalance.DEFAULT_SATURATION,
+                        help='Utilization, in %%, at which a core is saturated. Default: %(default)s.')
+    parser.add_argument('--step', type=float, default=None,
+                        help='Interval, in sec, of the joined series. Default: the sampling interval of resmon.')
+    parser.add_argument('--workers', type=int, default=catalog.NUM_WORKERS,
+                        help='Number of worker processes. Default: number of CPUs.')
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    results, errors = catalog.map_runs(args.data_dir, args.scan_depth, args.where, utilization_one,
+                                       (args.step, args.saturation), args.workers, args.catalog)
+    results = [(entry, result) for entry, result in results if len(result[0])]
+    if len(results) == 0:
+        print_outcome('Runs', 0, errors)
+        print(Colors.RED + 'No run has per-core utilization.' + Colors.ENDC)
+        return 1
+    utilization = imbalance.stack([mean for _, (_, mean, _, _) in results])
+    run_metrics = imbalance.metrics(utilization)
+    rows = []
+    util_rows = []
+    for i, (entry, (core_ids, mean, saturated, sets)) in enumerate(results):
+        row = collections.OrderedDict([('path', entry.path), ('conf', entry.conf), ('runmode', entry.runmode),
+                                       ('nc', entry.nc), ('nd', entry.nd), ('affinity', entry.affinity),
+                                       ('i', entry.i), ('ts', entry.ts)])
+        row.update((name, float(values[i])) for name, values in run_metrics.items())
+        row['hot_core'] = int(core_ids[np.nanargmax(mean)]) if not np.all(np.isnan(mean)) else None
+        hot = imbalance.saturated_cores(core_ids, saturated)
+        row['saturated'] = cpu_list(hot)
+        row['nsaturated'] = len(hot)
+        for name, cores in imbalance.match_core_sets(hot, sets).items():
+            row['saturated.' + name] = cpu_list(cores)
+        for name, cpus in sets.items():
+            row[name + '_cpus'] = cpu_list(cpus)
+        rows.append(row)
+        util = collections.OrderedDict([('path', entry.path)])
+        util.update(('cpu%d' % c, float(v)) for c, v in zip(core_ids, mean))
+        util_rows.append(util)
+    save_csv(os.path.join(args.output_dir, 'cores.csv'), rows)
+    # Runs may have different cores. Give every row all columns.
+    names = sorted({k for u in util_rows for k in u if k != 'path'}, key=lambda k: int(k[3:]))
+    save_csv(os.path.join(args.output_dir, 'cores.util.csv'),
+             [collections.OrderedDict([('path', u['path'])] + [(k, u.get(k, float('nan'))) for k in names])
+              for u in util_rows])
+    print('Saved the core utilization of %d runs to "%s".' % (len(rows), args.output_dir))
+    print_outcome('Runs', len(rows), errors, [('Runs with saturated cores', sum(1 for r in rows if r['nsaturated']))])
+    return 1 if len(errors) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
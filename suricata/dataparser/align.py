@@ -0,0 +1,119 @@
+"""
+Alignment of repeated runs on a common grid.
+
+Runs sample at slightly different uptimes and stop at different times, so row i of one run is not
+the same moment as row i of another. Aligner resamples the numeric columns of every run onto one
+uptime grid, either by linear interpolation or by taking the nearest sample within a tolerance.
+Grid points outside a run, or without a near enough sample, are NaN and left out of the cross-run
+statistics. All columns of a run are resampled at once as a matrix.
+"""
+
+import collections
+
+import numpy as np
+
+
+METHODS = ('linear', 'nearest')
+
+AlignOptions = collections.namedtuple('AlignOptions', ('method', 'step', 'tolerance'))
+
+DEFAULT_OPTIONS = AlignOptions('linear', None, None)
+
+
+def sampling_step(keys_list):
+    """ Median interval between consecutive samples over all runs. """
+    diffs = [np.diff(keys) for keys in keys_list if len(keys) > 1]
+    diffs = np.concatenate(diffs) if len(diffs) > 0 else np.empty(0)
+    diffs = diffs[diffs > 0]
+    return float(np.median(diffs)) if len(diffs) > 0 else 1.0
+
+
+def common_grid(keys_list, step):
+    """ Grid with the given step covering every run, anchored at a multiple of the step. """
+    start = min(keys[0] for keys in keys_list if len(keys) > 0)
+    end = max(keys[-1] for keys in keys_list if len(keys) > 0)
+    start = np.floor(start / step) * step
+    return start + step * np.arange(int(np.floor((end - start) / step + 1e-9)) + 1)
+
+
+def resample_linear(keys, matrix, grid):
+    """ Interpolate the rows of matrix, sampled at keys, at the grid points. """
+    n = len(keys)
+    if n < 2:
+        return resample_nearest(keys, matrix, grid, 0)
+    right = np.clip(np.searchsorted(keys, grid, side='right'), 1, n - 1)
+    left = right - 1
+    span = keys[right] - keys[left]
+    weight = np.divide(grid - keys[left], span, out=np.zeros(len(grid)), where=span > 0)
+    out = matrix[:, left] * (1 - weight) + matrix[:, right] * weight
+    out[:, (grid < keys[0]) | (grid > keys[-1])] = np.nan
+    return out
+
+
+def resample_nearest(keys, matrix, grid, tolerance):
+    """ Take the sample nearest to each grid point, or NaN if it is farther than tolerance. """
+    n = len(keys)
+    if n == 0:
+        return np.full((len(matrix), len(grid)), np.nan)
+    right = np.clip(np.searchsorted(keys, grid), 0, n - 1)
+    left = np.clip(right - 1, 0, n - 1)
+    nearest = np.where(np.abs(grid - keys[left]) <= np.abs(keys[right] - grid), left, right)
+    out = matrix[:, nearest]
+    out[:, np.abs(keys[nearest] - grid) > tolerance] = np.nan
+    return out
+
+
+class Aligner:
+
+    def __init__(self, key, method='linear', step=None, tolerance=None):
+        """
+        :param key: Name of the column to align on, e.g. "uptime".
+        :param method: "linear" or "nearest".
+        :param step: Interval of the grid. Default: the median sampling interval of the runs.
+        :param tolerance: Max distance to the nearest sample. Default: half the step.
+        """
+        if method not in METHODS:
+            raise ValueError('Unknown alignment method "%s".' % method)
+        self.key = key
+        self.method = method
+        self.step = step
+        self.tolerance = tolerance
+
+    def describe(self, step):
+        return {'key': self.key, 'method': self.method, 'step': step,
+                'tolerance': self.tolerance if self.tolerance is not None else step / 2}
+
+    def align(self, runs):
+        """
+        Resample the runs onto a common grid.
+        :param list runs: Dicts mapping column name to array. Runs without the key column are skipped.
+        :return: (step, list of OrderedDicts of float64 arrays with the grid as the key column).
+            Columns that are not numeric are dropped.
+        """
+        runs = [run for run in runs if self.key in run and len(run[self.key]) > 0]
+        if len(runs) == 0:
+            return self.step, []
+        keys_list = []
+        for run in runs:
+            keys = run[self.key].astype(np.float64)
+            keys_list.append(keys)
+        step = self.step if self.step is not None else sampling_step(keys_list)
+        tolerance = self.tolerance if self.tolerance is not None else step / 2
+        grid = common_grid(keys_list, step)
+        aligned = []
+        for run, keys in zip(runs, keys_list):
+            order = np.argsort(keys, kind='stable')
+            keys = keys[order]
+            names = [name for name, values in run.items()
+                     if name != self.key and values.dtype.kind in 'biuf']
+            matrix = np.vstack([run[name][order].astype(np.float64) for name in names]) if len(names) > 0 \
+                else np.empty((0, len(keys)))
+            if self.method == 'linear':
+                values = resample_linear(keys, matrix, grid)
+            else:
+                values = resample_nearest(keys, matrix, grid, tolerance)
+            columns = collections.OrderedDict([(self.key, grid)])
+            for name, row in zip(names, values):
+                columns[name] = row
+            aligned.append(columns)
+        return step, aligned
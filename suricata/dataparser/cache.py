@@ -0,0 +1,91 @@
+"""
+Persistent cache of parsed run files.
+
+Finished runs in the data repository never change, so the result of parsing a file is stored in
+an SQLite database keyed by the path, size and mtime of the file and the name and VERSION of the
+parser. Bump the VERSION of a parser whenever its output changes.
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import zlib
+
+from . import compressed
+
+
+class ParseCache:
+
+    # Commit after this many new entries, so that an interrupted run keeps most of its work.
+    COMMIT_EVERY = 64
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS parsed ('
+                          'path TEXT NOT NULL, parser TEXT NOT NULL, version INTEGER NOT NULL, '
+                          'size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, data BLOB NOT NULL, '
+                          'PRIMARY KEY (path, parser))')
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _key(path, parser):
+        # The file may be stored compressed. Compressing it changes the size and so invalidates the entry.
+        st = os.stat(compressed.find(path) or path)
+        # Parsers configured to produce different results tell them apart by a variant suffix.
+        name = type(parser).__name__ + getattr(parser, 'variant', '')
+        return os.path.abspath(path), name, getattr(parser, 'VERSION', 0), st.st_size, st.st_mtime_ns
+
+    def get(self, path, parser):
+        """ Return the cached result of parser.parse(path), or None if absent or stale. """
+        path, name, version, size, mtime_ns = self._key(path, parser)
+        with self._lock:
+            row = self.conn.execute('SELECT data FROM parsed WHERE path=? AND parser=? AND version=? AND size=? AND mtime_ns=?',
+                                    (path, name, version, size, mtime_ns)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def put(self, path, parser, data):
+        path, name, version, size, mtime_ns = self._key(path, parser)
+        blob = zlib.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self.conn.execute('INSERT OR REPLACE INTO parsed (path, parser, version, size, mtime_ns, data) VALUES (?, ?, ?, ?, ?, ?)',
+                              (path, name, version, size, mtime_ns, blob))
+            self._pending += 1
+            if self._pending >= self.COMMIT_EVERY:
+                self.conn.commit()
+                self._pending = 0
+
+    def parse(self, path, parser):
+        """ Return parser.parse(path), from the cache if possible. """
+        data = self.get(path, parser)
+        if data is None:
+            data = parser.parse(path)
+            self.put(path, parser, data)
+        return data
+
+    def invalidate(self):
+        """ Drop all entries. """
+        with self._lock:
+            self.conn.execute('DELETE FROM parsed')
+            self.conn.commit()
+            self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,250 @@
+"""
+Catalog of the runs in a data repository.
+
+The test writes a manifest.json with the full test case and host info into every run directory.
+The catalog indexes the manifests in an SQLite database so that analyses select runs by query
+instead of walking the repository and splitting directory names. Runs recorded before manifests
+existed are cataloged from their directory names.
+
+Paths in the catalog are relative to the root of the data repository, so a catalog file serves
+one repository only.
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+
+from . import runname
+
+
+MANIFEST_FILE = 'manifest.json'
+
+DEFAULT_DB_NAME = '.catalog.sqlite'
+
+# Default number of worker processes of the analyses: the number of CPU threads.
+NUM_WORKERS = multiprocessing.cpu_count()
+
+# Catalog columns and their SQLite types. Analyses may use any of them in a query.
+COLUMNS = (
+    ('path', 'TEXT PRIMARY KEY'),
+    ('name', 'TEXT'),
+    ('conf', 'TEXT'),
+    ('trace_file', 'TEXT'),
+    ('runmode', 'TEXT'),
+    ('ninstances', 'INTEGER'),
+    ('nnics', 'INTEGER'),
+    ('i', 'INTEGER'),
+    ('ts', 'INTEGER'),
+    ('nc', 'INTEGER'),
+    ('nd', 'INTEGER'),
+    ('affinity', 'TEXT'),
+    ('skip_smt', 'INTEGER'),
+    ('cluster_type', 'TEXT'),
+    ('ring_size', 'INTEGER'),
+    ('block_size', 'INTEGER'),
+    ('capture_mode', 'TEXT'),
+    ('defrag', 'INTEGER'),
+    ('test_method', 'TEXT'),
+    ('suricata_config_file', 'TEXT'),
+    ('adaptive_duration', 'INTEGER'),
+    ('enable_vtune', 'INTEGER'),
+    ('receiver_host', 'TEXT'),
+    ('kernel', 'TEXT'),
+    ('suricata_version', 'TEXT'),
+    ('result', 'INTEGER'),
+    ('source', 'TEXT'),          # "manifest" or "dirname".
+    ('mtime_ns', 'INTEGER'),     # Of the manifest, or the directory if there is none.
+    ('manifest', 'TEXT'),        # The manifest as JSON, NULL if there is none.
+)
+
+INDEXES = (
+    ('runs_collection', ('conf', 'trace_file', 'runmode', 'ninstances', 'nnics')),
+    ('runs_threads', ('nc', 'nd')),
+    ('runs_ts', ('ts',)),
+)
+
+Entry = collections.namedtuple('Entry', [c for c, _ in COLUMNS])
+
+
+def user_cache_dir():
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'suricata-analysis')
+
+
+def default_db_path(root):
+    """
+    ".catalog.sqlite" under root. If root is not writable, e.g. a read-only copy of the data
+    repository, a file of the user cache directory named after the absolute path of root.
+    """
+    if os.access(root, os.W_OK):
+        return os.path.join(root, DEFAULT_DB_NAME)
+    digest = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:16]
+    os.makedirs(user_cache_dir(), exist_ok=True)
+    return os.path.join(user_cache_dir(), 'catalog-%s.sqlite' % digest)
+
+
+def add_catalog_argument(parser, name='--catalog', what='the data directory'):
+    """ Add the option of the catalog file shared by the analysis scripts. """
+    parser.add_argument(name, type=str, default=None,
+                        help='SQLite catalog of the runs of %s. Default: "%s" in it, or a file of "%s" if it is '
+                             'not writable.' % (what, DEFAULT_DB_NAME, user_cache_dir()))
+
+
+def entry_from_manifest(path, manifest, mtime_ns):
+    params = manifest['params']
+    testcase = manifest['testcase']
+    run = manifest['run']
+    receiver = manifest.get('receiver') or dict()
+    return Entry(path=path, name=run['name'], conf=params['conf'], trace_file=params['trace_file'],
+                 runmode=params['runmode'], ninstances=params['ninstances'], nnics=params['nnics'],
+                 i=run['iter_id'], ts=run['start_time'], nc=params['nc'], nd=params['nd'],
+                 affinity=params['affinity'], skip_smt=int(params['skip_smt']),
+                 cluster_type=params['cluster_type'], ring_size=params['ring_size'],
+                 block_size=params['block_size'], capture_mode=params['capture_mode'],
+                 defrag=int(params['defrag']), test_method=testcase['test_method'],
+                 suricata_config_file=testcase['suricata_config_file'],
+                 adaptive_duration=int(testcase.get('adaptive_duration', False)),
+                 enable_vtune=int(testcase['enable_vtune']), receiver_host=receiver.get('host'),
+                 kernel=receiver.get('kernel'), suricata_version=receiver.get('suricata_version'),
+                 result=run.get('result'), source='manifest', mtime_ns=mtime_ns,
+                 manifest=json.dumps(manifest, sort_keys=True))
+
+
+def entry_from_dirname(path, mtime_ns):
+    """ Raises ValueError if the directory name is not a run name. """
+    run = runname.parse_dirname(os.path.basename(path))
+    return Entry(path=path, name=os.path.basename(path), conf=run.conf, trace_file=run.trace_file,
+                 runmode=run.runmode, ninstances=run.ninstances, nnics=run.nnics, i=run.i, ts=run.ts,
+                 nc=run.nc, nd=run.nd, affinity=run.affinity, skip_smt=int(run.skip_smt),
+                 cluster_type=run.cluster_type, ring_size=run.ring_size, block_size=run.block_size,
+                 capture_mode=run.capture_mode, defrag=int(run.defrag), test_method=None,
+                 suricata_config_file=None, adaptive_duration=None, enable_vtune=int('vtune' in run.extra),
+                 receiver_host=None, kernel=None, suricata_version=None, result=None, source='dirname',
+                 mtime_ns=mtime_ns, manifest=None)
+
+
+class Catalog:
+
+    def __init__(self, root, db_path=None):
+        """
+        :param root: Root directory of the data repository.
+        :param db_path: SQLite file. Default: see default_db_path.
+        """
+        self.root = root
+        self.db_path = db_path or default_db_path(root)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS runs (%s)' % ', '.join('%s %s' % c for c in COLUMNS))
+        # Directories that could not be cataloged, tried again only once they change.
+        self.conn.execute('CREATE TABLE IF NOT EXISTS skipped (path TEXT PRIMARY KEY, mtime_ns INTEGER, reason TEXT)')
+        for name, columns in INDEXES:
+            self.conn.execute('CREATE INDEX IF NOT EXISTS %s ON runs (%s)' % (name, ', '.join(columns)))
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _scan(self, path, depth):
+        """ Yield the relative paths of the directories depth levels below path. """
+        with os.scandir(os.path.join(self.root, path)) as it:
+            for e in it:
+                if e.is_dir() and not e.name.startswith('.'):
+                    sub = os.path.join(path, e.name) if path else e.name
+                    if depth == 1:
+                        yield sub
+                    else:
+                        yield from self._scan(sub, depth - 1)
+
+    def update(self, scan_depth):
+        """
+        Catalog new and changed run directories scan_depth levels below the root and drop the
+        ones that are gone. Only directories whose manifest changed are read.
+        :return: (number of added or updated runs, number of removed runs, [(path, reason), ...] of
+            the directories newly skipped). Skipped directories are not read again until they change.
+        """
+        known = dict(self.conn.execute('SELECT path, mtime_ns FROM runs'))
+        known_skipped = dict(self.conn.execute('SELECT path, mtime_ns FROM skipped'))
+        seen = set()
+        changed = []
+        skipped = []
+        for path in self._scan('', scan_depth):
+            manifest_path = os.path.join(self.root, path, MANIFEST_FILE)
+            try:
+                mtime_ns = os.stat(manifest_path).st_mtime_ns
+                has_manifest = True
+            except FileNotFoundError:
+                mtime_ns = os.stat(os.path.join(self.root, path)).st_mtime_ns
+                has_manifest = False
+            seen.add(path)
+            if known.get(path) == mtime_ns or known_skipped.get(path) == mtime_ns:
+                continue
+            try:
+                if has_manifest:
+                    with open(manifest_path, 'r') as f:
+                        changed.append(entry_from_manifest(path, json.load(f), mtime_ns))
+                else:
+                    changed.append(entry_from_dirname(path, mtime_ns))
+            except (ValueError, KeyError) as e:
+                skipped.append((path, mtime_ns, str(e)))
+        # A run whose manifest became unreadable is dropped as well.
+        removed = [p for p in known if p not in seen] + [p for p, _, _ in skipped if p in known]
+        self.conn.executemany('INSERT OR REPLACE INTO runs VALUES (%s)' % ', '.join('?' * len(COLUMNS)), changed)
+        self.conn.executemany('DELETE FROM runs WHERE path=?', [(p,) for p in removed])
+        self.conn.executemany('DELETE FROM skipped WHERE path=?',
+                              [(p,) for p in known_skipped if p not in seen] + [(e.path,) for e in changed])
+        self.conn.executemany('INSERT OR REPLACE INTO skipped VALUES (?, ?, ?)', skipped)
+        self.conn.commit()
+        return len(changed), len(removed), [(path, reason) for path, _, reason in skipped]
+
+    def select(self, where=None, params=()):
+        """
+        Return the Entries matching an SQL condition on the catalog columns, ordered by path.
+        e.g. select("nc = ? AND runmode = 'workers'", (2,)).
+        """
+        sql = 'SELECT %s FROM runs' % ', '.join(c for c, _ in COLUMNS)
+        if where:
+            sql += ' WHERE ' + where
+        return [Entry(*row) for row in self.conn.execute(sql + ' ORDER BY path', params)]
+
+    def abspath(self, entry):
+        return os.path.join(self.root, entry.path)
+
+
+def map_runs(data_dir, scan_depth, where, fn, args=(), workers=NUM_WORKERS, catalog_path=None):
+    """
+    Update the catalog of data_dir and call fn(run directory, *args) for every run matching the
+    SQL condition where, in a pool of worker processes.
+    :return: [(entry, result), ...] ordered by path, and [(path, error message), ...] of the runs
+        fn raised an exception for.
+    """
+    with Catalog(data_dir, catalog_path) as runs:
+        runs.update(scan_depth)
+        entries = runs.select(where)
+        paths = [runs.abspath(entry) for entry in entries]
+    results = []
+    errors = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fn, path, *args): entry for entry, path in zip(entries, paths)}
+        for future in concurrent.futures.as_completed(futures):
+            entry = futures[future]
+            try:
+                results.append((entry, future.result()))
+            except Exception as e:
+                errors.append((entry.path, str(e)))
+    # Process pool results come in completion order. Keep the reports stable.
+    results.sort(key=lambda r: r[0].path)
+    errors.sort()
+    return results, errors
+
+
+def load_manifest(entry):
+    """ Return the manifest of an Entry as dict, or None if the run has none. """
+    return json.loads(entry.manifest) if entry.manifest is not None else None
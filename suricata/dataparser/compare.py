@@ -0,0 +1,177 @@
+"""
+Regression detection between two campaigns of the same test matrix.
+
+Runs of the two campaigns are matched by configuration (see scaling.CURVE_KEYS, nc and nd). For
+every configuration and metric, the change is the difference of the medians over the repeats, new
+minus old, relative to the old median except for the drop ratio, which is often 0. A relative change
+from 0 is infinite. Its confidence interval is bootstrapped by resampling the repeats of both
+campaigns. A change whose interval excludes 0 (and is at least min_change) is flagged a regression
+or an improvement according to whether higher is better for the metric.
+
+The median of a resample only depends on which order statistics of the sample it picks, so the
+resamples are drawn once per number of repeats, as indices, and reduced to the distribution of the
+order statistics their medians average. Applied to the sorted repeats of all configurations with
+that number at once, it gives the distribution of the resampled medians of each, and the interval
+is read off the distribution of their change, weighted by the probabilities of both medians.
+"""
+
+import collections
+import math
+
+import numpy as np
+
+from . import scaling
+
+
+# Compared metrics, their better direction (1 if higher is better, -1 if lower is) and whether the
+# change is relative.
+METRICS = (
+    ('pps', 1, True),
+    ('drop_ratio', -1, False),
+    ('cpu', -1, True),
+    ('cpu_per_mpps', -1, True),
+    ('rss_kb', -1, True),
+)
+
+DEFAULT_RESAMPLES = 2000
+DEFAULT_ALPHA = 0.05
+
+# Values in the change distributions of a batch, to bound its memory.
+MAX_BATCH_VALUES = 1 << 24
+
+
+def config_key(entry):
+    return tuple(getattr(entry, k) for k in scaling.CURVE_KEYS) + (entry.nc, entry.nd)
+
+
+def group_runs(runs):
+    """ :param runs: List of (catalog entry, metrics). Returns config key -> [metrics, ...]. """
+    groups = collections.OrderedDict()
+    for entry, metrics in runs:
+        groups.setdefault(config_key(entry), []).append(metrics)
+    return groups
+
+
+def _change(old, new, relative):
+    """ The relative change from 0 is infinite, so that resamples with an old median of 0 still rank. """
+    if not relative:
+        return new - old
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(old != 0, (new - old) / np.abs(old), np.where(new == old, 0.0, np.sign(new) * np.inf))
+
+
+def median_pairs(nrepeats, nresamples, rng):
+    """
+    Resample nrepeats indices nresamples times and return the distinct pairs (i, j) of order
+    statistics whose mean is the median of a resample, as index arrays, with their frequencies.
+    """
+    idx = np.sort(rng.integers(0, nrepeats, size=(nresamples, nrepeats)), axis=1)
+    half = nrepeats // 2
+    lower = idx[:, half - 1] if nrepeats % 2 == 0 else idx[:, half]
+    upper = idx[:, half]
+    pairs, counts = np.unique(lower * nrepeats + upper, return_counts=True)
+    return pairs // nrepeats, pairs % nrepeats, counts / nresamples
+
+
+def _weighted_quantiles(values, weights, quantiles):
+    """ values: (configs, K), weights: (K,) summing to 1. Returns (len(quantiles), configs). """
+    order = np.argsort(values, axis=1)
+    cum = np.cumsum(weights[order], axis=1)
+    sorted_values = np.take_along_axis(values, order, axis=1)
+    out = []
+    for q in quantiles:
+        pos = np.minimum((cum < q - 1e-12).sum(axis=1), values.shape[1] - 1)
+        out.append(sorted_values[np.arange(len(values)), pos])
+    return out
+
+
+def bootstrap_change(old, new, relative=True, nresamples=DEFAULT_RESAMPLES, alpha=DEFAULT_ALPHA, rng=None):
+    """
+    :param old: List of 1-D arrays, the repeats of every configuration in the old campaign.
+    :param new: Same for the new campaign.
+    :param relative: Whether the change is relative to the old median.
+    :return: (change, low, high) arrays. The interval is NaN for configurations with fewer than
+        two repeats on either side.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    n = len(old)
+    change = np.full(n, np.nan)
+    low = np.full(n, np.nan)
+    high = np.full(n, np.nan)
+    batches = collections.defaultdict(list)
+    for i, (a, b) in enumerate(zip(old, new)):
+        if len(a) and len(b):
+            change[i] = _change(np.median(a), np.median(b), relative)
+        if len(a) >= 2 and len(b) >= 2:
+            batches[(len(a), len(b))].append(i)
+    pairs = dict()
+    for (na, nb), members in batches.items():
+        for nrepeats in (na, nb):
+            if nrepeats not in pairs:
+                pairs[nrepeats] = median_pairs(nrepeats, nresamples, rng)
+        ia, ja, wa = pairs[na]
+        ib, jb, wb = pairs[nb]
+        weights = np.outer(wa, wb).ravel()
+        step = max(1, MAX_BATCH_VALUES // len(weights))
+        for start in range(0, len(members), step):
+            chunk = members[start:start + step]
+            a = np.sort(np.array([old[i] for i in chunk]), axis=1)
+            b = np.sort(np.array([new[i] for i in chunk]), axis=1)
+            medians_a = (a[:, ia] + a[:, ja]) / 2
+            medians_b = (b[:, ib] + b[:, jb]) / 2
+            changes = _change(medians_a[:, :, None], medians_b[:, None, :], relative).reshape(len(chunk), -1)
+            low[chunk], high[chunk] = _weighted_quantiles(changes, weights, (alpha / 2, 1 - alpha / 2))
+    return change, low, high
+
+
+def _values(repeats, name):
+    values = np.array([m[name] for m in repeats], dtype=np.float64)
+    return values[~np.isnan(values)]
+
+
+def classify(change, low, high, better, min_change=0.0):
+    """ "regression", "improvement" or "" for every configuration. """
+    significant = ((low > 0) | (high < 0)) & (np.abs(change) >= min_change)
+    signed = np.sign(change) * better
+    return np.where(significant & (signed < 0), 'regression', np.where(significant & (signed > 0), 'improvement', ''))
+
+
+def compare(runs_old, runs_new, nresamples=DEFAULT_RESAMPLES, alpha=DEFAULT_ALPHA, min_change=0.0, seed=None):
+    """
+    :param runs_old: List of (catalog entry, metrics) of the old campaign.
+    :param runs_new: Same for the new campaign.
+    :return: List of OrderedDicts, one per configuration and metric present in both campaigns.
+    """
+    old_groups = group_runs(runs_old)
+    new_groups = group_runs(runs_new)
+    keys = [k for k in old_groups if k in new_groups]
+    rng = np.random.default_rng(seed)
+    rows = []
+    for name, better, relative in METRICS:
+        old = [_values(old_groups[k], name) for k in keys]
+        new = [_values(new_groups[k], name) for k in keys]
+        change, low, high = bootstrap_change(old, new, relative, nresamples, alpha, rng)
+        verdicts = classify(change, low, high, better, min_change)
+        for i, key in enumerate(keys):
+            if len(old[i]) == 0 or len(new[i]) == 0:
+                continue
+            row = collections.OrderedDict(zip(scaling.CURVE_KEYS + ('nc', 'nd'), key))
+            row['metric'] = name
+            row['old_repeats'] = len(old[i])
+            row['new_repeats'] = len(new[i])
+            row['old_median'] = float(np.median(old[i]))
+            row['new_median'] = float(np.median(new[i]))
+            row['relative'] = relative
+            row['change'] = float(change[i])
+            row['ci_low'] = float(low[i])
+            row['ci_high'] = float(high[i])
+            row['verdict'] = str(verdicts[i])
+            rows.append(row)
+    return rows
+
+
+def sort_rows(rows):
+    """ Regressions first, then improvements, each by the size of the change; the rest last. """
+    order = {'regression': 0, 'improvement': 1, '': 2}
+    return sorted(rows, key=lambda r: (order[r['verdict']],
+                                       -abs(r['change']) if not math.isnan(r['change']) else 0.0))
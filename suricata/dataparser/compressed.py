@@ -0,0 +1,119 @@
+"""
+Transparent reading of compressed run files.
+
+The test compresses the resmon outputs on the fly and the Suricata logs after the run, so a run
+file "<name>" may be stored as "<name>", "<name>.gz" or "<name>.zst". Parsers keep using the
+uncompressed name: find() returns whichever file exists, and open_binary() and open_text()
+decompress it as a stream while it is parsed, so there is no separate decompression pass.
+
+zstd files are read with the zstandard module if it is installed, else through "zstd -dc".
+A gzip stream without end-of-stream marker, e.g. of a monitor that got killed, ends at the last
+complete block instead of raising.
+"""
+
+import glob as _glob
+import gzip
+import io
+import os
+import subprocess
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Suffixes of the compressed files, in the order they are looked for after the plain file.
+SUFFIXES = ('.gz', '.zst')
+
+
+def find(path):
+    """ Return the path of the plain or compressed file stored for path, or None if there is none. """
+    for candidate in (path,) + tuple(path + s for s in SUFFIXES):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def exists(path):
+    return find(path) is not None
+
+
+def strip_suffix(path):
+    for suffix in SUFFIXES:
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def glob(pattern):
+    """ Like glob.glob, but also match compressed files. Returns the uncompressed names, sorted. """
+    paths = set(_glob.glob(pattern))
+    for suffix in SUFFIXES:
+        paths.update(strip_suffix(p) for p in _glob.glob(pattern + suffix))
+    return sorted(paths)
+
+
+class _TruncatedGzipReader(io.RawIOBase):
+
+    def __init__(self, path):
+        self._f = gzip.open(path, 'rb')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        try:
+            data = self._f.read1(len(b))
+        except EOFError:
+            return 0
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+        super().close()
+
+
+class _ProcessReader(io.RawIOBase):
+    """ Reads the stdout of a decompressor process. """
+
+    def __init__(self, cmd):
+        self._proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self._proc.stdout.readinto(b)
+
+    def close(self):
+        if not self.closed:
+            self._proc.stdout.close()
+            self._proc.wait()
+        super().close()
+
+
+def open_binary(path):
+    """ Open the file stored for path for reading bytes. Raises FileNotFoundError if there is none. """
+    found = find(path)
+    if found is None:
+        raise FileNotFoundError('File "%s" does not exist.' % path)
+    if found.endswith('.gz'):
+        return io.BufferedReader(_TruncatedGzipReader(found))
+    if found.endswith('.zst'):
+        if zstandard is not None:
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(found, 'rb'), closefd=True))
+        return io.BufferedReader(_ProcessReader(['zstd', '-dcq', found]))
+    return open(found, 'rb')
+
+
+def open_text(path, newline=None):
+    """ Open the file stored for path for reading UTF-8 text. """
+    return io.TextIOWrapper(open_binary(path), encoding='utf-8', newline=newline)
+
+
+def is_compressed(path):
+    found = find(path)
+    return found is not None and found != path
@@ -0,0 +1,60 @@
+"""
+Parser of the Suricata counters polled by tools/suricounters.py.
+
+The counters are stored as binary rows in "<prefix>.bin", described by the segments of
+"<prefix>.json". Each segment starts at a byte offset and lists the columns of its rows.
+The .bin file may be compressed after the run, see compressed.
+"""
+
+import array
+import collections
+import json
+import os
+import struct
+
+from . import compressed
+from . import exceptions
+
+
+class CounterParser:
+
+    def __init__(self):
+        pass
+
+    def parse(self, path):
+        """
+        Parse the counters. path is either the .json header or the .bin file.
+        Returns an OrderedDict mapping column name to an array.array of its values, "Timestamp"
+        first. Rows of an earlier segment get -1 for the columns added by a later one.
+        """
+        prefix = os.path.splitext(path)[0]
+        with open(prefix + '.json', 'r') as f:
+            header = json.load(f)
+        segments = header['segments']
+        if len(segments) == 0:
+            raise exceptions.NoContentException('File "%s" has no counter sample.' % path)
+        columns = collections.OrderedDict()
+        columns['Timestamp'] = array.array('d')
+        for name in segments[-1]['columns'][1:]:
+            columns[name] = array.array('q')
+        with compressed.open_binary(prefix + '.bin') as f:
+            data = f.read()
+        nrows = 0
+        for i, seg in enumerate(segments):
+            end = segments[i + 1]['offset'] if i + 1 < len(segments) else len(data)
+            row_struct = struct.Struct('<d%dq' % (len(seg['columns']) - 1))
+            # Ignore a row cut short by an unclean stop.
+            end -= (end - seg['offset']) % row_struct.size
+            seg_cols = list(zip(*row_struct.iter_unpack(data[seg['offset']:end])))
+            if len(seg_cols) == 0:
+                continue
+            seg_nrows = len(seg_cols[0])
+            for name, values in zip(seg['columns'], seg_cols):
+                columns[name].extend(values)
+            for name, values in columns.items():
+                if len(values) < nrows + seg_nrows:
+                    values.extend([-1] * (nrows + seg_nrows - len(values)))
+            nrows += seg_nrows
+        if nrows == 0:
+            raise exceptions.NoContentException('File "%s" has no counter sample.' % path)
+        return columns
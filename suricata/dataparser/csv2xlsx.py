@@ -4,16 +4,23 @@ Parser of a generic csv.
 @author Xiangyu Bu <bu1@purdue.edu>
 """
 
+import collections
 import csv
+import os
 import threading
 
-import xlsxwriter
+import numpy as np
 
-from . import excelhelper
+from . import align
+from . import compressed
 from . import exceptions
+from . import summary
 
 
 class BaseCsvCollection:
+
+    # Column to align the runs on. resmon counts it in seconds since the monitor started.
+    ALIGN_KEY = 'Uptime'
     
     def __init__(self, name, suffix):
         self._lock = threading.Lock()
@@ -22,7 +29,7 @@ class BaseCsvCollection:
         self.all_data = dict()
         print('Created new netstat collection: "%s"' % name)
 
-    def get_key(self, engine, ts, trace, nworker, args):
+    def get_key(self, conf, trace_file, runmode, ninstances, nnics, i, ts):
         return ts
 
     def add(self, key, data):
@@ -30,51 +37,57 @@ class BaseCsvCollection:
         self.all_data[key] = data
         self._lock.release()
 
-    def to_xlsx(self):
-        with open('%s,%s.log' % (self.name, self.suffix), 'w') as f:
-            print('Sample size: %d' % len(self.all_data), file=f)
-            workbook = xlsxwriter.Workbook('%s,%s.xlsx' % (self.name, self.suffix), {'strings_to_numbers': True})
-            summary_sheet = workbook.add_worksheet('Summary')
-            sheet_names = []
-            max_rowcount = 0
-            max_colcount = 0
-            for key in sorted(self.all_data.keys()):
-                sheet_name = str(key)
-                data = self.all_data[key]
-                sheet = workbook.add_worksheet(sheet_name)
-                sheet_names.append(sheet_name)
-                print('Sheet name: %s' % sheet_name, file=f)
-                print('  Records: %d' % len(data), file=f)
-                if max_rowcount < len(data):
-                    max_rowcount = len(data)
-                for rowid, row in enumerate(data):
-                    if max_colcount < len(row):
-                        max_colcount = len(row)
-                    for colid, col in enumerate(row):
-                        sheet.write(rowid, colid, col)
-            for i in range(max_colcount):
-                summary_sheet.write(0, i, '=%s!%s' % (sheet_names[0], excelhelper.excel_style(1, i+1)))
-                # summary_sheet.set_column('{0}:{0}'.format(chr(ord('A') + i)), 10)
-            for i in range(1, max_rowcount+1):
-                for j in range(max_colcount):
-                    related_cells = []
-                    for s in sheet_names:
-                        related_cells.append('%s!%s' % (s, excelhelper.excel_style(i+1, j+1)))
-                    # print(related_cells)
-                    summary_sheet.write(i, j, '=MEDIAN(%s)' % ','.join(related_cells))
-            workbook.close()
-        print('Saved "%s,%s.xlsx"' % (self.name, self.suffix))
+    def to_xlsx(self, percentiles=(), formulas=False, constant_memory=None, align_opts=align.DEFAULT_OPTIONS,
+                output_dir='.'):
+        """ align_opts is an align.AlignOptions, or None to align the runs by row index. """
+        basename = os.path.join(output_dir, '%s,%s' % (self.name, self.suffix))
+        aligner = align.Aligner(self.ALIGN_KEY, *align_opts) if align_opts is not None else None
+        with open(basename + '.log', 'w') as f:
+            summary.write_workbook(basename, self.all_data, f, percentiles, formulas, constant_memory,
+                                   aligner=aligner)
+        print('Saved "%s.xlsx"' % basename)
+
+
+def typed_array(values):
+    """ Convert a sequence of strings to an int64 array, or a float64 one, or else a str one. """
+    for dtype in (np.int64, np.float64):
+        try:
+            return np.array(values, dtype=dtype)
+        except ValueError:
+            pass
+    return np.array(values, dtype=np.str_)
 
 
 class BaseCsvParser:
+
+    # Version of the parsed data. Bump it when the output changes to invalidate cached results.
+    VERSION = 2
     
     def __init__(self):
         pass
 
     def parse(self, path):
-        """ CSV file is assumed to have header. """
+        """
+        CSV file is assumed to have header. Returns an OrderedDict mapping every column name of the
+        header to a NumPy array of its values, typed as int64, float64 or str.
+        """
+        with compressed.open_text(path, newline='') as f:
+            # resmon pads the separators, e.g. "Timestamp,  Uptime, NCPU".
+            reader = csv.reader(f, skipinitialspace=True)
+            try:
+                header = next(reader)
+            except StopIteration:
+                raise exceptions.NoContentException('File "%s" is empty.' % path)
+            # Skip rows of a different width, e.g. the last one of a monitor that got killed.
+            rows = [row for row in reader if len(row) == len(header)]
+        if len(rows) == 0:
+            return collections.OrderedDict((name, np.empty(0, dtype=np.float64)) for name in header)
+        return collections.OrderedDict((name, typed_array(values)) for name, values in zip(header, zip(*rows)))
+
+    def parse_rows(self, path):
+        """ Return the rows, header first, as lists of strings. """
         data = []
-        with open(path, 'rU') as f:
+        with compressed.open_text(path, newline='') as f:
             reader = csv.reader(f)
             try:
                 data.append(next(reader))
@@ -0,0 +1,199 @@
+"""
+Attribution of packet loss to the stages between the sender and Suricata.
+
+  wire       sent by the sender but never counted by the receiver NIC
+  nic        dropped or errored by the receiver NIC (netstat drop.in / err.in)
+  capture    received by the NIC but never seen by the AF_PACKET sockets of Suricata
+  kernel     dropped by the AF_PACKET rings (capture.kernel_drops)
+  suricata   delivered to Suricata but not decoded (capture.kernel_packets - kernel_drops - decoder.pkts)
+
+The counters are taken from the joined series of the run (see join), so the budget can be split
+into time windows. The total number of packets sent comes from the logs of tcpreplay or the JSON
+of the UDP iperf clients if the run has them, and from the sender NIC monitor otherwise.
+
+The counters start at different times, e.g. the NIC counters when resmon starts and the eve
+counters at the first stats record, and end at different times, so they are compared over the
+span they all have samples in. All counters count from 0 (the NIC monitors report the packets of
+every interval, which join sums up), so the budget of the whole run is the value of every counter
+at the end of that span. A window takes the difference of every counter over the part of the
+window all counters have samples in. The number of packets the generators report is kept as
+sent_reported and used as sent if the span reaches the end of every counter.
+"""
+
+import collections
+import math
+import os
+import re
+
+import numpy as np
+
+from . import compressed
+from . import iperf
+from . import join
+
+
+STAGES = ('wire', 'nic', 'capture', 'kernel', 'suricata')
+
+# Counters of the budget, in the order packets pass them.
+COUNTERS = ('sent', 'nic_rx', 'nic_drop', 'nic_err', 'kernel_packets', 'kernel_drops', 'decoder')
+
+# tcpreplay prints e.g. "Actual: 568809 packets (629148324 bytes) sent in 30.02 seconds".
+_TCPREPLAY_ACTUAL_RE = re.compile(r'Actual:\s+(\d+)\s+packets\s+\((\d+)\s+bytes\)')
+
+
+def parse_tcpreplay_log(path):
+    """ Return (packets, bytes) sent as reported by tcpreplay, or None if the log has no report. """
+    with compressed.open_text(path) as f:
+        m = _TCPREPLAY_ACTUAL_RE.search(f.read())
+    return (int(m.group(1)), int(m.group(2))) if m is not None else None
+
+
+def sent_packets(dirpath):
+    """ Packets the traffic generators report to have sent, or None if they do not report it. """
+    total = None
+    for path in compressed.glob(os.path.join(dirpath, 'tcpreplay_*.log')):
+        sent = parse_tcpreplay_log(path)
+        if sent is not None:
+            total = (total or 0) + sent[0]
+    # TCP clients do not count packets.
+    packets = iperf.totals(iperf.load_run(dirpath))['client.packets']
+    if not math.isnan(packets):
+        total = (total or 0) + packets
+    return total
+
+
+def _sum_columns(table, prefix, suffix):
+    names = [n for n in table.keys() if n.startswith(prefix) and n.endswith(suffix)]
+    if len(names) == 0:
+        return None
+    return sum(table[n] for n in names)
+
+
+def _first_column(table, names):
+    for name in names:
+        if name in table:
+            return table[name]
+    return None
+
+
+def counter_series(table):
+    """ The cumulative counters of the budget on the grid of the joined table, None if missing. """
+    return collections.OrderedDict([
+        ('sent', _sum_columns(table, 'sender.net.', '.sent.pkts')),
+        ('nic_rx', _sum_columns(table, 'net.', '.recv.pkts')),
+        ('nic_drop', _sum_columns(table, 'net.', '.drop.in')),
+        ('nic_err', _sum_columns(table, 'net.', '.err.in')),
+        # The counters polled over the socket have the finer resolution.
+        ('kernel_packets', _first_column(table, ('ctr.capture.kernel_packets', 'eve.capture.kernel_packets'))),
+        ('kernel_drops', _first_column(table, ('ctr.capture.kernel_drops', 'eve.capture.kernel_drops'))),
+        ('decoder', _first_column(table, ('ctr.decoder.pkts', 'eve.decoder.pkts'))),
+    ])
+
+
+def budget(counts):
+    """
+    :param counts: Counter name -> number of packets over a period, NaN if unknown.
+    :return: OrderedDict of the loss of every stage, NaN if its counters are unknown. A negative
+        loss means a later stage counted more packets, e.g. other traffic on the NIC or counters
+        sampled at slightly different times; it is left as is.
+    """
+    c = collections.defaultdict(lambda: math.nan, counts)
+    nic_seen = c['nic_rx'] + c['nic_drop'] + c['nic_err']
+    # Without NIC counters, packets lost on the wire and by the NIC cannot be told apart from
+    # packets the capture missed.
+    return collections.OrderedDict([
+        ('wire', c['sent'] - nic_seen),
+        ('nic', c['nic_drop'] + c['nic_err']),
+        ('capture', c['nic_rx'] - c['kernel_packets']),
+        ('kernel', c['kernel_drops']),
+        ('suricata', c['kernel_packets'] - c['kernel_drops'] - c['decoder']),
+    ])
+
+
+def dominant_stage(losses):
+    """ The stage with the most lost packets, or None if no stage lost any. """
+    known = [(v, s) for s, v in losses.items() if not math.isnan(v) and v > 0]
+    return max(known)[1] if known else None
+
+
+def shared_span(series, start, end):
+    """
+    The first and last grid points between start and end where all counters have samples, or None.
+    The counters start at different times, e.g. the NIC counters when resmon starts and the eve
+    counters at the first stats record, so they are compared over the span they all cover.
+    Counters with no sample between start and end are left out.
+    """
+    first, last = start, end
+    for values in series.values():
+        if values is None:
+            continue
+        valid = np.flatnonzero(~np.isnan(values[start:end + 1]))
+        if len(valid):
+            first = max(first, start + int(valid[0]))
+            last = min(last, start + int(valid[-1]))
+    return (first, last) if last > first else None
+
+
+def _delta(series, span):
+    """ Difference of a cumulative series over the span. """
+    if series is None or span is None:
+        return math.nan
+    return float(series[span[1]] - series[span[0]])
+
+
+def _value(series, i):
+    return float(series[i]) if series is not None else math.nan
+
+
+def _last_sample(series):
+    valid = np.flatnonzero(~np.isnan(series))
+    return int(valid[-1]) if len(valid) else -1
+
+
+def attribute_table(table, sent=None, window_sec=10.0):
+    """
+    :param table: Joined table of the run, see join.join_run.
+    :param sent: Packets the traffic generators report to have sent, or None.
+    :return: (total, windows). total is an OrderedDict of the counters, the loss of every stage,
+        the loss ratio of the packets sent and the dominant stage over the whole run; windows a list
+        of the same for consecutive windows of window_sec, with their start and end.
+    """
+    series = counter_series(table)
+    grid = table['Timestamp']
+
+    def row(start, end, counts):
+        losses = budget(counts)
+        out = collections.OrderedDict([('start', float(grid[start])), ('end', float(grid[end]))])
+        out.update(counts)
+        out.update(('loss.' + s, v) for s, v in losses.items())
+        total_loss = sum(v for v in losses.values() if not math.isnan(v) and v > 0)
+        out['loss_ratio'] = total_loss / counts['sent'] if counts['sent'] > 0 else math.nan
+        out['dominant'] = dominant_stage(losses)
+        return out
+
+    # The counters count from 0, so the total runs from the start to the end of the shared span.
+    span = shared_span(series, 0, len(grid) - 1)
+    end = span[1] if span is not None else len(grid) - 1
+    counts = collections.OrderedDict((name, _value(s, end) if span is not None else math.nan)
+                                     for name, s in series.items())
+    # What the generators report covers the whole run, so it is only comparable if the span reaches
+    # the last sample of every counter. Otherwise the sender NIC counter at the end of the span is used.
+    if sent is not None and span is not None and \
+            all(_last_sample(s) == end for s in series.values() if s is not None):
+        counts['sent'] = float(sent)
+    total = row(0, end, counts)
+    total['sent_reported'] = float(sent) if sent is not None else math.nan
+    windows = []
+    bounds = np.searchsorted(grid, np.arange(grid[0], grid[-1], window_sec))
+    bounds = list(bounds) + [len(grid) - 1]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        span = shared_span(series, start, end)
+        if span is not None:
+            windows.append(row(span[0], span[1],
+                               collections.OrderedDict((name, _delta(s, span)) for name, s in series.items())))
+    return total, windows
+
+
+def attribute(dirpath, window_sec=10.0, step=None):
+    """ Attribute the loss of the run in dirpath, see attribute_table. """
+    return attribute_table(join.join_run(dirpath, step), sent_packets(dirpath), window_sec)
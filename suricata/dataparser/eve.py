@@ -4,18 +4,32 @@ Parser of Suricata eve.json.
 It assumes eve.json contains only one run of Suricata. That is, the recorded uptime
 increases as the file progresses.
 
+With alert and flow logging on, stats records are a tiny fraction of eve.json. EveStatsExtractor
+memory-maps the file and jumps between occurrences of '"event_type":"stats"' with a byte search,
+so only the stats records are decoded. The file can be split into byte ranges for parallel workers.
+A compressed eve.json cannot be mapped, so it is decompressed as a stream and only the lines with
+the marker are decoded.
+
 @author Xiangyu Bu <bu1@purdue.edu>
 """
 
+import collections
+import concurrent.futures
 import json
+import mmap
+import os
 import threading
 
-import xlsxwriter
+import numpy as np
 
-from . import excelhelper
+from . import align
+from . import compressed
 from . import exceptions
+from . import statschema
+from . import summary
 
 
+# Columns extracted by default. See statschema for the format.
 EVE_STRUCTURE = {
     "uptime": "key",
     "capture": {
@@ -34,13 +48,16 @@ EVE_STRUCTURE = {
 
 class EveCollection:
 
+    # Field to align the runs on, in seconds since Suricata started.
+    ALIGN_KEY = 'uptime'
+
     def __init__(self, name):
         self._lock = threading.Lock()
         self.name = name
         self.all_data = dict()
         print('Created new eve collection: "%s"' % name)
 
-    def get_key(self, engine, ts, trace, nworker, args):
+    def get_key(self, conf, trace_file, runmode, ninstances, nnics, i, ts):
         return ts
 
     def add(self, key, data):
@@ -48,70 +65,161 @@ class EveCollection:
         self.all_data[key] = data
         self._lock.release()
 
-    def to_xlsx(self):
-        # TODO: Parse this from STRUCTURE.
-        sheet_header = ['uptime', 'capture.kernel_packets', 'capture.kernel_drops', 'decoder.pkts', 'decoder.bytes', 'detect.alert']
-        max_rowcount = 0
-        max_colcount = len(sheet_header)
-        with open('%s,eve.log' % self.name, 'w') as f:
-            print('Sample size: %d' % len(self.all_data), file=f)
-            workbook = xlsxwriter.Workbook('%s,eve.xlsx' % self.name, {'strings_to_numbers': True})
-            summary_sheet = workbook.add_worksheet('Summary')
-            sheet_names = []
-            for eve_id in sorted(self.all_data.keys()):
-                sheet_name = str(eve_id)
-                sheet_names.append(sheet_name)
-                eve_sheet = workbook.add_worksheet(sheet_name)
-                eve_data = self.all_data[eve_id]
-                for i, column_name in enumerate(sheet_header):
-                    eve_sheet.write(0, i, column_name)
-                    eve_sheet.set_column('{0}:{0}'.format(chr(ord('A') + i)), 15)
-                print('Sheet name: %s' % eve_id, file=f)
-                print('  Records: %d' % len(eve_data.keys()), file=f)
-                if max_rowcount < len(eve_data):
-                    max_rowcount = len(eve_data)
-                for row, uptime in enumerate(sorted(eve_data.keys())):
-                    eve_sheet.write(row+1, 0, uptime)
-                    for col, column_name in enumerate(sheet_header[1:]):
-                        eve_sheet.write(row+1, col+1, eve_data[uptime][column_name])
-            for i, column_name in enumerate(sheet_header):
-                summary_sheet.write(0, i, column_name)
-                summary_sheet.set_column('{0}:{0}'.format(chr(ord('A') + i)), 15)
-            for i in range(1, max_rowcount+1):
-                for j in range(max_colcount):
-                    related_cells = []
-                    for s in sheet_names:
-                        related_cells.append('%s!%s' % (s, excelhelper.excel_style(i+1, j+1)))
-                    # print(related_cells)
-                    summary_sheet.write(i, j, '=INT(MEDIAN(%s))' % ','.join(related_cells))
-            workbook.close()
-        print('Saved "%s,eve.xlsx"' % self.name)
-
-class EveParser:
+    def to_xlsx(self, percentiles=(), formulas=False, constant_memory=None, align_opts=align.DEFAULT_OPTIONS,
+                output_dir='.'):
+        """ align_opts is an align.AlignOptions, or None to align the runs by row index. """
+        basename = os.path.join(output_dir, '%s,eve' % self.name)
+        with open(basename + '.log', 'w') as f:
+            summary.write_workbook(basename, self.all_data, f, percentiles, formulas, constant_memory,
+                                   integer=True, column_width=15,
+                                   aligner=align.Aligner(self.ALIGN_KEY, *align_opts) if align_opts is not None else None)
+        print('Saved "%s.xlsx"' % basename)
+
+
+# Suricata writes compact JSON, so a stats record always contains this byte string.
+STATS_MARKER = b'"event_type":"stats"'
+
+# The stats records of eve.json, extracted on the receiver by tools/reducerun.py. Same line format.
+STATS_FILE = 'eve.stats.json'
+
+
+def find_eve_file(dirpath):
+    """ Path of the stats-only eve file of the run directory if there is one, else of eve.json. """
+    path = os.path.join(dirpath, STATS_FILE)
+    return path if compressed.exists(path) else os.path.join(dirpath, 'eve.json')
+
+
+def _extract_stats_range(path, start, end, with_timestamp=False):
+    """ Decode the stats records whose marker starts in [start, end) of the file. """
+    records = []
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            # A marker that starts in the range may end past it.
+            search_end = min(end + len(STATS_MARKER) - 1, len(m))
+            pos = m.find(STATS_MARKER, start, search_end)
+            while pos != -1:
+                line_start = m.rfind(b'\n', 0, pos) + 1
+                line_end = m.find(b'\n', pos)
+                if line_end == -1:
+                    line_end = len(m)
+                ev = json.loads(m[line_start:line_end].decode('utf-8'))
+                # The marker may be quoted inside another record, e.g. in an alert payload.
+                if ev.get('event_type') == 'stats':
+                    records.append((ev.get('timestamp'), ev['stats']) if with_timestamp else ev['stats'])
+                pos = m.find(STATS_MARKER, line_end, search_end)
+    return records
+
+
+def _extract_stats_stream(path, with_timestamp=False):
+    """ Decode the stats records of a compressed file line by line. """
+    records = []
+    with compressed.open_binary(path) as f:
+        for line in f:
+            if STATS_MARKER in line:
+                ev = json.loads(line.decode('utf-8'))
+                if ev.get('event_type') == 'stats':
+                    records.append((ev.get('timestamp'), ev['stats']) if with_timestamp else ev['stats'])
+    return records
+
+
+class EveStatsExtractor:
+
+    def __init__(self, workers=1):
+        self.workers = workers
+
+    def split(self, path, nparts):
+        """ Split the file into nparts byte ranges. A record belongs to the range its marker starts in. """
+        size = os.path.getsize(path)
+        step = max(size // nparts, 1)
+        bounds = list(range(0, size, step))[:nparts] + [size]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def extract(self, path, with_timestamp=False):
+        """
+        Return the "stats" objects of all stats records of the eve.json file, in file order.
+        If with_timestamp is True, return (timestamp string or None, stats) tuples instead.
+        """
+        if compressed.is_compressed(path):
+            return _extract_stats_stream(path, with_timestamp)
+        if os.path.getsize(path) == 0:
+            return []
+        ranges = self.split(path, self.workers)
+        if len(ranges) == 1:
+            return _extract_stats_range(path, *ranges[0], with_timestamp)
+        records = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+            for part in executor.map(_extract_stats_range, [path] * len(ranges),
+                                     [r[0] for r in ranges], [r[1] for r in ranges],
+                                     [with_timestamp] * len(ranges)):
+                records.extend(part)
+        return records
+
+
+def _typed_array(values):
+    """ int64 array if every value is integral, else float64 with NaN for missing values. """
+    floats = np.array(values, dtype=np.float64)
+    if len(floats) and not np.isnan(floats).any() and np.all(floats == np.floor(floats)) \
+            and np.abs(floats).max() < 2 ** 53:
+        return np.array(values, dtype=np.int64)
+    return floats
 
-    def __init__(self):
-        pass
 
-    def parse_stat(self, d):
-        data_key = None
-        data_value = dict()
-        for key, role in EVE_STRUCTURE.items():
-            if role == 'key':
-                data_key = d[key]
-            elif isinstance(role, dict):
-                for subkey, subrole in role.items():
-                    data_value['%s.%s' % (key, subkey)] = d[key][subkey]
-        return data_key, data_value
+class EveParser:
 
-    def parse(self, eve_path):
-        data = dict()
-        with open(eve_path, 'r') as f:
+    # Version of the parsed data. Bump it when the output changes to invalidate cached results.
+    VERSION = 2
+
+    def __init__(self, use_mmap=True, workers=1, schema=EVE_STRUCTURE):
+        """
+        :param schema: Schema of the columns to extract, see statschema. EVE_STRUCTURE by default,
+            statschema.ALL_NUMERIC for every counter including the per-thread ones.
+        """
+        self.use_mmap = use_mmap
+        self.extractor = EveStatsExtractor(workers)
+        self.schema = schema
+
+    @property
+    def variant(self):
+        """ Distinguishes cached results of different schemas. """
+        if self.schema is EVE_STRUCTURE:
+            return ''
+        return ':' + (self.schema if isinstance(self.schema, str) else json.dumps(self.schema, sort_keys=True))
+
+    def iter_lines(self, eve_path):
+        """ Yield the stats objects by reading eve.json line by line. """
+        with compressed.open_text(eve_path) as f:
             for line in f:
                 if 'stats' in line:
                     ev = json.loads(line)
                     if ev['event_type'] == 'stats':
-                        key, val = self.parse_stat(ev['stats'])
-                        data[key] = val
-        if len(data) == 0:
+                        yield ev['stats']
+
+    def parse_records(self, records):
+        """
+        Flatten stats objects into an OrderedDict of the key column (uptime) followed by the
+        columns of the schema, each an array ordered by uptime. A later record with the same
+        uptime replaces an earlier one. Columns that first appear in a later record are NaN
+        before it.
+        """
+        compiled = None
+        rows = dict()
+        for stats in records:
+            compiled = statschema.CompiledSchema(self.schema, stats) if compiled is None else compiled.extend(stats)
+            rows[compiled.key(stats)] = compiled.row(stats)
+        if compiled is None:
+            return None
+        keys = sorted(rows.keys())
+        width = len(compiled.columns)
+        padding = (None,) * width
+        matrix = zip(*[rows[k] + padding[len(rows[k]):] for k in keys])
+        columns = collections.OrderedDict([(compiled.key_name, np.array(keys))])
+        for name, values in zip(compiled.columns, matrix):
+            columns[name] = _typed_array(values)
+        return columns
+
+    def parse(self, eve_path):
+        records = self.extractor.extract(eve_path) if self.use_mmap else self.iter_lines(eve_path)
+        data = self.parse_records(records)
+        if data is None:
             raise exceptions.NoContentException('File "%s" has no stat record.' % eve_path)
         return data
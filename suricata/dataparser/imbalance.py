@@ -0,0 +1,142 @@
+"""
+Per-core utilization imbalance of the receiver.
+
+resmon samples the utilization of every core as the "%CPU<n>" columns of sysstat.receiver.csv.
+For every run, the utilization of every core is averaged over the steady window of the run (see
+scaling.steady_mask), along with the fraction of its samples at or above the saturation threshold.
+The cores of all runs are then stacked into one matrix, padded with NaN for runs with fewer
+cores, and the imbalance metrics are computed over it at once:
+
+  max_mean   utilization of the busiest core over the mean of all cores (1 if even)
+  cv         coefficient of variation (stdev / mean) across the cores
+  gini       Gini coefficient across the cores (0 if even, 1 - 1/n if one core takes all)
+
+A core is saturated if it is at or above the threshold in at least half of the steady samples.
+Saturated cores are matched with the CPU sets the run bound its capture and worker threads to,
+from the manifest of the run or else the NIC layout applied by the test.
+"""
+
+import collections
+import json
+import os
+import re
+
+import numpy as np
+
+from . import catalog
+from . import join
+from . import scaling
+
+
+NIC_LAYOUT_FILE = 'nic_layout.json'
+
+# Utilization, in %, at or above which a core sample counts as saturated.
+DEFAULT_SATURATION = 95.0
+
+# Fraction of the steady samples a core must be saturated in to count as saturated.
+SATURATED_FRACTION = 0.5
+
+CORE_SETS = ('capture', 'worker')
+
+_CORE_COLUMN_RE = re.compile(r'^sys\.%CPU(\d+)$')
+
+
+def core_columns(table):
+    """ Return [(core id, column name), ...] of the per-core utilization columns, by core id. """
+    cores = []
+    for name in table.keys():
+        m = _CORE_COLUMN_RE.match(name)
+        if m is not None:
+            cores.append((int(m.group(1)), name))
+    return sorted(cores)
+
+
+def load_core_sets(dirpath):
+    """
+    Return OrderedDict of "capture" and "worker" to the list of CPUs the threads were bound to,
+    empty if the run did not bind them.
+    """
+    sets = collections.OrderedDict((name, []) for name in CORE_SETS)
+    path = os.path.join(dirpath, catalog.MANIFEST_FILE)
+    if os.path.isfile(path):
+        with open(path, 'r') as f:
+            testcase = json.load(f).get('testcase', {})
+        for name in CORE_SETS:
+            sets[name] = [int(c) for c in testcase.get(name + '_cpus') or ()]
+    path = os.path.join(dirpath, NIC_LAYOUT_FILE)
+    if len(sets['capture']) == 0 and os.path.isfile(path):
+        with open(path, 'r') as f:
+            nics = json.load(f).get('nics', {})
+        cpus = [c for layout in nics.values() for c in layout.get('capture_cpus', ())]
+        sets['capture'] = sorted(set(cpus))
+    return sets
+
+
+def core_utilization(dirpath, step=None, saturation=DEFAULT_SATURATION):
+    """
+    :return: (core ids, mean utilization of every core over the steady window, fraction of the
+        steady samples every core is saturated in) as arrays, empty if the run has no per-core column.
+    """
+    table = join.join_run(dirpath, step)
+    cores = core_columns(table)
+    if len(cores) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    mask = scaling.steady_mask(dirpath, table)
+    matrix = np.vstack([table[name][mask] for _, name in cores])
+    valid = ~np.isnan(matrix)
+    nvalid = valid.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(nvalid > 0, np.nansum(matrix, axis=1) / nvalid, np.nan)
+        saturated = np.where(nvalid > 0, ((matrix >= saturation) & valid).sum(axis=1) / nvalid, np.nan)
+    return np.array([c for c, _ in cores], dtype=np.int64), mean, saturated
+
+
+def stack(rows):
+    """ Stack arrays of different lengths into a matrix with one row per array, padded with NaN. """
+    matrix = np.full((len(rows), max([len(r) for r in rows] + [0])), np.nan)
+    for i, r in enumerate(rows):
+        matrix[i, :len(r)] = r
+    return matrix
+
+
+def metrics(utilization):
+    """
+    :param utilization: (runs, cores) matrix of the mean utilization of every core, NaN padded.
+    :return: OrderedDict of metric name to an array with one value per run.
+    """
+    valid = ~np.isnan(utilization)
+    n = valid.sum(axis=1)
+    values = np.where(valid, utilization, 0.0)
+    total = values.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(n > 0, total / n, np.nan)
+        peak = np.where(n > 0, np.where(valid, utilization, -np.inf).max(axis=1, initial=-np.inf), np.nan)
+        var = np.where(n > 0, (np.where(valid, utilization - mean[:, None], 0.0) ** 2).sum(axis=1) / n, np.nan)
+        # NaN sort last, so the valid cores of every run come first in ascending order.
+        ordered = np.nan_to_num(np.sort(utilization, axis=1))
+        rank = np.arange(1, utilization.shape[1] + 1)[None, :]
+        weights = np.where(rank <= n[:, None], 2 * rank - n[:, None] - 1, 0)
+        gini = np.where(total > 0, (weights * ordered).sum(axis=1) / (n * total), np.where(n > 0, 0.0, np.nan))
+        return collections.OrderedDict([
+            ('ncores', n.astype(np.float64)),
+            ('mean', mean),
+            ('max', peak),
+            ('max_mean', np.where(mean > 0, peak / mean, np.nan)),
+            ('cv', np.where(mean > 0, np.sqrt(var) / mean, np.nan)),
+            ('gini', gini),
+        ])
+
+
+def saturated_cores(core_ids, saturated):
+    """ The ids of the cores saturated in at least SATURATED_FRACTION of the steady samples. """
+    return [int(c) for c, s in zip(core_ids, saturated) if not np.isnan(s) and s >= SATURATED_FRACTION]
+
+
+def match_core_sets(cores, sets):
+    """ Split cores by the CPU set they belong to: OrderedDict of set name (or "other") -> [core, ...]. """
+    out = collections.OrderedDict((name, []) for name in tuple(sets.keys()) + ('other',))
+    for core in cores:
+        owners = [name for name, cpus in sets.items() if core in cpus]
+        for name in owners or ('other',):
+            out[name].append(core)
+    return out
@@ -0,0 +1,211 @@
+"""
+Parser of the iperf3 results of a run.
+
+test_iperf writes the JSON results (-J) of every client as "iperf_client_<nic>_<port>.json" on the
+sender and of every server as "iperf_server_<nic>_<port>.json" on the receiver. A server that
+serves more than one test appends one JSON object per test to its log.
+
+Every interval of a result is placed on the clock by the start time of its test. The intervals
+report bytes, and depending on the protocol and side, packets (UDP), lost datagrams (UDP server)
+and retransmits (TCP client). They are summed up into counters per side, so the results can be
+joined with the other series of the run (see join), where the client side is shifted onto the
+receiver clock like the other sender sources. cross_check compares the totals with the counters
+of Suricata.
+"""
+
+import collections
+import json
+import os
+import re
+
+import numpy as np
+
+from . import compressed
+from . import exceptions
+
+
+CLIENT_PATTERN = 'iperf_client_*.json'
+SERVER_PATTERN = 'iperf_server_*.json'
+
+_NAME_RE = re.compile(r'iperf_(client|server)_(.+)_(\d+)\.json$')
+
+# Counters of an interval sum, as reported by iperf3, and their column names.
+INTERVAL_FIELDS = (('bytes', 'bytes'), ('packets', 'packets'), ('lost_packets', 'lost'),
+                   ('retransmits', 'retransmits'))
+
+# Relative difference between the offered and the observed load up to which they agree.
+DEFAULT_TOLERANCE = 0.01
+
+Result = collections.namedtuple('Result', ('role', 'nic', 'port', 'protocol', 'start_time', 'intervals', 'end'))
+
+
+def iter_json_objects(text):
+    """ Yield the JSON objects concatenated in text. """
+    decoder = json.JSONDecoder()
+    pos = 0
+    while True:
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        if pos >= len(text):
+            return
+        try:
+            obj, pos = decoder.raw_decode(text, pos)
+        except ValueError:
+            # iperf3 was killed while writing its result.
+            return
+        yield obj
+
+
+def _end_summary(obj, protocol):
+    end = obj.get('end', {})
+    if protocol == 'UDP':
+        return end.get('sum', {})
+    summary = dict(end.get('sum_received', {}))
+    if 'retransmits' in end.get('sum_sent', {}):
+        summary['retransmits'] = end['sum_sent']['retransmits']
+    return summary
+
+
+def parse_result(obj, role, nic=None, port=None):
+    """
+    :param obj: One JSON result of iperf3.
+    :return: Result whose intervals is an OrderedDict of "Timestamp" (end of every interval, epoch
+        sec), "seconds" and the columns of INTERVAL_FIELDS, NaN where the side does not count them.
+    :raise NoContentException: If the test failed.
+    """
+    if 'error' in obj:
+        raise exceptions.NoContentException('iperf3 failed: %s' % obj['error'])
+    start = obj.get('start', {})
+    try:
+        start_time = float(start['timestamp']['timesecs'])
+    except KeyError:
+        raise exceptions.NoContentException('iperf3 result has no start time.')
+    protocol = start.get('test_start', {}).get('protocol', 'TCP')
+    sums = [interval['sum'] for interval in obj.get('intervals', ()) if not interval['sum'].get('omitted', False)]
+    intervals = collections.OrderedDict([
+        ('Timestamp', np.array([start_time + s['end'] for s in sums], dtype=np.float64)),
+        ('seconds', np.array([s['seconds'] for s in sums], dtype=np.float64)),
+    ])
+    for field, name in INTERVAL_FIELDS:
+        intervals[name] = np.array([s.get(field, np.nan) for s in sums], dtype=np.float64)
+    return Result(role, nic, port, protocol, start_time, intervals, _end_summary(obj, protocol))
+
+
+def parse_file(path):
+    """ Return the list of Results in an iperf3 log, in the order of the tests. """
+    m = _NAME_RE.search(compressed.strip_suffix(os.path.basename(path)))
+    role, nic, port = (m.group(1), m.group(2), int(m.group(3))) if m is not None else (None, None, None)
+    with compressed.open_text(path) as f:
+        text = f.read()
+    results = []
+    for obj in iter_json_objects(text):
+        try:
+            results.append(parse_result(obj, role, nic, port))
+        except exceptions.NoContentException:
+            continue
+    return results
+
+
+def load_run(dirpath):
+    """ Return the Results of all clients and servers of the run. """
+    results = []
+    for pattern in (CLIENT_PATTERN, SERVER_PATTERN):
+        for path in compressed.glob(os.path.join(dirpath, pattern)):
+            results.extend(parse_file(path))
+    return results
+
+
+def pairs(results):
+    """ Match the results of every client with its server by NIC and port: (nic, port) -> (client, server). """
+    matched = collections.OrderedDict()
+    for r in results:
+        client, server = matched.get((r.nic, r.port), (None, None))
+        if r.role == 'client':
+            client = r
+        elif r.role == 'server':
+            server = r
+        matched[(r.nic, r.port)] = (client, server)
+    return matched
+
+
+def series(results, role, offset=0.0):
+    """
+    Sum up the intervals of all results of one side into cumulative counters.
+    :param offset: Added to the timestamps, e.g. the clock offset of the sender.
+    :return: (timestamps, OrderedDict of column name to counter), or None if the side has no interval.
+    """
+    intervals = [r.intervals for r in results if r.role == role and len(r.intervals['Timestamp']) > 0]
+    if len(intervals) == 0:
+        return None
+    timestamps = np.concatenate([i['Timestamp'] for i in intervals])
+    order = np.argsort(timestamps, kind='stable')
+    columns = collections.OrderedDict()
+    for _, name in INTERVAL_FIELDS:
+        values = np.concatenate([i[name] for i in intervals])[order]
+        if np.all(np.isnan(values)):
+            continue
+        columns[name] = np.cumsum(np.nan_to_num(values))
+    return timestamps[order] + offset, columns
+
+
+def totals(results):
+    """ Totals of the end summaries over all results, per side: OrderedDict of "<role>.<column>". """
+    out = collections.OrderedDict()
+    for role in ('client', 'server'):
+        ends = [r.end for r in results if r.role == role]
+        for field, name in INTERVAL_FIELDS:
+            values = [e[field] for e in ends if field in e]
+            out['%s.%s' % (role, name)] = float(sum(values)) if len(values) > 0 else np.nan
+    return out
+
+
+def suricata_counts(table):
+    """
+    Packets and bytes Suricata decoded and the packets the kernel dropped over the run, from the
+    last sample of the counters in the joined table of the run; NaN if unknown.
+    """
+    out = collections.OrderedDict()
+    for name, counter in (('decoded.packets', 'decoder.pkts'), ('decoded.bytes', 'decoder.bytes'),
+                          ('kernel_drops', 'capture.kernel_drops')):
+        out[name] = np.nan
+        # The counters polled over the socket have the finer resolution.
+        for source in ('ctr.', 'eve.'):
+            values = table.get(source + counter)
+            if values is not None and not np.all(np.isnan(values)):
+                out[name] = float(values[~np.isnan(values)][-1])
+                break
+    return out
+
+
+def cross_check(results, counts, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare the load the iperf clients offered with the load Suricata observed.
+
+    With UDP, every datagram the clients sent should be decoded or dropped by the kernel, so their
+    sum relative to the packets sent should be 1. Datagrams larger than the MTU are fragmented and
+    count more than once. With TCP, the clients only count bytes, and the decoded bytes include
+    the headers, the ACKs and the retransmits, so they only must not fall short of them.
+    :param counts: The counts of Suricata, see suricata_counts.
+    :return: OrderedDict of the totals of both sides, the counts, the ratios and "ok", "short" or
+        "excess", or "" if nothing can be compared.
+    """
+    out = totals(results)
+    out.update(counts)
+    seen = counts['decoded.packets'] + np.nan_to_num(counts['kernel_drops'])
+    offered = out['client.packets']
+    out['packet_ratio'] = seen / offered if offered > 0 else np.nan
+    offered = out['client.bytes']
+    out['byte_ratio'] = counts['decoded.bytes'] / offered if offered > 0 else np.nan
+    if not np.isnan(out['packet_ratio']):
+        ratio, upper = out['packet_ratio'], 1 + tolerance
+    else:
+        ratio, upper = out['byte_ratio'], np.inf
+    if np.isnan(ratio):
+        out['verdict'] = ''
+    elif ratio < 1 - tolerance:
+        out['verdict'] = 'short'
+    elif ratio > upper:
+        out['verdict'] = 'excess'
+    else:
+        out['verdict'] = 'ok'
+    return out
@@ -0,0 +1,253 @@
+"""
+Join of all time series of a run on one timestamp axis.
+
+The sources of a run directory are:
+
+  sysstat.receiver.csv / psstat.suricata.csv    resmon on the receiver, prefixed "sys." / "ps."
+  netstat.<nic>.csv                             resmon NIC monitor on the receiver, "net.<nic>."
+  eve.json or eve.stats.json                    Suricata stats records, "eve."
+  suricounters.json                             Suricata counters polled over the socket, "ctr."
+  sysstat.sender.csv / sender.netstat.<nic>.csv resmon on the sender, "sender." / "sender.net.<nic>."
+  iperf_client_*.json / iperf_server_*.json     iperf3 results, "iperf.client." / "iperf.server."
+
+Any of the files may be stored compressed, see compressed.
+
+Every source is placed on the receiver clock. Eve stats are placed by their "timestamp" field, or
+by the Suricata uptime plus the start time of Suricata (the start of the psstat monitor, which
+launches it) if the records have no timestamp. Sender samples, including the iperf clients, are
+shifted by the clock offset measured by the test and saved as clock.json.
+
+The sources sample at different rates, so they are resampled onto a common grid: cumulative
+counters by linear interpolation, gauges like CPU usage by the nearest sample within the sampling
+interval of the source. The NIC monitors report the delta of every interval, which is summed up
+into a counter first, and so are the iperf intervals. Rates (pps, drop ratio, CPU per Mpps, the
+load offered by iperf and the ratio of the load Suricata decoded to it) are derived on the grid.
+"""
+
+import collections
+import datetime
+import json
+import os
+import re
+
+import numpy as np
+
+from . import align
+from . import compressed
+from . import counters
+from . import eve
+from . import exceptions
+from . import iperf
+from . import mon
+
+
+CLOCK_FILE = 'clock.json'
+
+Source = collections.namedtuple('Source', ('prefix', 'timestamps', 'columns', 'cumulative'))
+
+
+def load_clock_offset(dirpath):
+    """ Return the receiver clock minus the sender clock, in sec, or 0 if it was not measured. """
+    path = os.path.join(dirpath, CLOCK_FILE)
+    if not os.path.isfile(path):
+        return 0.0
+    with open(path, 'r') as f:
+        clock = json.load(f)
+    offsets = [m['offset_sec'] for m in clock.values() if m is not None]
+    return float(np.mean(offsets)) if len(offsets) > 0 else 0.0
+
+
+def _numeric(columns, exclude=()):
+    return collections.OrderedDict((name, values.astype(np.float64)) for name, values in columns.items()
+                                   if name not in exclude and values.dtype.kind in 'biuf')
+
+
+def read_resmon(path, prefix, offset=0.0):
+    columns = mon.SysStatParser().parse(path)
+    return Source(prefix, columns['Timestamp'].astype(np.float64) + offset,
+                  _numeric(columns, ('Timestamp', 'Uptime')), False)
+
+
+def read_netstat(path, prefix, offset=0.0):
+    """ The NIC monitor writes the delta of every interval. Sum them up into counters. """
+    columns = mon.NetStatParser().parse(path)
+    return Source(prefix, columns['Timestamp'].astype(np.float64) + offset,
+                  collections.OrderedDict((name, np.cumsum(values))
+                                          for name, values in _numeric(columns, ('Timestamp', 'Uptime')).items()),
+                  True)
+
+
+def parse_eve_timestamp(ts):
+    """ Parse an eve timestamp like "2017-04-27T10:23:45.123456-0400" into epoch seconds. """
+    return datetime.datetime.strptime(ts, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()
+
+
+def read_eve(path, start_time=None):
+    """
+    :param start_time: Epoch time Suricata started at, used if the records have no timestamp.
+    """
+    parser = eve.EveParser()
+    records = parser.extractor.extract(path, with_timestamp=True)
+    if len(records) == 0:
+        raise exceptions.NoContentException('File "%s" has no stat record.' % path)
+    columns = parser.parse_records(stats for _, stats in records)
+    uptimes = columns.pop('uptime').astype(np.float64)
+    stamped = [(parse_eve_timestamp(ts), stats['uptime']) for ts, stats in records if ts is not None]
+    if len(stamped) > 0:
+        # Uptime has a resolution of 1 sec, so take the start time over all records.
+        start_time = float(np.median([ts - up for ts, up in stamped]))
+    elif start_time is None:
+        raise exceptions.NoContentException('File "%s" has no timestamp and no start time is known.' % path)
+    columns = _numeric(columns)
+    return Source('eve.', start_time + uptimes, columns, True)
+
+
+def read_counters(path):
+    columns = counters.CounterParser().parse(path)
+    timestamps = np.frombuffer(columns['Timestamp'], dtype=np.float64)
+    out = collections.OrderedDict()
+    for name, values in columns.items():
+        # Keep the global counters. Per-thread ones are analyzed separately.
+        if name in ('Timestamp', 'uptime') or name.startswith('threads.'):
+            continue
+        values = np.frombuffer(values, dtype=np.int64).astype(np.float64)
+        values[values < 0] = np.nan
+        out[name] = values
+    return Source('ctr.', timestamps, out, True)
+
+
+def read_iperf(dirpath, offset=0.0):
+    """ The iperf clients run on the sender, the servers on the receiver. """
+    results = iperf.load_run(dirpath)
+    sources = []
+    for role, role_offset in (('client', offset), ('server', 0.0)):
+        side = iperf.series(results, role, role_offset)
+        if side is not None:
+            sources.append(Source('iperf.%s.' % role, side[0], side[1], True))
+    return sources
+
+
+def _nic_name(path, pattern):
+    return re.match(pattern, os.path.basename(path)).group(1)
+
+
+def load_sources(dirpath):
+    """ Read every source present in the run directory. """
+    sources = []
+    offset = load_clock_offset(dirpath)
+    start_time = None
+    path = os.path.join(dirpath, 'sysstat.receiver.csv')
+    if compressed.exists(path):
+        sources.append(read_resmon(path, 'sys.'))
+    path = os.path.join(dirpath, 'psstat.suricata.csv')
+    if compressed.exists(path):
+        ps_columns = mon.PsStatParser().parse(path)
+        if len(ps_columns['Timestamp']) > 0:
+            start_time = float(ps_columns['Timestamp'][0] - ps_columns['Uptime'][0])
+        sources.append(Source('ps.', ps_columns['Timestamp'].astype(np.float64),
+                              _numeric(ps_columns, ('Timestamp', 'Uptime')), False))
+    for path in compressed.glob(os.path.join(dirpath, 'netstat.*.csv')):
+        sources.append(read_netstat(path, 'net.%s.' % _nic_name(path, r'netstat\.(.+)\.csv$')))
+    path = eve.find_eve_file(dirpath)
+    if compressed.exists(path):
+        sources.append(read_eve(path, start_time))
+    path = os.path.join(dirpath, 'suricounters.json')
+    if os.path.isfile(path):
+        sources.append(read_counters(path))
+    path = os.path.join(dirpath, 'sysstat.sender.csv')
+    if compressed.exists(path):
+        sources.append(read_resmon(path, 'sender.', offset))
+    for path in compressed.glob(os.path.join(dirpath, 'sender.netstat.*.csv')):
+        sources.append(read_netstat(path, 'sender.net.%s.' % _nic_name(path, r'sender\.netstat\.(.+)\.csv$'), offset))
+    sources.extend(read_iperf(dirpath, offset))
+    return [s for s in sources if len(s.timestamps) > 0]
+
+
+def _rate(grid, values):
+    """ Per-second rate of a counter on the grid. The first point has no rate. """
+    rate = np.full(len(grid), np.nan)
+    rate[1:] = np.diff(values) / np.diff(grid)
+    return rate
+
+
+def _ratio(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(b > 0, a / b, np.nan)
+
+
+def add_derived(table):
+    """ Add rates derived from the joined counters to the table. """
+    grid = table['Timestamp']
+    rates = collections.OrderedDict()
+    # Prefer the counters polled over the socket, they have the finer resolution.
+    for counter, name, scale in (('decoder.pkts', 'pps', 1), ('decoder.bytes', 'bps', 8),
+                                 ('capture.kernel_packets', 'capture.pps', 1),
+                                 ('capture.kernel_drops', 'drop.pps', 1)):
+        for source in ('ctr.', 'eve.'):
+            if source + counter in table:
+                rates[name] = _rate(grid, table[source + counter]) * scale
+                break
+    if 'drop.pps' in rates and 'capture.pps' in rates:
+        rates['drop_ratio'] = _ratio(rates['drop.pps'], rates['capture.pps'])
+    for prefix, column, name in (('net.', 'recv.pkts', 'nic.rx_pps'), ('net.', 'drop.in', 'nic.drop_pps'),
+                                 ('sender.net.', 'sent.pkts', 'sender.tx_pps'),
+                                 ('iperf.client.', 'packets', 'iperf.offered_pps'),
+                                 ('iperf.server.', 'packets', 'iperf.received_pps')):
+        names = [n for n in table.keys() if n.startswith(prefix) and n.endswith('.' + column)]
+        if len(names) > 0:
+            rates[name] = sum(_rate(grid, table[n]) for n in names)
+    if 'pps' in rates and 'iperf.offered_pps' in rates:
+        rates['iperf.load_ratio'] = _ratio(rates['pps'], rates['iperf.offered_pps'])
+    if 'pps' in rates:
+        mpps = rates['pps'] / 1e6
+        if 'sys.%CPU' in table:
+            rates['cpu_per_mpps'] = _ratio(table['sys.%CPU'], mpps)
+        if 'ps.%CPU' in table:
+            rates['suricata.cpu_per_mpps'] = _ratio(table['ps.%CPU'], mpps)
+    table.update(rates)
+    return table
+
+
+def join_sources(sources, step=None):
+    """
+    Resample the sources onto a common grid.
+    :param step: Interval of the grid. Default: the sampling interval of the receiver resmon, or
+        else the finest one of the sources.
+    :return: OrderedDict of "Timestamp", "Uptime" (since the first grid point) and the columns of
+        every source under its prefix.
+    """
+    if len(sources) == 0:
+        raise exceptions.NoContentException('No source to join.')
+    steps = {s.prefix: align.sampling_step([s.timestamps]) for s in sources}
+    if step is None:
+        step = steps['sys.'] if 'sys.' in steps else min(steps.values())
+    grid = align.common_grid([np.sort(s.timestamps) for s in sources], step)
+    table = collections.OrderedDict([('Timestamp', grid), ('Uptime', grid - grid[0])])
+    for s in sources:
+        order = np.argsort(s.timestamps, kind='stable')
+        keys = s.timestamps[order]
+        names = list(s.columns.keys())
+        if len(names) == 0:
+            continue
+        matrix = np.vstack([s.columns[n][order] for n in names])
+        if s.cumulative:
+            values = align.resample_linear(keys, matrix, grid)
+        else:
+            values = align.resample_nearest(keys, matrix, grid, max(step, steps[s.prefix]) / 2)
+        for name, row in zip(names, values):
+            table[s.prefix + name] = row
+    return table
+
+
+def join_run(dirpath, step=None):
+    """ Return the wide table of the run, with derived rates. """
+    return add_derived(join_sources(load_sources(dirpath), step))
+
+
+def save_csv(path, table):
+    """ Write the table as CSV. NaN is written as an empty field. """
+    names = list(table.keys())
+    with open(path, 'w') as f:
+        f.write(','.join(names) + '\n')
+        for row in zip(*[table[n].tolist() for n in names]):
+            f.write(','.join('' if v != v else repr(v) for v in row) + '\n')
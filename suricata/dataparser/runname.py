@@ -0,0 +1,94 @@
+"""
+Parser of run directory names.
+
+A run directory is named "<conf>_<trace>_<runmode>_<ninstances>_<nnics>nics[_<extra>...]_<i>_<ts>",
+e.g. "2c4d_snort.log_workers_8_1nics_0_1493306210". The conf token starts with the number of
+capture and worker threads and is followed by the tags of suricata_configs/repl.py, separated by
+"-", e.g. "2c4d-af-nosmt-cqm-r4096-b32768-v3-nodefrag".
+"""
+
+import collections
+import os
+import re
+
+
+RunName = collections.namedtuple('RunName', ('conf', 'trace_file', 'runmode', 'ninstances', 'nnics', 'i', 'ts',
+                                             'nc', 'nd', 'affinity', 'skip_smt',
+                                             'cluster_type', 'ring_size', 'block_size', 'capture_mode', 'defrag',
+                                             'extra'))
+
+# The AF_PACKET options a conf token without tags stands for.
+DEFAULT_CONF = {
+    'affinity': None,
+    'skip_smt': False,
+    'cluster_type': 'flow',
+    'ring_size': None,
+    'block_size': None,
+    'capture_mode': 'mmap',
+    'defrag': True,
+}
+
+_THREADS_RE = re.compile(r'^(\d+)c(\d+)d$')
+
+# Conf tags that may follow the conf token after a "_" in older run names.
+_LEGACY_TAG_RE = re.compile(r'^(af|afw|nosmt|v3|nommap|nodefrag|r\d+|b\d+|c(flow|cpu|qm))$')
+
+
+def parse_conf(conf):
+    """ Parse a conf token like "2c4d-af-cqm" into a dict. Raises ValueError on unknown tags. """
+    tags = conf.replace('_', '-').split('-')
+    m = _THREADS_RE.match(tags[0])
+    if m is None:
+        raise ValueError('Malformed conf token "%s".' % conf)
+    d = dict(DEFAULT_CONF)
+    d['nc'] = int(m.group(1))
+    d['nd'] = int(m.group(2))
+    for tag in tags[1:]:
+        if tag == 'af':
+            d['affinity'] = 'autofp'
+        elif tag == 'afw':
+            d['affinity'] = 'workers'
+        elif tag == 'nosmt':
+            d['skip_smt'] = True
+        elif tag in ('v3', 'nommap'):
+            d['capture_mode'] = tag
+        elif tag == 'nodefrag':
+            d['defrag'] = False
+        elif tag.startswith('c') and len(tag) > 1:
+            d['cluster_type'] = tag[1:]
+        elif tag.startswith('r') and tag[1:].isdigit():
+            d['ring_size'] = int(tag[1:])
+        elif tag.startswith('b') and tag[1:].isdigit():
+            d['block_size'] = int(tag[1:])
+        else:
+            raise ValueError('Unknown tag "%s" in conf token "%s".' % (tag, conf))
+    return d
+
+
+def conf_from_config_file(config_file):
+    """ Return the conf token of a config file like "suricata_2c4d_af.yaml", i.e. "2c4d-af". """
+    name = os.path.basename(config_file)
+    if name.startswith('suricata_'):
+        name = name[len('suricata_'):]
+    return os.path.splitext(name)[0].replace('_', '-')
+
+
+def trace_label(tracefile):
+    """ Return the trace name used in run names, e.g. "snort.log" for "traces/snort.log.1425823194". """
+    return re.sub(r'\.\d+$', '', os.path.basename(tracefile))
+
+
+def parse_dirname(dirname):
+    """ Parse the name of a run directory into a RunName. Raises ValueError if it is malformed. """
+    parts = dirname.split('_')
+    # Older names separate the conf tags by "_", e.g. "4c8d_af_snort.log_...".
+    while len(parts) > 1 and _LEGACY_TAG_RE.match(parts[1]):
+        parts[:2] = [parts[0] + '-' + parts[1]]
+    if len(parts) < 7:
+        raise ValueError('Malformed run directory name "%s".' % dirname)
+    conf, trace_file, runmode, ninstances, nnics = parts[:5]
+    i, ts = parts[-2:]
+    conf_info = parse_conf(conf)
+    return RunName(conf=conf, trace_file=trace_file, runmode=runmode,
+                   ninstances=int(ninstances), nnics=int(nnics.split('n', 1)[0]), i=int(i), ts=int(ts),
+                   extra=tuple(parts[5:-2]), **conf_info)
@@ -0,0 +1,145 @@
+"""
+Scaling efficiency of Suricata across capture/worker configurations.
+
+The metrics of a run are the medians of its joined series (see join) over the steady window: the
+one detected during the test, else the longest steady stretch of the packet rate and CPU usage,
+else the whole run. Repeats of a configuration are reduced to their medians.
+
+A configuration is a point (nc, nd) of a curve. The curve is made of the runs that agree on every
+other dimension, e.g. runmode, NICs, instances and AF_PACKET options. Parallel efficiency is the
+speedup over the 1c1d point of the curve divided by the ratio of cores used. In workers runmode
+the workers are the capture threads, so a configuration uses nc cores, and nc + nd in autofp.
+"""
+
+import collections
+import math
+
+import numpy as np
+
+from . import join
+from . import steadystate
+
+
+# Dimensions a scaling curve is made of, besides nc and nd.
+CURVE_KEYS = ('trace_file', 'runmode', 'nnics', 'ninstances', 'affinity', 'skip_smt', 'cluster_type',
+              'ring_size', 'block_size', 'capture_mode', 'defrag')
+
+# Metrics of a run: name -> column of the joined table.
+RUN_METRICS = (
+    ('pps', 'pps'),
+    ('bps', 'bps'),
+    ('capture_pps', 'capture.pps'),
+    ('drop_pps', 'drop.pps'),
+    ('drop_ratio', 'drop_ratio'),
+    ('cpu', 'ps.%CPU'),
+    ('sys_cpu', 'sys.%CPU'),
+    ('cpu_per_mpps', 'suricata.cpu_per_mpps'),
+    ('rss_kb', 'ps.mem.rss.KB'),
+)
+
+# Drop ratio up to which a configuration counts as lossless.
+DEFAULT_LOSS_TOLERANCE = 0.001
+
+BASELINE = (1, 1)
+
+
+def cores(nc, nd, runmode):
+    return nc + nd if runmode == 'autofp' else nc
+
+
+def steady_mask(dirpath, table):
+    """ Rows of the joined table within the steady window of the run. """
+    timestamps = table['Timestamp']
+    window = steadystate.load_window(dirpath)
+    if window is not None and window['steady']:
+        start, end = window['start_ts'], window['end_ts']
+    else:
+        series = {name: table[name] for name in ('pps', 'ps.%CPU') if name in table}
+        valid = np.all([~np.isnan(v) for v in series.values()], axis=0) if series else np.zeros(0, dtype=bool)
+        window = None
+        if valid.any():
+            window = steadystate.find_steady_window(timestamps[valid].tolist(),
+                                                    {name: v[valid].tolist() for name, v in series.items()})
+        start, end = window if window is not None else (timestamps[0], timestamps[-1])
+    return (timestamps >= start) & (timestamps <= end)
+
+
+def run_metrics(dirpath, step=None):
+    """ Return the metrics of the run directory, NaN for the ones its sources do not provide. """
+    table = join.join_run(dirpath, step)
+    mask = steady_mask(dirpath, table)
+    metrics = collections.OrderedDict()
+    for name, column in RUN_METRICS:
+        values = table[column][mask] if column in table else np.empty(0)
+        values = values[~np.isnan(values)]
+        metrics[name] = float(np.median(values)) if len(values) else math.nan
+    metrics['duration'] = float(table['Timestamp'][mask][-1] - table['Timestamp'][mask][0]) if mask.any() else 0.0
+    return metrics
+
+
+def _median(values):
+    values = [v for v in values if not math.isnan(v)]
+    return float(np.median(values)) if values else math.nan
+
+
+def aggregate(runs):
+    """
+    :param runs: List of (catalog entry, metrics).
+    :return: List of OrderedDicts, one per configuration, with the curve keys, nc, nd, cores,
+        the number of repeats and the median of every metric over them.
+    """
+    groups = collections.OrderedDict()
+    for entry, metrics in runs:
+        key = tuple(getattr(entry, k) for k in CURVE_KEYS) + (entry.nc, entry.nd)
+        groups.setdefault(key, []).append(metrics)
+    points = []
+    for key, repeats in groups.items():
+        point = collections.OrderedDict(zip(CURVE_KEYS + ('nc', 'nd'), key))
+        point['cores'] = cores(point['nc'], point['nd'], point['runmode'])
+        point['repeats'] = len(repeats)
+        for name in repeats[0].keys():
+            point[name] = _median([m[name] for m in repeats])
+        points.append(point)
+    return points
+
+
+def curve_key(point):
+    return tuple(point[k] for k in CURVE_KEYS)
+
+
+def add_efficiency(points, loss_tolerance=DEFAULT_LOSS_TOLERANCE):
+    """
+    Add to every point its speedup and parallel efficiency over the 1c1d point of its curve (NaN
+    if the curve has none), whether it is lossless, and the pps per core if it is.
+    """
+    baselines = {curve_key(p): p for p in points if (p['nc'], p['nd']) == BASELINE}
+    for p in points:
+        base = baselines.get(curve_key(p))
+        if base is not None and base['pps'] > 0:
+            p['speedup'] = p['pps'] / base['pps']
+            p['efficiency'] = p['speedup'] / (p['cores'] / base['cores'])
+        else:
+            p['speedup'] = p['efficiency'] = math.nan
+        p['pps_per_core'] = p['pps'] / p['cores']
+        # A run without a drop counter cannot be told lossless.
+        p['lossless'] = not math.isnan(p['drop_ratio']) and p['drop_ratio'] <= loss_tolerance
+        p['lossless_pps_per_core'] = p['pps_per_core'] if p['lossless'] else math.nan
+    return points
+
+
+def curves(points):
+    """ Group the points by curve, each ordered by cores. """
+    out = collections.OrderedDict()
+    for p in points:
+        out.setdefault(curve_key(p), []).append(p)
+    for c in out.values():
+        c.sort(key=lambda p: (p['cores'], p['nc'], p['nd']))
+    return out
+
+
+def ranking(points):
+    """ Lossless configurations by pps per core, best first, followed by the lossy ones by drop ratio. """
+    lossless = sorted((p for p in points if p['lossless']), key=lambda p: -p['lossless_pps_per_core'])
+    lossy = sorted((p for p in points if not p['lossless']),
+                   key=lambda p: (math.isnan(p['drop_ratio']), p['drop_ratio'], -p['pps_per_core']))
+    return lossless + lossy
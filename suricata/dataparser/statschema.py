@@ -0,0 +1,182 @@
+"""
+Compiled extraction of flat columns from nested stats records.
+
+A schema mirrors the nesting of a record. A leaf role of "key" marks the row key (e.g. uptime),
+any other role marks a column. A "*" key matches every child, e.g. every thread under "threads".
+The schema ALL_NUMERIC takes every numeric leaf of the records.
+
+The schema is expanded once against a sample record into a flat column list, and a Python function
+reading all columns of a record is generated for it, so records are not walked per key. Another
+generated function takes the keys of every dict the schema reads, as a fingerprint of the record
+layout. Records whose layout differs from the sample (e.g. threads that started late or a counter
+added under an existing key) extend the column list.
+
+Per-thread columns are named "threads.<thread>.<counter>" and grouped by "threads.*.<counter>".
+"""
+
+import collections
+import re
+
+
+ALL_NUMERIC = 'all'
+WILDCARD = '*'
+KEY_ROLE = 'key'
+
+_EMPTY = {}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _has_path(record, path):
+    for key in path:
+        if not isinstance(record, dict) or key not in record:
+            return False
+        record = record[key]
+    return True
+
+
+def _holds_dicts(record, path):
+    for key in path:
+        record = record.get(key) if isinstance(record, dict) else None
+    return isinstance(record, dict) and any(isinstance(v, dict) for v in record.values())
+
+
+def expand(schema, record, prefix=(), dicts=None):
+    """
+    Expand the schema against a record.
+    :param dicts: If a list, the paths of the dicts read are appended to it.
+    :return: (path of the row key or None, list of column paths). A path is a tuple of keys.
+    """
+    key_path = None
+    paths = []
+    if dicts is not None:
+        dicts.append(prefix)
+    if schema == ALL_NUMERIC:
+        for name, value in record.items():
+            if isinstance(value, dict):
+                paths.extend(expand(ALL_NUMERIC, value, prefix + (name,), dicts)[1])
+            elif _is_number(value):
+                if prefix == () and name == 'uptime':
+                    key_path = (name,)
+                else:
+                    paths.append(prefix + (name,))
+        return key_path, paths
+    for name, role in schema.items():
+        names = list(record.keys()) if name == WILDCARD else [name]
+        for n in names:
+            if isinstance(role, dict) or role == ALL_NUMERIC:
+                sub = record.get(n, _EMPTY)
+                sub = sub if isinstance(sub, dict) else _EMPTY
+                sub_key, sub_paths = expand(role, sub, prefix + (n,), dicts)
+                if name == WILDCARD:
+                    # A child only gets the counters it has, e.g. the flow manager has no capture.
+                    sub_paths = [p for p in sub_paths if _has_path(sub, p[len(prefix) + 1:])]
+                key_path = key_path or sub_key
+                paths.extend(sub_paths)
+            elif role == KEY_ROLE:
+                key_path = prefix + (n,)
+            else:
+                paths.append(prefix + (n,))
+    return key_path, paths
+
+
+def _lookup_lines(dict_paths):
+    """ Lines assigning every dict on the way to the dict paths to a variable, and the variables by path. """
+    lines = []
+    variables = {(): 'd'}
+    for path in dict_paths:
+        for depth in range(1, len(path) + 1):
+            parent = path[:depth]
+            if parent not in variables:
+                variables[parent] = 'v%d' % len(variables)
+                lines.append('    %s = %s.get(%r, _E)' % (variables[parent], variables[parent[:-1]], parent[-1]))
+    return lines, variables
+
+
+def _define(name, lines):
+    namespace = {'_EMPTY': _EMPTY}
+    exec('\n'.join(['def %s(d, _E=_EMPTY):' % name] + lines), namespace)
+    return namespace[name]
+
+
+def compile_accessor(paths):
+    """
+    Generate a function returning the tuple of values at the paths of a record, None for a
+    missing one. Every intermediate dict is looked up only once.
+    """
+    lines, variables = _lookup_lines([p[:-1] for p in paths])
+    values = ['%s.get(%r)' % (variables[p[:-1]], p[-1]) for p in paths]
+    lines.append('    return (%s)' % ''.join(v + ', ' for v in values))
+    return _define('accessor', lines)
+
+
+def compile_shape(dict_paths, named=()):
+    """
+    Generate a function returning the size of the dicts at the paths of a record, or their keys for
+    the paths in named, e.g. the dict of the threads, whose children may be renamed.
+    """
+    lines, variables = _lookup_lines(dict_paths)
+    named = set(named)
+    lines.append('    return (%s)' % ''.join('%s(%s), ' % ('tuple' if p in named else 'len', variables[p])
+                                              for p in dict_paths))
+    return _define('shape', lines)
+
+
+def thread_groups(columns):
+    """ Group the per-thread columns by counter: "threads.*.<counter>" -> [column, ...]. """
+    groups = collections.OrderedDict()
+    for column in columns:
+        m = re.match(r'^threads\.([^.]+)\.(.+)$', column)
+        if m is not None:
+            groups.setdefault('threads.*.' + m.group(2), []).append(column)
+    return groups
+
+
+class CompiledSchema:
+
+    def __init__(self, schema, record, paths=()):
+        """
+        :param schema: Schema dict or ALL_NUMERIC.
+        :param record: Sample record to expand the schema against.
+        :param paths: Column paths to keep before the ones of the record, when extending.
+        """
+        self.schema = schema
+        dict_paths = []
+        key_path, new_paths = expand(schema, record, dicts=dict_paths)
+        self.key_path = key_path
+        known = set(paths)
+        self.paths = list(paths) + [p for p in new_paths if p not in known]
+        self.columns = ['.'.join(p) for p in self.paths]
+        self.key_name = '.'.join(key_path) if key_path is not None else None
+        self._accessor = compile_accessor(self.paths)
+        self._key_accessor = compile_accessor([key_path]) if key_path is not None else None
+        # The dicts the schema read in the record and the ones holding the kept columns. A new
+        # counter changes the size of its dict, a renamed thread or group the keys of its parent.
+        dict_paths = list(collections.OrderedDict.fromkeys(dict_paths + [p[:-1] for p in self.paths]))
+        self._shape = compile_shape(dict_paths, [p for p in dict_paths if _holds_dicts(record, p)])
+        self.signature = self.shape(record)
+
+    def shape(self, record):
+        """ Fingerprint of the record layout. Records with another one may have other columns. """
+        return self._shape(record)
+
+    def extend(self, record):
+        """ Return a schema with the new columns of the record appended, or self if there are none. """
+        if self.shape(record) == self.signature:
+            return self
+        extended = CompiledSchema(self.schema, record, self.paths)
+        if len(extended.paths) > len(self.paths):
+            return extended
+        self._shape, self.signature = extended._shape, extended.signature
+        return self
+
+    def key(self, record):
+        return self._key_accessor(record)[0] if self._key_accessor is not None else None
+
+    def row(self, record):
+        return self._accessor(record)
+
+    def groups(self):
+        return thread_groups(self.columns)
@@ -0,0 +1,109 @@
+"""
+Steady-state detection for metric time series.
+
+A window of the last `window` samples is steady when the coefficient of variation (stdev / mean)
+of every metric in it is at most `cv_threshold`. The measurement window starts at the first
+sample of the first steady window and is restarted whenever the series becomes unsteady again.
+Enough stable samples exist once the measurement window holds `min_samples` samples.
+
+The window boundaries of a run are saved as steady_state.json in the run directory.
+"""
+
+import json
+import math
+import os
+
+
+STEADY_STATE_FILE = 'steady_state.json'
+
+
+def coefficient_of_variation(values):
+    n = len(values)
+    mean = sum(values) / n
+    var = sum((v - mean) ** 2 for v in values) / n
+    if mean == 0:
+        return 0 if var == 0 else math.inf
+    return math.sqrt(var) / abs(mean)
+
+
+class SteadyStateDetector:
+
+    def __init__(self, window=5, cv_threshold=0.05, min_samples=10):
+        if window < 2:
+            raise ValueError('Window must hold at least 2 samples.')
+        self.window = window
+        self.cv_threshold = cv_threshold
+        self.min_samples = max(min_samples, window)
+        self.keys = []
+        self.values = dict()
+        # Index of the first sample of the measurement window, or None if not steady.
+        self.start_idx = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, sample):
+        """
+        Add a sample.
+        :param key: Position of the sample, e.g. uptime or timestamp.
+        :param dict sample: Metric name -> value. Every sample must have the same metrics.
+        :return: True if the series is steady after this sample.
+        """
+        self.keys.append(key)
+        for name, value in sample.items():
+            self.values.setdefault(name, []).append(value)
+        if len(self.keys) < self.window:
+            return False
+        steady = all(coefficient_of_variation(v[-self.window:]) <= self.cv_threshold for v in self.values.values())
+        if not steady:
+            self.start_idx = None
+        elif self.start_idx is None:
+            self.start_idx = len(self.keys) - self.window
+        return steady
+
+    def is_steady(self):
+        return self.start_idx is not None
+
+    def is_done(self):
+        """ True when the measurement window holds enough stable samples. """
+        return self.start_idx is not None and len(self.keys) - self.start_idx >= self.min_samples
+
+    def steady_window(self):
+        """ Return (first key, last key) of the measurement window, or None if not steady. """
+        if self.start_idx is None:
+            return None
+        return self.keys[self.start_idx], self.keys[-1]
+
+
+def find_steady_window(keys, series, window=5, cv_threshold=0.05):
+    """
+    Find the longest steady window in complete series, for runs with no steady_state.json.
+    :param list keys: Position of every sample, e.g. uptime.
+    :param dict series: Metric name -> list of values aligned with keys.
+    :return: (first key, last key) of the window, or None if the series never becomes steady.
+    """
+    detector = SteadyStateDetector(window=window, cv_threshold=cv_threshold, min_samples=window)
+    best = None
+    for i, key in enumerate(keys):
+        detector.add(key, {name: values[i] for name, values in series.items()})
+        if detector.is_steady():
+            start = detector.start_idx
+            if best is None or i - start > best[1] - best[0]:
+                best = (start, i)
+    if best is None:
+        return None
+    return keys[best[0]], keys[best[1]]
+
+
+def save_window(dirpath, info):
+    with open(os.path.join(dirpath, STEADY_STATE_FILE), 'w') as f:
+        json.dump(info, f, indent=2, sort_keys=True)
+
+
+def load_window(dirpath):
+    """ Return the steady-state info saved in the run directory, or None if there is none. """
+    path = os.path.join(dirpath, STEADY_STATE_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
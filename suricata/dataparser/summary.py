@@ -0,0 +1,157 @@
+"""
+Cross-run summary of a collection.
+
+The runs of a collection are resampled onto a common uptime grid by an align.Aligner, or else
+aligned by row index as the per-run sheets of its workbook are. The median and optional
+percentiles of every cell are computed over the runs with NumPy. Rows a run does not have are
+ignored. The values are written to the Summary sheet of the workbook and to
+"<workbook>.summary.json". MEDIAN formulas computing the same values are only written on request.
+"""
+
+import collections
+import json
+import math
+import warnings
+
+import numpy as np
+import xlsxwriter
+
+from . import excelhelper
+
+
+# Workbooks with more cells than this are written in xlsxwriter's constant memory mode.
+CONSTANT_MEMORY_CELLS = 1000000
+
+
+def stack_column(runs, name):
+    """
+    Stack one column of every run into a float64 matrix with one row per run, padded with NaN.
+    :param list runs: Dicts mapping column name to array.
+    :return: The matrix, or None if the column is not numeric.
+    """
+    arrays = [run[name] for run in runs if name in run]
+    if len(arrays) == 0 or any(a.dtype.kind not in 'biuf' for a in arrays):
+        return None
+    matrix = np.full((len(arrays), max(len(a) for a in arrays)), np.nan)
+    for i, a in enumerate(arrays):
+        matrix[i, :len(a)] = a
+    return matrix
+
+
+def stat_name(percentile):
+    return 'p%g' % percentile
+
+
+def summarize(runs, names, percentiles=()):
+    """
+    Compute the median and percentiles of every cell over the runs.
+    :return: OrderedDict mapping "median" and "p<N>" to an OrderedDict of column name to array.
+        Columns that are not numeric are left out.
+    """
+    stats = collections.OrderedDict([('median', collections.OrderedDict())])
+    for p in percentiles:
+        stats[stat_name(p)] = collections.OrderedDict()
+    with warnings.catch_warnings():
+        # Grid points no run has a sample near are NaN.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for name in names:
+            matrix = stack_column(runs, name)
+            if matrix is None:
+                continue
+            stats['median'][name] = np.nanmedian(matrix, axis=0)
+            if len(percentiles) > 0:
+                for p, values in zip(percentiles, np.nanpercentile(matrix, percentiles, axis=0)):
+                    stats[stat_name(p)][name] = values
+    return stats
+
+
+def _cell_value(value, integer):
+    if math.isnan(value):
+        return None
+    return math.floor(value) if integer else value
+
+
+def save_json(path, keys, names, stats, integer=False, alignment=None):
+    summary = {
+        'samples': len(keys),
+        'runs': [str(k) for k in keys],
+        'columns': names,
+        'alignment': alignment,
+        'statistics': {stat: {name: [_cell_value(v, integer) for v in values.tolist()]
+                              for name, values in columns.items()}
+                       for stat, columns in stats.items()},
+    }
+    with open(path, 'w') as f:
+        json.dump(summary, f)
+
+
+def write_workbook(basename, all_data, log, percentiles=(), formulas=False, constant_memory=None,
+                   integer=False, column_width=None, aligner=None):
+    """
+    Write "<basename>.xlsx" with a Summary sheet (plus one per percentile) and a sheet per run, and
+    "<basename>.summary.json".
+    :param dict all_data: Key of the run -> OrderedDict mapping column name to array.
+    :param log: File to print the sample size and records to.
+    :param formulas: If True, write the MEDIAN formulas of the Summary sheet, with the computed values
+        as their cached results. Excel takes no list of cells on several sheets as the array of
+        PERCENTILE, so the percentile sheets always hold the values.
+    :param constant_memory: Use xlsxwriter's constant memory mode. None to decide by size.
+    :param integer: Round the summary down to integers.
+    :param aligner: align.Aligner to resample the runs with before the summary. None to align
+        them by row index, which formulas require.
+    """
+    keys = sorted(all_data.keys())
+    runs = [all_data[k] for k in keys]
+    names = []
+    for run in runs:
+        names.extend(n for n in run.keys() if n not in names)
+    if aligner is not None:
+        step, aligned = aligner.align(runs)
+        stats = summarize(aligned, names, percentiles)
+        alignment = aligner.describe(step)
+    else:
+        stats = summarize(runs, names, percentiles)
+        alignment = {'key': None, 'method': 'row'}
+    save_json(basename + '.summary.json', keys, names, stats, integer, alignment)
+    if constant_memory is None:
+        constant_memory = sum(len(v) for run in runs for v in run.values()) > CONSTANT_MEMORY_CELLS
+    print('Sample size: %d' % len(keys), file=log)
+    workbook = xlsxwriter.Workbook(basename + '.xlsx', {'strings_to_numbers': True,
+                                                        'constant_memory': constant_memory})
+    stat_sheets = [(stat, workbook.add_worksheet('Summary' if stat == 'median' else stat.upper()))
+                   for stat in stats.keys()]
+    sheet_names = []
+    for key, run in zip(keys, runs):
+        sheet_name = str(key)
+        sheet_names.append(sheet_name)
+        sheet = workbook.add_worksheet(sheet_name)
+        if column_width is not None:
+            sheet.set_column(0, len(run) - 1, column_width)
+        print('Sheet name: %s' % sheet_name, file=log)
+        print('  Records: %d' % max((len(v) for v in run.values()), default=0), file=log)
+        # Rows must be written in order in constant memory mode.
+        sheet.write_row(0, 0, list(run.keys()))
+        for rowid, row in enumerate(zip(*[v.tolist() for v in run.values()])):
+            sheet.write_row(rowid + 1, 0, row)
+    for stat, sheet in stat_sheets:
+        columns = stats[stat]
+        if column_width is not None:
+            sheet.set_column(0, len(names) - 1, column_width)
+        sheet.write_row(0, 0, names)
+        nrows = max((len(v) for v in columns.values()), default=0)
+        values = [columns[name].tolist() if name in columns else None for name in names]
+        for i in range(nrows):
+            for j, name in enumerate(names):
+                if values[j] is None or i >= len(values[j]):
+                    continue
+                value = _cell_value(values[j][i], integer)
+                if not formulas or stat != 'median':
+                    if value is not None:
+                        sheet.write_number(i + 1, j, value)
+                    continue
+                cells = ','.join("'%s'!%s" % (s, excelhelper.excel_style(i + 2, j + 1)) for s in sheet_names)
+                formula = 'MEDIAN(%s)' % cells
+                if integer:
+                    formula = 'INT(%s)' % formula
+                sheet.write_formula(i + 1, j, '=' + formula, None, value if value is not None else '')
+    workbook.close()
@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+
+"""
+Attribute the packet loss of every run to the stages between the sender and Suricata:
+
+  <output_dir>/drops.csv                  loss budget of every run, with the stage that lost the most
+  <output_dir>/<run dir name>.drops.csv   loss budget of every time window of the run
+"""
+
+import argparse
+import collections
+import os
+import sys
+
+from dataparser import catalog
+from dataparser import drops
+from scaling_report import print_outcome, save_csv
+
+
+def attribute_one(dirpath, output_dir, window_sec, step):
+    total, windows = drops.attribute(dirpath, window_sec, step)
+    if len(windows):
+        save_csv(os.path.join(output_dir, os.path.basename(dirpath) + '.drops.csv'), windows)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Attribute the packet loss of every run to NIC, kernel and Suricata.')
+    parser.add_argument('data_dir', type=str, help='Directory holding the run directories.')
+    parser.add_argument('output_dir', type=str, help='Directory to write the report to.')
+    parser.add_argument('scan_depth', type=int, help='Depth of the run directories under data_dir.')
+    parser.add_argument('--where', type=str, default=None,
+                        help='SQL condition on the catalog columns to select runs.')
+    catalog.add_catalog_argument(parser)
+    parser.add_argument('--window', type=float, default=10.0,
+                        help='Length, in sec, of the windows the loss is split into. Default: %(default)s.')
+    parser.add_argument('--step', type=float, default=None,
+                        help='Interval, in sec, of the joined series. Default: the sampling interval of resmon.')
+    parser.add_argument('--workers', type=int, default=catalog.NUM_WORKERS,
+                        help='Number of worker processes. Default: number of CPUs.')
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_dir = os.path.abspath(args.output_dir)
+    results, errors = catalog.map_runs(args.data_dir, args.scan_depth, args.where, attribute_one,
+                                       (output_dir, args.window, args.step), args.workers, args.catalog)
+    rows = []
+    for entry, total in results:
+        row = collections.OrderedDict([('path', entry.path), ('conf', entry.conf), ('runmode', entry.runmode),
+                                       ('nnics', entry.nnics), ('ninstances', entry.ninstances),
+                                       ('i', entry.i), ('ts', entry.ts)])
+        row.update(total)
+        rows.append(row)
+    if len(rows):
+        save_csv(os.path.join(output_dir, 'drops.csv'), rows)
+    for stage in drops.STAGES:
+        print('%-10s dominant in %d runs.' % (stage, sum(1 for r in rows if r['dominant'] == stage)))
+    print_outcome('Runs', len(rows), errors)
+    return 1 if len(errors) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+
+"""
+Fetch the raw logs of runs that were reduced on the receiver with raw_logs "lazy" into their run
+directories, for the runs an analysis needs them for.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+from colors import Colors
+from dataparser import catalog
+from dataparser import compressed
+
+
+def fetch_one(rundir, raw):
+    # Runs of the single-host mode keep them on this host.
+    src = raw['dir'] + '/' if raw.get('host') is None else '%s@%s:%s/' % (raw['user'], raw['host'], raw['dir'])
+    return subprocess.call(['rsync', '-vrpE', src, rundir + '/'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fetch the raw logs kept on the receiver for reduced runs.')
+    parser.add_argument('data_dir', type=str, help='Directory holding the run directories.')
+    parser.add_argument('scan_depth', type=int, help='Depth of the run directories under data_dir.')
+    parser.add_argument('--where', type=str, default=None,
+                        help='SQL condition on the catalog columns to select runs.')
+    catalog.add_catalog_argument(parser)
+    parser.add_argument('--force', default=False, action='store_true',
+                        help='If present, fetch again the runs that have an eve.json already.')
+    args = parser.parse_args()
+    nfetched = 0
+    errors = []
+    with catalog.Catalog(args.data_dir, args.catalog) as runs:
+        runs.update(args.scan_depth)
+        entries = runs.select(args.where)
+        for entry in entries:
+            manifest = catalog.load_manifest(entry)
+            raw = manifest.get('raw_logs') if manifest is not None else None
+            if raw is None or raw.get('dir') is None:
+                continue
+            rundir = runs.abspath(entry)
+            if not args.force and compressed.exists(os.path.join(rundir, 'eve.json')):
+                continue
+            if fetch_one(rundir, raw) != 0:
+                errors.append(entry.path)
+                print(Colors.RED + 'Error: failed to fetch the raw logs of "%s".' % entry.path + Colors.ENDC)
+            else:
+                nfetched += 1
+    print(Colors.GREEN + 'Fetched:\t%d' % nfetched + Colors.ENDC)
+    print(Colors.RED + 'Failures:\t%d' % len(errors) + Colors.ENDC)
+    return 1 if len(errors) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+
+"""
+Write synthetic run directories, in the layout and file formats of real runs, to measure the
+analysis tools on any box without a testbed:
+
+  <data_dir>/<conf>_<trace>_<runmode>_<ninstances>_<nnics>nics_<i>_<ts>/
+      eve.json                  stats records every --stats-interval sec, with per-thread counters, between
+                                alert, flow, http and dns events at the given rates
+      stats.log                 the same counters in the text format of Suricata
+      sysstat.receiver.csv      resmon system monitor, one sample per sec
+      psstat.suricata.csv       resmon process monitor
+      netstat.<nic>.csv         resmon NIC monitor of every NIC
+
+The load of a run follows its conf: the throughput grows with the worker threads up to a fixed
+offered load, and what the workers cannot process is dropped by the kernel. Runs are named and
+timestamped like real ones, so the catalog finds them from their directory names.
+
+Example:
+
+$ python3 suricata/gen_synthetic_runs.py /tmp/synthetic --confs 1c1d 2c4d 4c8d-af --repeats 3 --duration 60 \
+      --alerts 50 --flows 500
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import gzip
+import json
+import os
+import random
+import shutil
+import sys
+
+from colors import Colors
+from dataparser import runname
+from dataparser.catalog import NUM_WORKERS
+
+
+DEFAULT_CONFS = ('1c1d', '2c4d', '4c8d-af')
+
+# Packets per second one worker thread processes, and the load the sender offers.
+WORKER_PPS = 120000
+OFFERED_PPS = 600000
+
+PACKET_BYTES = 800
+
+NCPU = 8
+
+APP_PROTOS = ('http', 'dns', 'tls', 'ssh', 'failed')
+
+
+def run_dirname(conf, trace_file, runmode, ninstances, nnics, i, ts):
+    return '%s_%s_%s_%d_%dnics_%d_%d' % (conf, trace_file, runmode, ninstances, nnics, i, ts)
+
+
+def eve_timestamp(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f+0000')
+
+
+class RunModel:
+    """ Cumulative counters of a run, consistent across its files. """
+
+    def __init__(self, conf, nnics, ts, duration, rng):
+        params = runname.parse_conf(conf)
+        self.nc = params['nc']
+        self.nd = params['nd']
+        self.nnics = nnics
+        self.ts = ts
+        self.duration = duration
+        self.rng = rng
+        jitter = rng.uniform(0.95, 1.05)
+        self.offered_pps = OFFERED_PPS * jitter
+        self.pps = min(self.offered_pps, WORKER_PPS * self.nd * jitter)
+        self.cpu = min(100.0 * NCPU, 100.0 * (self.nc + self.nd) * self.pps / (WORKER_PPS * max(self.nd, 1)))
+        self.threads = ['W#%02d-eth%d' % (t + 1, t % nnics + 1) for t in range(self.nd)]
+
+    def counters(self, uptime):
+        """ Global counters of Suricata after uptime sec. """
+        packets = int(self.offered_pps * uptime)
+        decoded = int(self.pps * uptime)
+        return {
+            'capture': {'kernel_packets': packets, 'kernel_drops': packets - decoded},
+            'decoder': {'pkts': decoded, 'bytes': decoded * PACKET_BYTES, 'ipv4': decoded, 'tcp': int(decoded * 0.8),
+                        'udp': int(decoded * 0.2), 'avg_pkt_size': PACKET_BYTES, 'max_pkt_size': 1514},
+            'flow': {'memuse': 7000000 + 100 * uptime, 'spare': 10000, 'emerg_mode_entered': 0},
+            'tcp': {'sessions': decoded // 40, 'syn': decoded // 40, 'synack': decoded // 41, 'reassembly_gap': 0},
+            'detect': {'alert': int(decoded * 1e-4)},
+            'app_layer': {'flow': {p: decoded // (80 * (k + 1)) for k, p in enumerate(APP_PROTOS)}},
+        }
+
+    def stats(self, uptime):
+        c = self.counters(uptime)
+        record = {'uptime': uptime}
+        record.update(c)
+        record['threads'] = {}
+        share = len(self.threads)
+        for t in self.threads:
+            record['threads'][t] = {
+                'capture': {k: v // share for k, v in c['capture'].items()},
+                'decoder': {k: v // share for k, v in c['decoder'].items()},
+                'detect': {'alert': c['detect']['alert'] // share},
+            }
+        return record
+
+
+def write_eve(path, model, stats_interval, alerts, flows):
+    rng = model.rng
+    with open(path, 'w') as f:
+        for uptime in range(model.duration + 1):
+            ts = model.ts + uptime
+            for _ in range(int(rng.expovariate(1.0 / alerts)) if alerts > 0 else 0):
+                f.write(json.dumps({
+                    'timestamp': eve_timestamp(ts + rng.random()), 'flow_id': rng.getrandbits(52),
+                    'in_iface': 'eth1', 'event_type': 'alert', 'src_ip': '10.0.%d.%d' % (rng.randrange(256), rng.randrange(256)),
+                    'src_port': rng.randrange(1024, 65536), 'dest_ip': '192.168.1.%d' % rng.randrange(256),
+                    'dest_port': rng.choice((80, 443, 53, 22)), 'proto': 'TCP',
+                    'alert': {'action': 'allowed', 'gid': 1, 'signature_id': rng.randrange(2000000, 2030000), 'rev': 1,
+                              'signature': 'ET POLICY Synthetic alert', 'category': 'Potential Corporate Privacy Violation',
+                              'severity': rng.randrange(1, 4)},
+                }, separators=(',', ':')) + '\n')
+            for _ in range(int(rng.expovariate(1.0 / flows)) if flows > 0 else 0):
+                proto = rng.choice(APP_PROTOS)
+                event = {'timestamp': eve_timestamp(ts + rng.random()), 'flow_id': rng.getrandbits(52), 'in_iface': 'eth1',
+                         'event_type': 'flow', 'src_ip': '10.0.%d.%d' % (rng.randrange(256), rng.randrange(256)),
+                         'src_port': rng.randrange(1024, 65536), 'dest_ip': '192.168.1.%d' % rng.randrange(256),
+                         'dest_port': 80, 'proto': 'TCP', 'app_proto': proto,
+                         'flow': {'pkts_toserver': rng.randrange(1, 100), 'pkts_toclient': rng.randrange(1, 100),
+                                  'bytes_toserver': rng.randrange(60, 100000), 'bytes_toclient': rng.randrange(60, 100000),
+                                  'start': eve_timestamp(ts - rng.random() * 10), 'end': eve_timestamp(ts), 'age': 10,
+                                  'state': 'closed', 'reason': 'timeout'}}
+                if proto == 'http':
+                    event['event_type'] = 'http'
+                    event['http'] = {'hostname': 'example.com', 'url': '/index%d.html' % rng.randrange(1000),
+                                     'http_user_agent': 'curl/7.47.0', 'http_method': 'GET', 'protocol': 'HTTP/1.1',
+                                     'status': 200, 'length': rng.randrange(100000)}
+                elif proto == 'dns':
+                    event['event_type'] = 'dns'
+                    event['dns'] = {'type': 'query', 'id': rng.randrange(65536), 'rrname': 'host%d.example.com' % rng.randrange(1000),
+                                    'rrtype': 'A', 'tx_id': 0}
+                f.write(json.dumps(event, separators=(',', ':')) + '\n')
+            if uptime % stats_interval == 0:
+                f.write(json.dumps({'timestamp': eve_timestamp(ts), 'event_type': 'stats', 'stats': model.stats(uptime)},
+                                   separators=(',', ':')) + '\n')
+
+
+def _flatten(obj, prefix=''):
+    for k, v in obj.items():
+        if isinstance(v, dict):
+            yield from _flatten(v, prefix + k + '.')
+        else:
+            yield prefix + k, v
+
+
+def write_stats_log(path, model, stats_interval):
+    rule = '-' * 84 + '\n'
+    with open(path, 'w') as f:
+        for uptime in range(stats_interval, model.duration + 1, stats_interval):
+            date = datetime.datetime.fromtimestamp(model.ts + uptime, datetime.timezone.utc)
+            f.write(rule)
+            f.write('Date: %d/%d/%d -- %s (uptime: 0d, %02dh %02dm %02ds)\n' % (
+                date.month, date.day, date.year, date.strftime('%H:%M:%S'), uptime // 3600, uptime // 60 % 60, uptime % 60))
+            f.write(rule)
+            f.write('%-42s | %-25s | %s\n' % ('Counter', 'TM Name', 'Value'))
+            f.write(rule)
+            for name, value in _flatten(model.counters(uptime)):
+                f.write('%-42s | %-25s | %d\n' % (name, 'Total', value))
+
+
+def write_sysstat(path, model):
+    rng = model.rng
+    with open(path, 'w') as f:
+        f.write('Timestamp,  Uptime, NCPU, %CPU, ' + ', '.join(['%CPU' + str(i) for i in range(NCPU)]) +
+                ', %MEM, mem.total.KB, mem.used.KB, mem.avail.KB, mem.free.KB' +
+                ', %SWAP, swap.total.KB, swap.used.KB, swap.free.KB' +
+                ', io.read, io.write, io.read.KB, io.write.KB, io.read.ms, io.write.ms\n')
+        busy = min(NCPU, model.nc + model.nd)
+        for uptime in range(model.duration + 1):
+            cores = [min(100.0, max(0.0, rng.gauss(model.cpu / busy if i < busy else 2.0, 3.0))) for i in range(NCPU)]
+            used = 4000000 + 1000 * uptime
+            f.write('%d, %d, %d, %.1f, %s, %.1f, 16000000, %d, %d, %d, 0.0, 4000000, 0, 4000000, %d, %d, %d, %d, %d, %d\n' % (
+                model.ts + uptime, uptime, NCPU, sum(cores), ', '.join('%.1f' % c for c in cores), used / 160000.0,
+                used, 16000000 - used, 16000000 - used - 500000, rng.randrange(10), rng.randrange(50),
+                rng.randrange(100), rng.randrange(2000), rng.randrange(5), rng.randrange(20)))
+
+
+def write_psstat(path, model):
+    rng = model.rng
+    with open(path, 'w') as f:
+        f.write('Timestamp, Uptime, %CPU, io.read, io.read.KB, io.write, io.write.KB, mem.rss.KB, nctxsw, nthreads\n')
+        for uptime in range(model.duration + 1):
+            f.write('%d, %d, %.3f, 0, 0, %d, %d, %d, %d, %d\n' % (
+                model.ts + uptime, uptime, max(0.0, rng.gauss(model.cpu, model.cpu * 0.02)), rng.randrange(50),
+                rng.randrange(2000), 400000 + 50 * uptime, rng.randrange(100, 1000), model.nc + model.nd + 4))
+
+
+def write_netstat(path, nic, model):
+    rng = model.rng
+    pps = model.offered_pps / model.nnics
+    with open(path, 'w') as f:
+        f.write('Timestamp,  Uptime, NIC, sent.B, recv.B, sent.pkts, recv.pkts, err.in, err.out, drop.in, drop.out\n')
+        for uptime in range(model.duration + 1):
+            packets = int(rng.gauss(pps, pps * 0.01)) if uptime > 0 else 0
+            f.write('%d, %d, %s, %d, %d, %d, %d, 0, 0, 0, 0\n' % (
+                model.ts + uptime, uptime, nic, rng.randrange(1000), packets * PACKET_BYTES, rng.randrange(10), packets))
+
+
+def gzip_file(path):
+    with open(path, 'rb') as fin, gzip.open(path + '.gz', 'wb', compresslevel=1) as fout:
+        shutil.copyfileobj(fin, fout)
+    os.remove(path)
+
+
+def write_run(dirpath, conf, nnics, ts, duration, stats_interval, alerts, flows, seed, compress=False):
+    """ Write one run directory. Returns the total size of its files, in bytes. """
+    model = RunModel(conf, nnics, ts, duration, random.Random(seed))
+    os.makedirs(dirpath, exist_ok=True)
+    paths = [os.path.join(dirpath, name) for name in ('eve.json', 'stats.log', 'sysstat.receiver.csv',
+                                                      'psstat.suricata.csv')]
+    write_eve(paths[0], model, stats_interval, alerts, flows)
+    write_stats_log(paths[1], model, stats_interval)
+    write_sysstat(paths[2], model)
+    write_psstat(paths[3], model)
+    for n in range(nnics):
+        paths.append(os.path.join(dirpath, 'netstat.eth%d.csv' % (n + 1)))
+        write_netstat(paths[-1], 'eth%d' % (n + 1), model)
+    if compress:
+        for path in paths:
+            gzip_file(path)
+        paths = [p + '.gz' for p in paths]
+    return sum(os.path.getsize(p) for p in paths)
+
+
+def generate(data_dir, confs=DEFAULT_CONFS, repeats=3, duration=60, stats_interval=8, alerts=10, flows=100,
+             trace_file='snort.log', runmode='workers', ninstances=8, nnics=1, seed=0, compress=False,
+             workers=NUM_WORKERS):
+    """ Write repeats runs of every conf under data_dir. Returns (number of runs, total bytes). """
+    tasks = []
+    ts = 1493300000
+    for i in range(repeats):
+        for conf in confs:
+            dirpath = os.path.join(data_dir, run_dirname(conf, trace_file, runmode, ninstances, nnics, i, ts))
+            tasks.append((dirpath, conf, nnics, ts, duration, stats_interval, alerts, flows, seed * 1000003 + len(tasks),
+                          compress))
+            ts += duration + 10
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        sizes = list(executor.map(write_run, *zip(*tasks)))
+    return len(tasks), sum(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic run directories to benchmark the analysis tools.')
+    parser.add_argument('data_dir', type=str, help='Directory to write the run directories to.')
+    parser.add_argument('--confs', type=str, nargs='+', default=list(DEFAULT_CONFS),
+                        help='Conf tokens of the runs, e.g. "2c4d-af". Default: %(default)s.')
+    parser.add_argument('--repeats', type=int, default=3, help='Runs per conf. Default: %(default)s.')
+    parser.add_argument('--duration', type=int, default=60, help='Length of every run, in sec. Default: %(default)s.')
+    parser.add_argument('--stats-interval', type=int, default=8,
+                        help='Interval of the stats records, in sec. Default: %(default)s.')
+    parser.add_argument('--alerts', type=float, default=10, help='Mean alert events per sec. Default: %(default)s.')
+    parser.add_argument('--flows', type=float, default=100,
+                        help='Mean flow, http and dns events per sec. Default: %(default)s.')
+    parser.add_argument('--nics', type=int, default=1, help='NICs per run. Default: %(default)s.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generator. Default: %(default)s.')
+    parser.add_argument('--compress', default=False, action='store_true', help='If present, gzip the files.')
+    parser.add_argument('--workers', type=int, default=NUM_WORKERS,
+                        help='Number of worker processes. Default: number of CPUs.')
+    args = parser.parse_args()
+    for conf in args.confs:
+        try:
+            runname.parse_conf(conf)
+        except ValueError as e:
+            print(Colors.RED + 'Error: %s' % e + Colors.ENDC)
+            return 1
+    nruns, nbytes = generate(args.data_dir, args.confs, args.repeats, args.duration, args.stats_interval, args.alerts,
+                             args.flows, nnics=args.nics, seed=args.seed, compress=args.compress, workers=args.workers)
+    print(Colors.GREEN + 'Wrote %d runs, %.1f MB, to "%s".' % (nruns, nbytes / 1e6, args.data_dir) + Colors.ENDC)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+"""
+Check the load the iperf clients offered in every run against the load Suricata observed:
+
+  <output_dir>/iperf.csv                  totals of the clients and servers and the Suricata counters of every
+                                          run, with their ratios and whether they agree
+  <output_dir>/<run dir name>.iperf.csv   throughput, packets, lost datagrams and retransmits of every interval
+                                          of every client and server of the run
+"""
+
+import argparse
+import collections
+import os
+import sys
+
+from colors import Colors
+from dataparser import catalog
+from dataparser import iperf
+from dataparser import join
+from scaling_report import print_outcome, save_csv
+
+
+def interval_rows(results):
+    rows = []
+    for (nic, port), pair in iperf.pairs(results).items():
+        for r in pair:
+            if r is None:
+                continue
+            columns = r.intervals
+            for i in range(len(columns['Timestamp'])):
+                row = collections.OrderedDict([('role', r.role), ('nic', nic), ('port', port), ('protocol', r.protocol)])
+                row.update((name, float(values[i])) for name, values in columns.items())
+                row['bps'] = row['bytes'] * 8 / row['seconds'] if row['seconds'] > 0 else float('nan')
+                rows.append(row)
+    return rows
+
+
+def check_one(dirpath, output_dir, tolerance, step):
+    """ Return the cross check of the run, or None if it has no iperf result. """
+    results = iperf.load_run(dirpath)
+    if len(results) == 0:
+        return None
+    rows = interval_rows(results)
+    if len(rows):
+        save_csv(os.path.join(output_dir, os.path.basename(dirpath) + '.iperf.csv'), rows)
+    return iperf.cross_check(results, iperf.suricata_counts(join.join_run(dirpath, step)), tolerance)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the load offered by iperf against the load Suricata observed.')
+    parser.add_argument('data_dir', type=str, help='Directory holding the run directories.')
+    parser.add_argument('output_dir', type=str, help='Directory to write the report to.')
+    parser.add_argument('scan_depth', type=int, help='Depth of the run directories under data_dir.')
+    parser.add_argument('--where', type=str, default=None,
+                        help='SQL condition on the catalog columns to select runs.')
+    catalog.add_catalog_argument(parser)
+    parser.add_argument('--tolerance', type=float, default=iperf.DEFAULT_TOLERANCE,
+                        help='Relative difference up to which the loads agree. Default: %(default)s.')
+    parser.add_argument('--step', type=float, default=None,
+                        help='Interval, in sec, of the joined series. Default: the sampling interval of resmon.')
+    parser.add_argument('--workers', type=int, default=catalog.NUM_WORKERS,
+                        help='Number of worker processes. Default: number of CPUs.')
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_dir = os.path.abspath(args.output_dir)
+    results, errors = catalog.map_runs(args.data_dir, args.scan_depth, args.where, check_one,
+                                       (output_dir, args.tolerance, args.step), args.workers, args.catalog)
+    rows = []
+    for entry, check in results:
+        if check is None:
+            continue
+        row = collections.OrderedDict([('path', entry.path), ('conf', entry.conf), ('runmode', entry.runmode),
+                                       ('nnics', entry.nnics), ('ninstances', entry.ninstances),
+                                       ('i', entry.i), ('ts', entry.ts)])
+        row.update(check)
+        rows.append(row)
+    if len(rows):
+        save_csv(os.path.join(output_dir, 'iperf.csv'), rows)
+    for r in rows:
+        if r['verdict'] in ('short', 'excess'):
+            print(Colors.RED + 'Mismatch: %s: packet ratio %.4g, byte ratio %.4g' % (
+                  r['path'], r['packet_ratio'], r['byte_ratio']) + Colors.ENDC)
+    print_outcome('Runs', len(rows), errors,
+                  [('Mismatches', sum(1 for r in rows if r['verdict'] in ('short', 'excess')))])
+    return 1 if len(errors) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
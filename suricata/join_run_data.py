@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+
+"""
+Join the resmon, NIC, eve and counter series of every run into one wide CSV per run,
+"<output_dir>/<run dir name>.joined.csv", with derived pps, drop ratio and CPU per Mpps.
+"""
+
+import argparse
+import os
+import sys
+
+from dataparser import catalog
+from dataparser import join
+from scaling_report import print_outcome
+
+
+def join_one(dirpath, output_dir, step):
+    table = join.join_run(dirpath, step)
+    outpath = os.path.join(output_dir, os.path.basename(dirpath) + '.joined.csv')
+    join.save_csv(outpath, table)
+    return outpath, len(table['Timestamp']), len(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Join the time series of every run on one timestamp axis.')
+    parser.add_argument('data_dir', type=str, help='Directory holding the run directories.')
+    parser.add_argument('output_dir', type=str, help='Directory to write the joined tables to.')
+    parser.add_argument('scan_depth', type=int, help='Depth of the run directories under data_dir.')
+    parser.add_argument('--step', type=float, default=None,
+                        help='Interval, in sec, of the timestamp axis. Default: the sampling interval of resmon.')
+    parser.add_argument('--workers', type=int, default=catalog.NUM_WORKERS,
+                        help='Number of worker processes. Default: number of CPUs.')
+    parser.add_argument('--where', type=str, default=None,
+                        help='SQL condition on the catalog columns to select runs.')
+    catalog.add_catalog_argument(parser)
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_dir = os.path.abspath(args.output_dir)
+    results, errors = catalog.map_runs(args.data_dir, args.scan_depth, args.where, join_one,
+                                       (output_dir, args.step), args.workers, args.catalog)
+    for _, (outpath, nrows, ncols) in results:
+        print('Saved "%s" (%d rows, %d columns).' % (outpath, nrows, ncols))
+    print_outcome('Successes', len(results), errors)
+    return 1 if len(errors) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,8 +6,48 @@ import collections
 
 DataRepository = collections.namedtuple('DataRepository', ('repo_host', 'repo_user', 'repo_dir'))
 
-ReceiverHost = collections.namedtuple('ReceiverHost', ('host', 'user', 'tmpdir_root'))
+ReceiverHost = collections.namedtuple('ReceiverHost', ('host', 'user', 'tmpdir_root',
+                                                       'raw_dir'))  # Where raw logs of reduced runs are kept for lazy upload.
+ReceiverHost.__new__.__defaults__ = ('/var/tmp/suricata_raw',)
 
 SenderHost = collections.namedtuple('SenderHost', ('tmpdir_root'))
 
 RemoteNic = collections.namedtuple('RemoteNic', ('nic', 'ip'))
+
+# Single-host mode: the receiver and sender are network namespaces of this host, connected by veth pairs.
+LocalTopology = collections.namedtuple('LocalTopology', ('receiver_ns',  # Namespace of the receiver.
+                                                         'sender_ns',    # Namespace of the sender.
+                                                         'nnics',        # Number of veth pairs, i.e. receiver NICs.
+                                                         'nic_prefix',   # The NICs are named <nic_prefix><i> on both ends.
+                                                         'subnet'))      # Network the /30 of every pair is taken from.
+LocalTopology.__new__.__defaults__ = (1, 'veth', '10.199.0.0/24')
+
+SuricataTestCase = collections.namedtuple('SuricataTestCase',
+                                          ('name',                  # Name of the test.
+                                           'stat_delay_sec',        # Interval between polling resource usage.
+                                           'suricata_config_file',  # Config file to run Suricata with.
+                                           'enable_suricata',       # Spawn Suricata in the test.
+                                           'iperf_nics',            # A set of NICs to use for iperf server.
+                                           'iperf_instances',       # Number of iperf pairs to run.
+                                           'iperf_server_args',     # Command-line arguments for iperf server-side.
+                                           'iperf_client_args',     # Command-line arguments for iperf client-side.
+                                           'suricata_wrapper_cmd',  # Wrapper command to run Suricata (e.g., vtune).
+                                           'suricata_runmode',      # Runmode of Suricata. Either workers (default) or autofp.
+                                           'test_method',           # Either "tcpreplay" or "iperf".
+                                           'tcpreplay_tracefile',   # Trace file for tcpreplay.
+                                           'enable_vtune',          # Enable vtune or not.
+                                           'capture_cpus',          # CPUs the capture threads are bound to, if any.
+                                           'worker_cpus',           # CPUs the worker threads are bound to, if any.
+                                           'cluster_type',          # AF_PACKET cluster-type: flow, cpu or qm.
+                                           'ring_size',             # AF_PACKET ring-size in packets. None for default.
+                                           'block_size',            # AF_PACKET block-size in bytes (tpacket-v3). None for default.
+                                           'capture_mode',          # AF_PACKET capture: mmap, v3 (tpacket-v3) or nommap.
+                                           'defrag',                # AF_PACKET defrag.
+                                           'adaptive_duration',     # Run traffic until Suricata is in steady state.
+                                           'min_duration_sec',      # Shortest traffic duration in adaptive mode.
+                                           'max_duration_sec',      # Longest traffic duration in adaptive mode.
+                                           'counter_interval_sec',  # Interval to poll counters via the command socket. None to disable.
+                                           'compression',           # Compress run files: "auto" (zstd for logs where installed), "gzip" or None.
+                                           'raw_logs',              # Raw logs: "upload" with the run, or reduce the run on the receiver and keep them there ("lazy") or "drop" them.
+                                           ))
+SuricataTestCase.__new__.__defaults__ = ((), (), 'flow', None, None, 'mmap', True, False, 10, 300, None, 'auto', 'upload')
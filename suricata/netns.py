@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+# netns.py
+# Single-host test mode. The receiver and sender are network namespaces of this host, connected
+# by veth pairs that stand in for the receiver NICs, and commands run through "ip netns exec"
+# instead of SSH. Needs root.
+
+import ipaddress
+import logging
+import os
+import shlex
+import subprocess
+
+import spur
+
+from . import models
+
+
+# Where "ip netns" keeps the named namespaces.
+NETNS_DIR = '/var/run/netns'
+
+
+def netns_cmd(ns, cmd, env=None):
+    """
+    The command to run cmd in namespace ns. It runs as root, so a leading sudo is dropped. pkill only
+    matches the processes of the namespace, as it would on a host of its own.
+    """
+    cmd = list(cmd)
+    if len(cmd) and cmd[0] == 'sudo':
+        cmd = cmd[1:]
+    if len(cmd) and cmd[0] == 'pkill':
+        cmd = ['bash', '-c', 'exec pkill --ns $$ --nslist net ' + ' '.join(shlex.quote(a) for a in cmd[1:])]
+    if env:
+        # sudo resets the environment.
+        cmd = ['env'] + ['%s=%s' % (k, v) for k, v in sorted(env.items())] + cmd
+    return ['sudo', 'ip', 'netns', 'exec', ns] + cmd
+
+
+class NetnsShell(spur.LocalShell):
+    """ spur shell running the commands in a network namespace of this host. Files are the ones of the host. """
+
+    def __init__(self, ns):
+        self.ns = ns
+
+    def spawn(self, command, *args, **kwargs):
+        return super().spawn(netns_cmd(self.ns, command, kwargs.pop('update_env', None)), *args, **kwargs)
+
+
+def _call(cmd):
+    retval = subprocess.call(cmd)
+    if retval != 0:
+        raise RuntimeError('Command "%s" returned %d.' % (' '.join(cmd), retval))
+
+
+def setup(topology):
+    """
+    Create the namespaces of the topology, with nnics veth pairs between them. Both ends of pair i
+    are named <nic_prefix><i>, so that the sender sends through the NIC of the receiver's name, and
+    get the two addresses of the i-th /30 of the subnet.
+    :param models.LocalTopology topology:
+    :return: The receiver NICs as a tuple of RemoteNic.
+    """
+    teardown(topology)
+    logging.info('Creating namespaces "%s" and "%s".', topology.receiver_ns, topology.sender_ns)
+    for ns in (topology.receiver_ns, topology.sender_ns):
+        _call(['sudo', 'ip', 'netns', 'add', ns])
+        _call(['sudo', 'ip', '-n', ns, 'link', 'set', 'lo', 'up'])
+    subnets = ipaddress.ip_network(topology.subnet).subnets(new_prefix=30)
+    nics = []
+    for i in range(topology.nnics):
+        name = '%s%d' % (topology.nic_prefix, i)
+        receiver_ip, sender_ip = list(next(subnets).hosts())
+        # The ends get their final name once in their namespace, where it is free.
+        ends = ((topology.receiver_ns, 'nsr%d' % i, receiver_ip), (topology.sender_ns, 'nss%d' % i, sender_ip))
+        _call(['sudo', 'ip', 'link', 'add', ends[0][1], 'type', 'veth', 'peer', 'name', ends[1][1]])
+        for ns, tmp_name, ip in ends:
+            _call(['sudo', 'ip', 'link', 'set', tmp_name, 'netns', ns])
+            _call(['sudo', 'ip', '-n', ns, 'link', 'set', tmp_name, 'name', name])
+            _call(['sudo', 'ip', '-n', ns, 'addr', 'add', '%s/30' % ip, 'dev', name])
+            _call(['sudo', 'ip', '-n', ns, 'link', 'set', name, 'up'])
+        logging.info('Created NIC "%s": receiver %s, sender %s.', name, receiver_ip, sender_ip)
+        nics.append(models.RemoteNic(nic=name, ip=str(receiver_ip)))
+    return tuple(nics)
+
+
+def teardown(topology):
+    """ Delete the namespaces of the topology, which deletes their veth pairs. """
+    for ns in (topology.receiver_ns, topology.sender_ns):
+        if os.path.exists(os.path.join(NETNS_DIR, ns)):
+            logging.info('Deleting namespace "%s".', ns)
+            subprocess.call(['sudo', 'ip', 'netns', 'del', ns])
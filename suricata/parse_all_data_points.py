@@ -1,16 +1,21 @@
 #!/usr/bin/python3
 
+import argparse
 import concurrent.futures
 import os
 import sys
-import multiprocessing
 import threading
 import traceback
 
 from colors import Colors
+from dataparser import align
+from dataparser import cache
+from dataparser import catalog
+from dataparser import compressed
 from dataparser import eve
 from dataparser import mon
 from dataparser import exceptions
+from dataparser import statschema
 
 
 evecollections = dict()
@@ -19,20 +24,32 @@ psstatcollections = dict()
 eveparser = eve.EveParser()
 sysstatparser = mon.SysStatParser()
 psstatparser = mon.PsStatParser()
+# Cache of parsed files, if enabled.
+parsecache = None
+# Writer of the collections whose runs are all in, set by main.
+writer = None
 
-# The number of concurrent workers equals the number of CPU threads.
-NUM_WORKERS = multiprocessing.cpu_count() 
+# Files parsed for every run: (kind, file names, parser, collections, collection class).
+# The first of the file names present in the run directory is parsed.
+RUN_FILES = (
+    ('eve', (eve.STATS_FILE, 'eve.json'), eveparser, evecollections, eve.EveCollection),
+    ('sysstat', ('sysstat.receiver.csv',), sysstatparser, sysstatcollections, mon.SysStatCollection),
+    ('psstat', ('psstat.suricata.csv',), psstatparser, psstatcollections, mon.PsStatCollection),
+)
 
 
-def get_all_logdirs(path, depth=2):
-    if depth == 1:
-        print('Adding all dirs under "%s".' % path)
-        return sorted([path + '/' + i for i in os.listdir(path) if os.path.isdir(path + '/' + i)])
-    all_logdirs = []
-    for name in os.listdir(path):
-        if os.path.isdir(path + '/' + name):
-            all_logdirs += get_all_logdirs(path + '/' + name, depth=depth-1)
-    return all_logdirs
+def run_file_path(dirpath, filenames):
+    """ Path of the first of the file names present in the run directory, or of the last one if none is. """
+    for filename in filenames[:-1]:
+        if compressed.exists(os.path.join(dirpath, filename)):
+            return os.path.join(dirpath, filename)
+    return os.path.join(dirpath, filenames[-1])
+
+
+def entry_args(entry):
+    """ Collection arguments of a catalog entry: (conf, trace_file, runmode, ninstances, nnics, i, ts). """
+    return (entry.conf, entry.trace_file, entry.runmode, str(entry.ninstances), '%dnics' % entry.nnics,
+            str(entry.i), str(entry.ts))
 
 
 _collection_lock = threading.Lock()
@@ -54,8 +71,90 @@ def get_collection_name(conf, trace_file, runmode, ninstances, nnics, i, ts):
     return ','.join([conf, trace_file, runmode, ninstances, nnics])
 
 
+def sort_by_collection(entries):
+    """ Order the entries so that the runs of every collection are parsed one after another. """
+    return sorted(entries, key=lambda entry: get_collection_name(*entry_args(entry)))
+
+
+class CollectionWriter:
+    """
+    Write every collection as soon as all its runs are in, and drop it.
+
+    The files every collection expects are counted from the catalog entries before parsing starts.
+    Every parsed, failed or missing file counts down its collection; the collection that reaches 0
+    is written by a thread pool and removed from its dict. The runs are parsed in the order of their
+    collections, so besides the max_pending collections being written, only the collections of the
+    tasks in flight are being filled, usually one or two per kind of file. Peak memory is then a few
+    times the largest collection rather than the whole dataset. done() blocks until a collection is
+    written when max_pending are. Writing holds the GIL most of the time, so more writer threads
+    gain little and only hold more finished collections in memory.
+    """
+
+    def __init__(self, entries, output_dir, to_xlsx_args, max_pending=1):
+        self.output_dir = output_dir
+        self.to_xlsx_args = to_xlsx_args
+        self.max_pending = max_pending
+        self.pending = dict()
+        for entry in entries:
+            name = get_collection_name(*entry_args(entry))
+            for kind, _, _, _, _ in RUN_FILES:
+                self.pending[(kind, name)] = self.pending.get((kind, name), 0) + 1
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_pending)
+        self.futures = dict()
+        self.num_written = 0
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def done(self, kind, name):
+        """ Count down the collection of a file that was merged, failed or does not exist. """
+        with self._lock:
+            self.pending[(kind, name)] -= 1
+            if self.pending[(kind, name)] > 0:
+                return
+            del self.pending[(kind, name)]
+            # The collection is not created if no run of it has the file.
+            collection = get_run_file_collections(kind).pop(name, None)
+            if collection is not None:
+                future = self.executor.submit(collection.to_xlsx, *self.to_xlsx_args, output_dir=self.output_dir)
+                self.futures[future] = collection.name
+        while len(self.futures) >= self.max_pending:
+            finished, _ = concurrent.futures.wait(list(self.futures), return_when=concurrent.futures.FIRST_COMPLETED)
+            self._reap(finished)
+
+    def _reap(self, finished):
+        for future in finished:
+            with self._lock:
+                name = self.futures.pop(future, None)
+            if name is None:
+                continue
+            try:
+                future.result()
+                self.num_written += 1
+            except Exception as e:
+                self.errors.append((name, str(e)))
+                print(Colors.RED + 'Error: %s' % e + Colors.ENDC)
+                print(traceback.format_exc())
+
+    def close(self):
+        """ Wait for all collections to be written. Collections still pending had runs that never came in. """
+        for kind, name in list(self.pending.keys()):
+            self.pending[(kind, name)] = 1
+            self.done(kind, name)
+        self._reap(list(self.futures))
+        self.executor.shutdown()
+
+
 def _parse_csvstat(collections, cls, parser, path, conf, trace_file, runmode, ninstances, nnics, i, ts):
-    if os.path.isfile(path):
+    try:
+        _parse_csvstat_file(collections, cls, parser, path, conf, trace_file, runmode, ninstances, nnics, i, ts)
+    finally:
+        if writer is not None:
+            kind = [k for k, _, _, c, _ in RUN_FILES if c is collections][0]
+            writer.done(kind, get_collection_name(conf, trace_file, runmode, ninstances, nnics, i, ts))
+
+
+def _parse_csvstat_file(collections, cls, parser, path, conf, trace_file, runmode, ninstances, nnics, i, ts):
+    if compressed.exists(path):
         thname = threading.current_thread().name
         if thname not in task_count:
             _task_count_lock.acquire()
@@ -68,7 +167,10 @@ def _parse_csvstat(collections, cls, parser, path, conf, trace_file, runmode, ni
         col = get_collection(collections, name, cls)
         try:
             id = col.get_key(conf, trace_file, runmode, ninstances, nnics, i, ts)
-            data = parser.parse(path)
+            if parsecache is not None:
+                data = parsecache.parse(path, parser)
+            else:
+                data = parser.parse(path)
             col.add(id, data)
         except exceptions.NoContentException as ex:
             print('Error: ' + str(ex))
@@ -90,23 +192,127 @@ def parse_eve(path, conf, trace_file, runmode, ninstances, nnics, i, ts):
         path, conf, trace_file, runmode, ninstances, nnics, i, ts)
 
 
+def parse_run_file(kind, path):
+    """
+    Parse one file of a run. Runs in a worker process, so it only returns the parsed data and
+    leaves merging into the collections to the parent. Returns None if the file does not exist.
+    """
+    if not compressed.exists(path):
+        return None
+    return get_run_file_parser(kind).parse(path)
+
+
+def get_run_file_parser(kind):
+    for k, _, parser, _, _ in RUN_FILES:
+        if k == kind:
+            return parser
+    raise ValueError('Unknown kind of run file "%s".' % kind)
+
+
+def get_run_file_collections(kind):
+    for k, _, _, collections, _ in RUN_FILES:
+        if k == kind:
+            return collections
+    raise ValueError('Unknown kind of run file "%s".' % kind)
+
+
+def merge_run_file(kind, data, conf, trace_file, runmode, ninstances, nnics, i, ts):
+    for k, _, _, collections, cls in RUN_FILES:
+        if k == kind:
+            name = get_collection_name(conf, trace_file, runmode, ninstances, nnics, i, ts)
+            col = get_collection(collections, name, cls)
+            col.add(col.get_key(conf, trace_file, runmode, ninstances, nnics, i, ts), data)
+
+
+def _init_worker(eve_schema):
+    """ Initializer of the worker processes, which do not inherit the settings of main under spawn. """
+    eveparser.schema = eve_schema
+
+
+def traverse_logdir_processes(entries, num_workers=catalog.NUM_WORKERS, eve_schema=eve.EVE_STRUCTURE):
+    """
+    Like traverse_logdir, but parse in a process pool so that the parsers do not share the GIL.
+    At most two tasks per worker are in flight, so parsed results do not pile up in the parent.
+    :param eve_schema: Schema of the eve columns to extract, see statschema.
+    """
+    num_successes = 0
+    num_cached = 0
+    errors = []
+    all_futures = dict()
+    max_in_flight = num_workers * 2
+
+    def collect(futures):
+        nonlocal num_successes
+        for future in futures:
+            kind, filepath, args = all_futures.pop(future)
+            try:
+                data = future.result()
+                if data is not None:
+                    merge_run_file(kind, data, *args)
+                    if parsecache is not None:
+                        parsecache.put(filepath, get_run_file_parser(kind), data)
+                    print('\033[92m[%s]\033[0m Done "%s".' % (threading.current_thread().name, filepath))
+                num_successes += 1
+            except exceptions.NoContentException as e:
+                print('Error: ' + str(e))
+                num_successes += 1
+            except Exception as e:
+                errors.append((filepath, str(e)))
+                print(Colors.RED + 'Error: %s' % e + Colors.ENDC)
+            finally:
+                if writer is not None:
+                    writer.done(kind, get_collection_name(*args))
+
+    print('INFO: using %d worker processes to parse %d log dirs.' % (num_workers, len(entries)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker,
+                                                initargs=(eve_schema,)) as executor:
+        # The workers are forked on the first task. Fork them before the writer runs any thread.
+        executor.submit(os.getpid).result()
+        for entry in entries:
+            dirpath = entry.path
+            args = entry_args(entry)
+            for kind, filenames, parser, _, _ in RUN_FILES:
+                filepath = run_file_path(dirpath, filenames)
+                if parsecache is not None and compressed.exists(filepath):
+                    data = parsecache.get(filepath, parser)
+                    if data is not None:
+                        merge_run_file(kind, data, *args)
+                        num_cached += 1
+                        if writer is not None:
+                            writer.done(kind, get_collection_name(*args))
+                        continue
+                all_futures[executor.submit(parse_run_file, kind, filepath)] = (kind, filepath, args)
+                if len(all_futures) >= max_in_flight:
+                    finished, _ = concurrent.futures.wait(list(all_futures),
+                                                          return_when=concurrent.futures.FIRST_COMPLETED)
+                    collect(finished)
+        print('\033[94m[%s]\033[0m \033[92mWaiting for the last %d tasks to complete.\033[0m' % (
+              threading.current_thread().name, len(all_futures)))
+        collect(concurrent.futures.as_completed(list(all_futures)))
+    print(Colors.GRAY + '-' * 80 + Colors.ENDC)
+    print(Colors.CYAN + 'Summary:' + Colors.ENDC)
+    print(Colors.GREEN + 'Successes:\t%d' % num_successes + Colors.ENDC)
+    print(Colors.GREEN + 'From cache:\t%d' % num_cached + Colors.ENDC)
+    print(Colors.RED + 'Failures:\t%d' % len(errors) + Colors.ENDC)
+    for e in sorted(errors):
+        print(Colors.RED + '|- %s: %s' % e + Colors.ENDC)
+
+
 def execute(all_futures, executor, func, *args):
     print('\033[94m[%s]\033[0m Adding Task %d - "%s"...' % (threading.current_thread().name, len(all_futures), args[0]))
     all_futures.add(executor.submit(func, *args))
 
 
-def traverse_logdir(path, scan_depth):
+def traverse_logdir(entries):
     num_successes = 0
     errors = []
-    all_logdirs = get_all_logdirs(path, scan_depth)
     all_futures = set()
-    print('INFO: using %d concurrent workers to parse %d log dirs.' % (NUM_WORKERS * 2, len(all_logdirs)))
-    with concurrent.futures.ThreadPoolExecutor(max_workers=NUM_WORKERS * 2) as executor:
-        for dirpath in all_logdirs:
-            parent, dirname = os.path.split(dirpath)
-            # Folder name is like "2c4d_snort.log_workers_8_1nics_0_1493306210".
-            conf, trace_file, runmode, ninstances, nnics, i, ts = dirname.split('_')
-            execute(all_futures, executor, parse_eve, dirpath + '/eve.json', conf, trace_file, runmode, ninstances, nnics, i, ts)
+    print('INFO: using %d concurrent workers to parse %d log dirs.' % (catalog.NUM_WORKERS * 2, len(entries)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=catalog.NUM_WORKERS * 2) as executor:
+        for entry in entries:
+            dirpath = entry.path
+            conf, trace_file, runmode, ninstances, nnics, i, ts = entry_args(entry)
+            execute(all_futures, executor, parse_eve, run_file_path(dirpath, RUN_FILES[0][1]), conf, trace_file, runmode, ninstances, nnics, i, ts)
             execute(all_futures, executor, parse_sysstat, dirpath + '/sysstat.receiver.csv', conf, trace_file, runmode, ninstances, nnics, i, ts)
             execute(all_futures, executor, parse_psstat, dirpath + '/psstat.suricata.csv', conf, trace_file, runmode, ninstances, nnics, i, ts)
         print('\033[94m[%s]\033[0m \033[92mWaiting for all tasks to complete.\033[0m' % threading.current_thread().name)
@@ -127,9 +333,54 @@ def traverse_logdir(path, scan_depth):
 
 
 def main():
-    data_dir = sys.argv[1]
-    output_dir = sys.argv[2]
-    scan_depth = int(sys.argv[3])
+    parser = argparse.ArgumentParser(description='Parse all run directories into xlsx workbooks.')
+    parser.add_argument('data_dir', type=str, help='Directory holding the run directories.')
+    parser.add_argument('output_dir', type=str, help='Directory to write the workbooks to.')
+    parser.add_argument('scan_depth', type=int, help='Depth of the run directories under data_dir.')
+    catalog.add_catalog_argument(parser)
+    parser.add_argument('--no-rescan', default=False, action='store_true',
+                        help='If present, use the catalog as is and do not look for new runs.')
+    parser.add_argument('--where', type=str, default=None,
+                        help='SQL condition on the catalog columns to select runs, e.g. "nc = 2 AND runmode = \'workers\'".')
+    parser.add_argument('--mode', type=str, choices=('process', 'thread'), default='process',
+                        help='Parse in a process pool or a thread pool. Default: "process".')
+    parser.add_argument('--workers', type=int, default=catalog.NUM_WORKERS,
+                        help='Number of worker processes in process mode. Default: number of CPUs.')
+    parser.add_argument('--cache', type=str, default=None,
+                        help='SQLite file to cache parsed results in. Default: ".parsecache.sqlite" in data_dir.')
+    parser.add_argument('--no-cache', default=False, action='store_true',
+                        help='If present, parse every file and do not use the cache.')
+    parser.add_argument('--invalidate-cache', default=False, action='store_true',
+                        help='If present, drop all cached results before parsing.')
+    parser.add_argument('--eve-columns', type=str, choices=('default', 'all'), default='default',
+                        help='Eve stats counters to extract: the default set, or all of them including the '
+                             'per-thread ones. Default: "default".')
+    parser.add_argument('--percentiles', type=float, nargs='*', default=[],
+                        help='Percentiles to summarize besides the median, e.g. "5 95".')
+    parser.add_argument('--formulas', default=False, action='store_true',
+                        help='If present, write the median of the Summary sheet as Excel formulas over the run sheets.')
+    parser.add_argument('--align', type=str, choices=('linear', 'nearest', 'row'), default='linear',
+                        help='How to align the runs before the summary: interpolate onto a common uptime grid, '
+                             'take the nearest sample on the grid, or match rows by index. Default: "linear".')
+    parser.add_argument('--align-step', type=float, default=None,
+                        help='Interval, in sec, of the uptime grid. Default: the median sampling interval.')
+    parser.add_argument('--align-tolerance', type=float, default=None,
+                        help='Max distance, in sec, to the nearest sample. Default: half the grid interval.')
+    parser.add_argument('--pending-writes', type=int, default=1,
+                        help='Max number of collections written at once while parsing goes on. Every one is held '
+                             'in memory until it is written. Default: %(default)s.')
+    parser.add_argument('--constant-memory', default=None, action='store_true',
+                        help='If present, write all workbooks in constant memory mode. Default: only the large ones.')
+    args = parser.parse_args()
+    if args.formulas and args.align != 'row':
+        print('INFO: formulas refer to the rows of the run sheets, so runs are aligned by row.')
+        args.align = 'row'
+    align_opts = align.AlignOptions(args.align, args.align_step, args.align_tolerance) if args.align != 'row' else None
+    data_dir = args.data_dir
+    output_dir = args.output_dir
+    scan_depth = args.scan_depth
+    cache_path = os.path.abspath(args.cache) if args.cache is not None else None
+    catalog_path = os.path.abspath(args.catalog) if args.catalog is not None else None
     try:
         os.makedirs(output_dir)
         output_dir = os.path.abspath(output_dir)
@@ -145,23 +396,44 @@ def main():
         print('Error: cannot chdir to path "%s": %s.' % (data_dir, str(e)))
         return 1        
     
-    traverse_logdir('.', scan_depth)
+    if args.eve_columns == 'all':
+        # The worker processes are given the schema when they start.
+        eveparser.schema = statschema.ALL_NUMERIC
+
+    global parsecache
+    if not args.no_cache:
+        parsecache = cache.ParseCache(cache_path or os.path.abspath('.parsecache.sqlite'))
+        if args.invalidate_cache:
+            print('INFO: invalidating cache "%s".' % parsecache.db_path)
+            parsecache.invalidate()
+
+    with catalog.Catalog('.', catalog_path) as runs:
+        if not args.no_rescan:
+            nchanged, nremoved, skipped = runs.update(scan_depth)
+            print('INFO: catalog "%s": %d runs added or updated, %d removed.' % (runs.db_path, nchanged, nremoved))
+            for path, reason in skipped:
+                print(Colors.YELLOW + 'Warning: skip "%s": %s' % (path, reason) + Colors.ENDC)
+        entries = sort_by_collection(runs.select(args.where))
+
+    global writer
+    writer = CollectionWriter(entries, output_dir, (args.percentiles, args.formulas, args.constant_memory, align_opts),
+                              max(1, args.pending_writes))
+    if args.mode == 'process':
+        traverse_logdir_processes(entries, args.workers, eveparser.schema)
+    else:
+        traverse_logdir(entries)
+
+    writer.close()
+    print('INFO: wrote %d collections, %d failed.' % (writer.num_written, len(writer.errors)))
+
+    if parsecache is not None:
+        print('INFO: cache hits: %d, misses: %d.' % (parsecache.hits, parsecache.misses))
+        parsecache.close()
 
     try:
         os.chdir(output_dir)
     except Exception as e:
         print('Error: cannot chdir to path "%s": %s. Use pwd ("%s") instead.' % (output_dir, str(e), os.getcwd()))
-    with concurrent.futures.ThreadPoolExecutor(max_workers=NUM_WORKERS * 2) as executor:
-        futures = set()
-        for col in (evecollections, sysstatcollections, psstatcollections):
-            for name, collection in col.items():
-                futures.add(executor.submit(collection.to_xlsx))
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                print(Colors.RED + 'Error: %s' % e + Colors.ENDC)
-                print(traceback.format_exc())
     
     os.system("grep -r 'Sample size' | sort | tee 'sample_size.txt'")
 
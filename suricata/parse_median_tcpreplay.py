@@ -5,6 +5,17 @@ import csv
 import os
 import subprocess
 
+import numpy as np
+
+from colors import Colors
+from dataparser import catalog
+from dataparser import compressed
+from dataparser import mon
+from dataparser import steadystate
+
+
+# Samples of the first seconds, while Suricata starts up, are left out if no steady window is found.
+WARMUP_SEC = 8
 
 os.chdir('525')
 
@@ -20,57 +31,68 @@ def collect_metrics(dirname):
         'avg_cpu': 0,
         'max_mem_rss': 0,
     }
-    with open(os.path.join(dirname, 'stats.log'), 'r') as f:
+    with compressed.open_text(os.path.join(dirname, 'stats.log')) as f:
         for line in f:
             for k in d.keys():
                 if line.startswith(k):
                     v = line.split('|')[-1].strip()
                     d[k] = v
-    i = 0
-    with open(os.path.join(dirname, 'psstat.suricata.csv'), 'r') as f:
-        rdr = csv.reader(f)
-        for row in rdr:
-            if row[0] == 'Timestamp':
-                continue
-            uptime = int(row[1].strip())
-            if uptime < 8:
-                continue
-            ps['avg_cpu'] = ps['avg_cpu'] + float(row[2].strip())
-            ps['max_mem_rss'] = max(ps['max_mem_rss'], float(row[7].strip()))
-            i = i + 1
-    ps['avg_cpu'] = int(ps['avg_cpu'] / i)
+    ps_cols = mon.PsStatParser().parse(os.path.join(dirname, 'psstat.suricata.csv'))
+    timestamps, cpu, rss = ps_cols['Timestamp'], ps_cols['%CPU'], ps_cols['mem.rss.KB']
+    # Only count the steady-state window, either as detected during the test or from the CPU usage.
+    window = steadystate.load_window(dirname)
+    if window is not None and window['steady']:
+        start_ts, end_ts = window['start_ts'], window['end_ts']
+        in_window = (timestamps >= start_ts) & (timestamps <= end_ts)
+    else:
+        warm = ps_cols['Uptime'] >= WARMUP_SEC
+        window = steadystate.find_steady_window(timestamps[warm].tolist(), {'cpu': cpu[warm].tolist()})
+        in_window = warm
+        if window is not None:
+            start_ts, end_ts = window
+            in_window = warm & (timestamps >= start_ts) & (timestamps <= end_ts)
+        elif warm.any():
+            start_ts, end_ts = timestamps[warm][0], timestamps[warm][-1]
+    if not in_window.any():
+        print(Colors.YELLOW + 'Warning: skip "%s": no psstat sample in the measurement window.' % dirname + Colors.ENDC)
+        return None
+    ps['avg_cpu'] = int(np.mean(cpu[in_window]))
+    ps['max_mem_rss'] = rss[in_window].max()
+    ps['window_start'] = start_ts
+    ps['window_end'] = end_ts
     return d, ps
 
 
 all_tasks = dict()
-header = ('nc', 'nd', 'runmode', 'nnics', 'ninst', 'capture_pkts', 'drop_pkts', 'decoder_pkts', 'decoder_bytes', 'avg_cpu', 'max_rss', 'i', 'timestamp', 'trace')
+header = ('nc', 'nd', 'runmode', 'nnics', 'ninst', 'capture_pkts', 'drop_pkts', 'decoder_pkts', 'decoder_bytes', 'avg_cpu', 'max_rss', 'i', 'timestamp', 'trace',
+          'affinity', 'skip_smt', 'cluster_type', 'ring_size', 'block_size', 'capture_mode', 'defrag',
+          'window_start', 'window_end')
 rows = []
+with catalog.Catalog('.') as runs:
+    runs.update(1)
+    entries = runs.select()
 with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
-    for d in os.listdir('.'):
-        f = executor.submit(collect_metrics, d)
-        all_tasks[f] = d
+    for run in entries:
+        f = executor.submit(collect_metrics, run.path)
+        all_tasks[f] = run
     for f in concurrent.futures.as_completed(all_tasks):
-        # Folder name is like "2c4d_snort.log_workers_8_1nics_0_1493306210".
-        dirname = all_tasks[f]
-        conf, trace_file, runmode, ninstances, nnics, i, ts = dirname.split('_')
-        # How many capturers.
-        nc = int(conf.split('c', maxsplit=1)[0])
-        nd = int(conf.split('c', maxsplit=1)[1][:-1])
-        # How many parallel iperfs / tcpreplays to each NIC.
-        ninstances = int(ninstances)
-        # How many NICs are involved.
-        nnics = int(nnics.split('n', maxsplit=1)[0])
-        # Which run of the test case.
-        i = int(i)
-        # Timestamp of the test run.
-        ts = int(ts)
+        # nc/nd: how many capturers and workers. ninstances: how many parallel iperfs / tcpreplays
+        # to each NIC. nnics: how many NICs are involved. i: which run of the test case.
+        # ts: timestamp of the test run. The rest are the AF_PACKET options of the config.
+        run = all_tasks[f]
         # Result
-        d, ps = f.result()
-        rows.append((nc, nd, runmode, nnics, ninstances,
+        result = f.result()
+        if result is None:
+            continue
+        d, ps = result
+        rows.append((run.nc, run.nd, run.runmode, run.nnics, run.ninstances,
                      d['capture.kernel_packets'], d['capture.kernel_drops'],
                      d['decoder.pkts'], d['decoder.bytes'],
                      ps['avg_cpu'], ps['max_mem_rss'],
-                     i, ts, trace_file))
+                     run.i, run.ts, run.trace_file,
+                     run.affinity or 'none', int(run.skip_smt), run.cluster_type,
+                     run.ring_size or 0, run.block_size or 0, run.capture_mode, int(run.defrag),
+                     ps['window_start'], ps['window_end']))
 
 with open('../tcpreplay.csv', 'w') as f:
     writer = csv.writer(f)
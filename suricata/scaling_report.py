@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+
+"""
+Report how Suricata scales over the capture/worker configurations of the runs:
+
+  <output_dir>/scaling.csv    one row per configuration, medians over its repeats
+  <output_dir>/ranking.csv    configurations ranked by lossless pps per core
+  <output_dir>/scaling.xlsx   one sheet per scaling curve, with pps and efficiency charts
+"""
+
+import argparse
+import csv
+import math
+import os
+import sys
+
+import xlsxwriter
+
+from colors import Colors
+from dataparser import catalog
+from dataparser import scaling
+
+
+def save_csv(path, points):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(list(points[0].keys()))
+        for p in points:
+            writer.writerow(['' if isinstance(v, float) and math.isnan(v) else v for v in p.values()])
+
+
+def print_outcome(label, count, errors, notes=()):
+    """
+    Print the errors of catalog.map_runs and the tail of an analysis: the count of label, the
+    (label, count) pairs of notes and the number of failures.
+    """
+    for path, e in errors:
+        print(Colors.RED + 'Error: %s: %s' % (path, e) + Colors.ENDC)
+    print(Colors.GREEN + '%s:\t%d' % (label, count) + Colors.ENDC)
+    for note, n in notes:
+        print(Colors.RED + '%s:\t%d' % (note, n) + Colors.ENDC)
+    print(Colors.RED + 'Failures:\t%d' % len(errors) + Colors.ENDC)
+
+
+def curve_name(key):
+    """ Short name of a curve from the dimensions that are set. """
+    d = dict(zip(scaling.CURVE_KEYS, key))
+    parts = [d['runmode'], '%dnics' % d['nnics'], str(d['ninstances']), d['trace_file']]
+    for k in ('affinity', 'cluster_type', 'capture_mode'):
+        if d[k] is not None:
+            parts.append(str(d[k]))
+    for k in ('ring_size', 'block_size'):
+        if d[k]:
+            parts.append('%s%d' % (k[0], d[k]))
+    if d['skip_smt']:
+        parts.append('nosmt')
+    if d['defrag'] == 0:
+        parts.append('nodefrag')
+    return ','.join(parts)
+
+
+def save_xlsx(path, curves):
+    columns = ('nc', 'nd', 'cores', 'repeats', 'pps', 'drop_ratio', 'cpu_per_mpps', 'speedup', 'efficiency',
+               'pps_per_core', 'lossless')
+    workbook = xlsxwriter.Workbook(path, {'nan_inf_to_errors': True})
+    for idx, (key, points) in enumerate(curves.items()):
+        # Sheet names are limited to 31 characters.
+        sheet_name = 'C%d' % (idx + 1)
+        sheet = workbook.add_worksheet(sheet_name)
+        sheet.write(0, 0, curve_name(key))
+        sheet.write_row(1, 0, columns)
+        for row, p in enumerate(points, start=2):
+            sheet.write_row(row, 0, [int(p[c]) if c == 'lossless' else p[c] for c in columns])
+        last = len(points) + 1
+        for col_name, title, anchor in (('pps', 'Packets per second', 'M2'), ('efficiency', 'Parallel efficiency', 'M18')):
+            col = columns.index(col_name)
+            chart = workbook.add_chart({'type': 'scatter', 'subtype': 'straight_with_markers'})
+            chart.add_series({'name': col_name,
+                              'categories': [sheet_name, 2, columns.index('cores'), last, columns.index('cores')],
+                              'values': [sheet_name, 2, col, last, col]})
+            chart.set_title({'name': title})
+            chart.set_x_axis({'name': 'Cores'})
+            chart.set_legend({'none': True})
+            sheet.insert_chart(anchor, chart)
+    workbook.close()
+
+
+def collect_run_metrics(data_dir, scan_depth, where=None, step=None, workers=catalog.NUM_WORKERS,
+                        catalog_path=None):
+    """ Return [(catalog entry, metrics), ...] ordered by path, and [(path, error), ...]. """
+    return catalog.map_runs(data_dir, scan_depth, where, scaling.run_metrics, (step,), workers, catalog_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scaling efficiency of the capture/worker configurations.')
+    parser.add_argument('data_dir', type=str, help='Directory holding the run directories.')
+    parser.add_argument('output_dir', type=str, help='Directory to write the report to.')
+    parser.add_argument('scan_depth', type=int, help='Depth of the run directories under data_dir.')
+    parser.add_argument('--where', type=str, default=None,
+                        help='SQL condition on the catalog columns to select runs.')
+    catalog.add_catalog_argument(parser)
+    parser.add_argument('--loss-tolerance', type=float, default=scaling.DEFAULT_LOSS_TOLERANCE,
+                        help='Drop ratio up to which a configuration is lossless. Default: %(default)s.')
+    parser.add_argument('--step', type=float, default=None,
+                        help='Interval, in sec, of the joined series. Default: the sampling interval of resmon.')
+    parser.add_argument('--workers', type=int, default=catalog.NUM_WORKERS,
+                        help='Number of worker processes. Default: number of CPUs.')
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    results, errors = collect_run_metrics(args.data_dir, args.scan_depth, args.where, args.step, args.workers,
+                                          args.catalog)
+    if len(results) == 0:
+        print_outcome('Runs', 0, errors)
+        print(Colors.RED + 'No run to report on.' + Colors.ENDC)
+        return 1
+    points = scaling.add_efficiency(scaling.aggregate(results), args.loss_tolerance)
+    curves = scaling.curves(points)
+    save_csv(os.path.join(args.output_dir, 'scaling.csv'), [p for c in curves.values() for p in c])
+    save_csv(os.path.join(args.output_dir, 'ranking.csv'), scaling.ranking(points))
+    save_xlsx(os.path.join(args.output_dir, 'scaling.xlsx'), curves)
+    print('Saved the report of %d configurations in %d curves to "%s".' % (len(points), len(curves), args.output_dir))
+    print_outcome('Runs', len(results), errors)
+    return 1 if len(errors) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
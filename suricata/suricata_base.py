@@ -5,11 +5,15 @@
 #
 # @author Xiangyu Bu <bu1@purdue.edu>
 
+import json
 import logging
 import os
+import platform
+import re
 import subprocess
 import time
 
+from . import netns
 from . import test_base
 
 
@@ -17,17 +21,46 @@ class SuritacaTestBase(test_base.TestBase):
 
     ETHTOOL_ARGS = ('tso', 'gro', 'lro', 'gso', 'rx', 'tx', 'sg')
 
-    def __init__(self, remote_host, remote_user, local_tmpdir, remote_tmpdir, data_repo):
+    # Receiver facts recorded in the manifest of a run: key -> shell command.
+    HOST_INFO_CMDS = (
+        ('hostname', 'hostname'),
+        ('kernel', 'uname -r'),
+        ('cpus', 'nproc --all'),
+        ('cpu_model', "grep -m 1 'model name' /proc/cpuinfo | cut -d: -f2"),
+        ('mem_total_kb', "awk '/MemTotal/ {print $2}' /proc/meminfo"),
+        ('suricata_version', 'suricata -V'),
+    )
+
+    # Suricata outputs compressed after the run. The small JSON files read as they are stay uncompressed.
+    COMPRESS_PATTERNS = ('eve.json', 'eve.stats.json', '*.log', '*.bin', '*.pcap')
+
+    def __init__(self, remote_host, remote_user, local_tmpdir, remote_tmpdir, data_repo, local_topology=None):
         super().__init__()
         self.remote_host = remote_host
         self.remote_user = remote_user
         self.local_tmpdir = local_tmpdir
         self.remote_tmpdir = remote_tmpdir
         self.data_repo = data_repo
-        self.shell = self.get_remote_shell(remote_host, remote_user)
+        # Channels and RSS indirection table of the NICs whose queues the test changes, by NIC.
+        self.saved_nic_settings = dict()
+        # In single-host mode, the receiver and sender are the network namespaces of the topology.
+        self.local_topology = local_topology
+        if local_topology is not None:
+            self.shell = self.get_netns_shell(local_topology.receiver_ns)
+        else:
+            self.shell = self.get_remote_shell(remote_host, remote_user)
+
+    def sender_cmd(self, cmd):
+        """ The command to run cmd on the sender, i.e. in the sender namespace in single-host mode. """
+        if self.local_topology is not None:
+            return netns.netns_cmd(self.local_topology.sender_ns, cmd)
+        return list(cmd)
 
-    def setup_nic(self, nic, is_local=True):
-        """ Configure the NIC to use for suricata. """
+    def setup_nic(self, nic, is_local=True, capture_cpus=()):
+        """
+        Configure the NIC to use for suricata. If capture_cpus is given, the RX queues, RSS and
+        IRQs of the remote NIC are laid out on those CPUs and the applied layout is returned.
+        """
         for optarg in self.ETHTOOL_ARGS:
             if is_local:
                 subprocess.call(['sudo', 'ethtool', '-K', nic, optarg, 'off'])
@@ -35,6 +68,207 @@ class SuritacaTestBase(test_base.TestBase):
                 self.simple_call(['sudo', 'ethtool', '-K', nic, optarg, 'off'])
         if not is_local:
             self.simple_call(['sudo', 'ifconfig', nic, 'promisc'])
+            if capture_cpus:
+                return self.setup_nic_queues(nic, capture_cpus)
+        return None
+
+    def get_nic_irqs(self, nic):
+        """ Return [(irq, queue name), ...] of the remote NIC, ordered by queue. """
+        _, interrupts = self.output_call(['cat', '/proc/interrupts'])
+        irqs = []
+        for line in interrupts.splitlines():
+            fields = line.split()
+            if len(fields) < 2 or not fields[0].rstrip(':').isdigit():
+                continue
+            name = fields[-1]
+            # Queue IRQs are named like "enp5s0f1-TxRx-0". The one named after the NIC alone is the link IRQ.
+            if name.startswith(nic + '-'):
+                m = re.search(r'(\d+)$', name[len(nic):])
+                irqs.append((int(m.group(1)) if m else -1, int(fields[0].rstrip(':')), name))
+        return [(irq, name) for (_, irq, name) in sorted(irqs)]
+
+    def setup_nic_queues(self, nic, capture_cpus):
+        """
+        Use one RX queue per capture CPU, spread RSS evenly over them and bind the IRQ of queue i
+        to capture_cpus[i]. Returns the layout as read back from the host.
+        """
+        cpus = []
+        for cpu in capture_cpus:
+            if cpu not in cpus:
+                cpus.append(cpu)
+        nqueues = len(cpus)
+        if nic not in self.saved_nic_settings:
+            self.saved_nic_settings[nic] = self.read_nic_settings(nic)
+        logging.info('Setting %d RX queues on NIC "%s" for CPUs %s.', nqueues, nic, cpus)
+        if self.simple_call(['sudo', 'ethtool', '-L', nic, 'combined', str(nqueues)]) != 0 and \
+           self.simple_call(['sudo', 'ethtool', '-L', nic, 'rx', str(nqueues)]) != 0:
+            logging.warning('Failed to set %d RX queues on NIC "%s".', nqueues, nic)
+        if self.simple_call(['sudo', 'ethtool', '-X', nic, 'equal', str(nqueues)]) != 0:
+            logging.warning('Failed to set RSS indirection table of NIC "%s".', nic)
+        irqs = self.get_nic_irqs(nic)
+        if len(irqs) == 0:
+            logging.warning('No IRQ found for NIC "%s".', nic)
+        for i, (irq, name) in enumerate(irqs):
+            cpu = cpus[i % nqueues]
+            if self.simple_call(['sudo', 'bash', '-c', 'echo %d > /proc/irq/%d/smp_affinity_list' % (cpu, irq)]) != 0:
+                logging.warning('Failed to bind IRQ %d (%s) to CPU %d.', irq, name, cpu)
+        layout = {
+            'capture_cpus': cpus,
+            'channels': self.output_call(['ethtool', '-l', nic])[1],
+            'rss': self.output_call(['ethtool', '-x', nic])[1],
+            'irqs': [],
+        }
+        for irq, name in irqs:
+            _, affinity = self.output_call(['cat', '/proc/irq/%d/smp_affinity_list' % irq])
+            layout['irqs'].append({'irq': irq, 'name': name, 'cpus': affinity.strip()})
+        return layout
+
+    def read_nic_settings(self, nic):
+        """ Return the output of "ethtool -l" and "ethtool -x" of the remote NIC, None where it failed. """
+        settings = dict()
+        for key, flag in (('channels', '-l'), ('rss', '-x')):
+            retval, out = self.output_call(['ethtool', flag, nic])
+            settings[key] = out if retval == 0 else None
+        return settings
+
+    @staticmethod
+    def parse_channels(text):
+        """ Return the current channel counts of "ethtool -l" output as [(name, count), ...]. """
+        channels = []
+        current = False
+        for line in text.splitlines():
+            if line.startswith('Current hardware settings'):
+                current = True
+                continue
+            fields = line.split(':')
+            if current and len(fields) == 2 and fields[1].strip().isdigit():
+                name = fields[0].strip().lower()
+                if name in ('rx', 'tx', 'combined'):
+                    channels.append((name, int(fields[1].strip())))
+        return channels
+
+    @staticmethod
+    def parse_rss_weights(text):
+        """ Return the number of entries of every RX queue in the indirection table of "ethtool -x" output. """
+        counts = dict()
+        for line in text.splitlines():
+            m = re.match(r'^\s*\d+:((\s+\d+)+)\s*$', line)
+            if m is None:
+                continue
+            for queue in m.group(1).split():
+                counts[int(queue)] = counts.get(int(queue), 0) + 1
+        return [counts.get(q, 0) for q in range(max(counts) + 1)] if counts else []
+
+    def restore_nic_settings(self):
+        """
+        Restore the channels and RSS indirection table the NICs had before setup_nic_queues. The
+        table is restored as weights, i.e. the share of every queue, which ethtool spreads evenly.
+        """
+        for nic, settings in self.saved_nic_settings.items():
+            logging.info('Restoring channels and RSS of NIC "%s".', nic)
+            channels = self.parse_channels(settings['channels'] or '')
+            if len(channels):
+                cmd = ['sudo', 'ethtool', '-L', nic]
+                for name, count in channels:
+                    cmd.extend([name, str(count)])
+                if self.simple_call(cmd) != 0:
+                    logging.warning('Failed to restore the channels of NIC "%s": %s.', nic, channels)
+            weights = self.parse_rss_weights(settings['rss'] or '')
+            if len(weights):
+                if self.simple_call(['sudo', 'ethtool', '-X', nic, 'weight'] + [str(w) for w in weights]) != 0:
+                    logging.warning('Failed to restore the RSS indirection table of NIC "%s".', nic)
+        self.saved_nic_settings = dict()
+
+    def stop_irqbalance(self):
+        """ Stop irqbalance so that it does not move the IRQs during the test. Returns True if it was running. """
+        if self.simple_call(['systemctl', 'is-active', '--quiet', 'irqbalance']) != 0:
+            return False
+        logging.info('Stopping irqbalance.')
+        self.simple_call(['sudo', 'systemctl', 'stop', 'irqbalance'])
+        return True
+
+    def start_irqbalance(self):
+        logging.info('Starting irqbalance.')
+        self.simple_call(['sudo', 'systemctl', 'start', 'irqbalance'])
+
+    def measure_clock_offset(self, samples=5):
+        """
+        Estimate the remote clock minus the local clock, in sec, from the remote time read in the
+        middle of the round trip. The sample with the shortest round trip is kept.
+        """
+        best = None
+        for _ in range(samples):
+            t0 = time.time()
+            retval, out = self.output_call(['date', '+%s.%N'])
+            t1 = time.time()
+            if retval != 0:
+                continue
+            try:
+                offset = float(out.strip()) - (t0 + t1) / 2
+            except ValueError:
+                continue
+            if best is None or t1 - t0 < best['rtt_sec']:
+                best = {'local_ts': t0, 'offset_sec': offset, 'rtt_sec': t1 - t0}
+        return best
+
+    def remote_host_info(self):
+        info = {'host': self.remote_host}
+        for key, cmd in self.HOST_INFO_CMDS:
+            retval, out = self.output_call(['bash', '-c', cmd])
+            info[key] = out.strip() if retval == 0 else None
+        return info
+
+    @staticmethod
+    def local_host_info():
+        info = {'hostname': platform.node(), 'kernel': platform.release(), 'cpus': os.cpu_count()}
+        for key, cmd in SuritacaTestBase.HOST_INFO_CMDS:
+            if key in ('cpu_model', 'mem_total_kb'):
+                try:
+                    info[key] = subprocess.check_output(['bash', '-c', cmd]).decode('utf-8', 'replace').strip()
+                except subprocess.CalledProcessError:
+                    info[key] = None
+        return info
+
+    def compress_remote_logs(self, method='auto', dirpath=None):
+        """
+        Compress the Suricata outputs in dirpath, the remote tmpdir by default, in place, with zstd
+        if method is "zstd", or "auto" and zstd is installed, else with gzip. Returns the method used.
+        """
+        dirpath = dirpath or self.remote_tmpdir
+        if method == 'auto':
+            method = 'zstd' if self.simple_call(['which', 'zstd']) == 0 else 'gzip'
+        compress_cmd = ['zstd', '-q', '--rm', '-T0'] if method == 'zstd' else ['gzip']
+        names = []
+        for pattern in self.COMPRESS_PATTERNS:
+            names.extend(['-o', '-name', pattern] if names else ['-name', pattern])
+        logging.info('Compressing remote logs with %s.', method)
+        cmd = ['sudo', 'find', dirpath, '-maxdepth', '1', '-type', 'f', '('] + names + \
+              [')', '-exec'] + compress_cmd + ['{}', '+']
+        if self.simple_call(cmd) != 0:
+            logging.warning('Failed to compress some logs in "%s".', dirpath)
+        return method
+
+    def reduce_remote_run(self, raw_logs, raw_dir):
+        """
+        Reduce the remote tmpdir to the stats of eve.json and a summary with tools/reducerun.py,
+        keeping the raw logs under raw_dir if raw_logs is "lazy" or deleting them if it is "drop".
+        Returns the directory the raw logs were moved to, or None.
+        """
+        cmd = ['sudo', 'reducerun', self.remote_tmpdir]
+        if raw_logs == 'lazy':
+            cmd.extend(['--raw', 'move', '--raw-dir', raw_dir])
+        elif raw_logs == 'drop':
+            cmd.extend(['--raw', 'drop'])
+        logging.info('Reducing remote run, raw logs: %s.', raw_logs)
+        if self.simple_call(cmd) != 0:
+            logging.warning('Failed to reduce "%s". The raw logs are kept with the run.', self.remote_tmpdir)
+            return None
+        return os.path.join(raw_dir, os.path.basename(self.remote_tmpdir)) if raw_logs == 'lazy' else None
+
+    def save_remote_json(self, name, obj):
+        """ Save obj as JSON file in the remote tmpdir. """
+        with self.shell.open(os.path.join(self.remote_tmpdir, name), 'w') as f:
+            f.write(json.dumps(obj, indent=2, sort_keys=True))
 
     def delete_tmpdir(self):
         """ Delete temporary directories on local and remote hosts. """
@@ -50,12 +284,14 @@ class SuritacaTestBase(test_base.TestBase):
         logging.info('Creating remote directory "%s".', self.remote_tmpdir)
         self.simple_call(['mkdir', '-p', self.remote_tmpdir])
 
-    def commit_dir(self):
-        """ Send directories to data repository server. """
+    def commit_dir(self, compress=False):
+        """ Send directories to data repository server, compressing the transfer if compress is set. """
         logging.info('Committing local tmpdir.')
-        self.commit_local_dir(self.local_tmpdir, self.data_repo.repo_user, self.data_repo.repo_host, self.data_repo.repo_dir)
+        self.commit_local_dir(self.local_tmpdir, self.data_repo.repo_user, self.data_repo.repo_host, self.data_repo.repo_dir,
+                              compress=compress)
         logging.info('Committing remote tmpdir.')
-        self.commit_remote_dir(self.remote_tmpdir, self.data_repo.repo_user, self.data_repo.repo_host, self.data_repo.repo_dir)
+        self.commit_remote_dir(self.remote_tmpdir, self.data_repo.repo_user, self.data_repo.repo_host, self.data_repo.repo_dir,
+                               compress=compress)
 
     def wait_for_suricata(self, wait_sec=4):
         while True:
@@ -1,22 +1,443 @@
 #!/usr/bin/python3
 
+"""
+repl.py
+
+Generate suricata_<c>c<d>d[_af].yaml from suricata_template.yaml.
+
+Besides the number of capture (c) and worker (d) threads, the AF_PACKET options that decide drop
+rates (cluster-type, ring-size, block-size, use-mmap/tpacket-v3 and defrag) can be swept. Options
+that differ from the defaults are appended to the config name as tags, e.g. "2c4d_af-cqm-r4096".
+
+For the configs with CPU affinity enabled, the capture ("receive") and worker threads are bound
+to concrete core lists chosen from the CPU/NUMA topology of the receiver host. Cores on the NUMA
+node the capture NICs are attached to are used first. The topology is read from /sys, or from a
+JSON file dumped with "--dump-topology" on the receiver for offline use.
+
+The YAML files go to suricata_configs/generated by default, apart from the hand-written configs,
+and existing files are only overwritten with "--force". Along with them, the matching
+SuricataTestCase entries are written to a JSON file which "suricata_main.py --testcases" runs.
+
+Example usage:
+
+$ ssh root@ohio python3 - --dump-topology /dev/stdout < repl.py > ohio.json
+$ python3 repl.py --topology ohio.json --nics enp5s0f1,enp5s0f2 --skip-smt
+"""
+
+import argparse
+import collections
+import itertools
+import json
 import os
+import sys
+
+
+SYSFS_CPU = '/sys/devices/system/cpu'
+SYSFS_NODE = '/sys/devices/system/node'
+SYSFS_NET = '/sys/class/net'
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Generated configs go apart from the hand-written suricata_<c>c<d>d[_af].yaml of BASE_DIR.
+DEFAULT_OUTDIR = os.path.join(BASE_DIR, 'generated')
+
+ALL_CONFS = ((1, 1), (1, 2), (1, 4), (1, 8),
+             (2, 1), (2, 2), (2, 4), (2, 8),
+             (4, 1), (4, 2), (4, 4), (4, 8), (4, 16),
+             (8, 1), (8, 2), (8, 4), (8, 8), (8, 16),
+             (16, 1), (16, 2), (16, 4), (16, 8), (16, 16), (16, 32))
+
+CLUSTER_TYPES = ('flow', 'cpu', 'qm')
+
+# "mmap" is the ring of tpacket v2, "v3" adds tpacket-v3 on top of it, and "nommap" uses recvfrom.
+CAPTURE_MODES = ('mmap', 'v3', 'nommap')
+
+AfPacketOpts = collections.namedtuple('AfPacketOpts', ('cluster_type',  # One of CLUSTER_TYPES.
+                                                       'ring_size',     # Ring size in packets, or None for Suricata's default.
+                                                       'block_size',    # tpacket-v3 block size in bytes, or None for default.
+                                                       'capture_mode',  # One of CAPTURE_MODES.
+                                                       'defrag',        # Let the kernel defragment before hashing.
+                                                       ))
+
+DEFAULT_AF_PACKET = AfPacketOpts(cluster_type='flow', ring_size=None, block_size=None, capture_mode='mmap', defrag=True)
+
+
+def parse_cpulist(s):
+    """ Parse a kernel cpulist like "0-3,8,10-11" into a list of ints. """
+    cpus = []
+    for part in s.strip().split(','):
+        if part == '':
+            continue
+        if '-' in part:
+            lo, hi = part.split('-', 1)
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _read(path, default=None):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return default
+
+
+def read_topology(nics=()):
+    """ Read CPU, NUMA and NIC locality information from sysfs. """
+    cpu_nodes = dict()
+    if os.path.isdir(SYSFS_NODE):
+        for name in os.listdir(SYSFS_NODE):
+            if name.startswith('node') and name[4:].isdigit():
+                for cpu in parse_cpulist(_read(os.path.join(SYSFS_NODE, name, 'cpulist'), '')):
+                    cpu_nodes[cpu] = int(name[4:])
+    cpus = dict()
+    for cpu in parse_cpulist(_read(os.path.join(SYSFS_CPU, 'online'), '0')):
+        topo_dir = os.path.join(SYSFS_CPU, 'cpu%d' % cpu, 'topology')
+        cpus[str(cpu)] = {
+            'core': int(_read(os.path.join(topo_dir, 'core_id'), cpu)),
+            'package': int(_read(os.path.join(topo_dir, 'physical_package_id'), 0)),
+            'node': cpu_nodes.get(cpu, 0),
+            'siblings': parse_cpulist(_read(os.path.join(topo_dir, 'thread_siblings_list'), str(cpu))),
+        }
+    all_nics = dict()
+    for nic in nics:
+        nic_dir = os.path.join(SYSFS_NET, nic)
+        if not os.path.isdir(nic_dir):
+            print('Warning: NIC "%s" does not exist. Skip.' % nic, file=sys.stderr)
+            continue
+        queues_dir = os.path.join(nic_dir, 'queues')
+        rx_queues = len([q for q in os.listdir(queues_dir) if q.startswith('rx-')]) if os.path.isdir(queues_dir) else 1
+        all_nics[nic] = {
+            'node': int(_read(os.path.join(nic_dir, 'device', 'numa_node'), -1)),
+            'local_cpus': parse_cpulist(_read(os.path.join(nic_dir, 'device', 'local_cpulist'), '')),
+            'rx_queues': rx_queues,
+        }
+    return {'cpus': cpus, 'nics': all_nics}
+
+
+def load_topology(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def nic_nodes(topology, nics):
+    """ NUMA nodes the given NICs are attached to, in the order the NICs are given. """
+    nodes = []
+    for nic in nics:
+        if nic not in topology['nics']:
+            print('Warning: NIC "%s" is not in the topology. Ignore its locality.' % nic, file=sys.stderr)
+            continue
+        node = topology['nics'][nic]['node']
+        # numa_node is -1 on single-node hosts and on platforms that do not report it.
+        if node >= 0 and node not in nodes:
+            nodes.append(node)
+    return nodes
+
 
-with open('suricata_template.yaml', 'r') as f:
-    data = f.read()
+def ordered_cpus(topology, nics, skip_smt=False):
+    """
+    Order the CPUs in which they should be handed out: CPUs local to the NICs first, one thread of
+    every physical core before the SMT siblings, and the sibling threads dropped if skip_smt is set.
+    """
+    nodes = nic_nodes(topology, nics)
+    keys = []
+    for cpu_id, cpu in topology['cpus'].items():
+        cpu_id = int(cpu_id)
+        siblings = sorted(cpu['siblings'])
+        thread_idx = siblings.index(cpu_id) if cpu_id in siblings else 0
+        if skip_smt and thread_idx > 0:
+            continue
+        node_rank = nodes.index(cpu['node']) if cpu['node'] in nodes else len(nodes)
+        keys.append((node_rank, thread_idx, cpu['node'], cpu['package'], cpu['core'], cpu_id))
+    return [k[-1] for k in sorted(keys)], nodes
 
-for (c, d) in ((1, 1), (1, 2), (1, 4), (1, 8),
-               (2, 1), (2, 2), (2, 4), (2, 8),
-               (4, 1), (4, 2), (4, 4), (4, 8), (4, 16),
-               (8, 1), (8, 2), (8, 4), (8, 8), (8, 16),
-               (16, 1), (16, 2), (16, 4), (16, 8), (16, 16), (16, 32)):
-    content = data
+
+def place_threads(topology, nics, nthreads, skip_smt=False):
+    """
+    Assign one management CPU followed by one CPU per thread in every group of nthreads.
+    Returns (management_cpus, [cpus_of_group, ...]). Groups share CPUs, in order, only if the
+    host has too few of them.
+    """
+    cpus, nodes = ordered_cpus(topology, nics, skip_smt)
+    local_count = len([c for c in cpus if topology['cpus'][str(c)]['node'] in nodes]) if nodes else len(cpus)
+    needed = 1 + sum(nthreads)
+    if needed > len(cpus):
+        print('Warning: %d CPUs needed but only %d available. CPUs will be shared.' % (needed, len(cpus)),
+              file=sys.stderr)
+    elif needed > local_count:
+        print('Warning: %d CPUs needed but only %d are local to NICs %s. Remote CPUs will be used.' % (
+              needed, local_count, ','.join(nics)), file=sys.stderr)
+    groups = []
+    pos = 1
+    for n in nthreads:
+        groups.append([cpus[(pos + i) % len(cpus)] for i in range(n)])
+        pos += n
+    return [cpus[0]], groups
+
+
+def afpacket_tags(opts):
+    """ Tags naming the AF_PACKET options that differ from DEFAULT_AF_PACKET, e.g. ["cqm", "r4096"]. """
+    tags = []
+    if opts.cluster_type != DEFAULT_AF_PACKET.cluster_type:
+        tags.append('c' + opts.cluster_type)
+    if opts.ring_size is not None:
+        tags.append('r%d' % opts.ring_size)
+    if opts.block_size is not None:
+        tags.append('b%d' % opts.block_size)
+    if opts.capture_mode != DEFAULT_AF_PACKET.capture_mode:
+        tags.append(opts.capture_mode)
+    if not opts.defrag:
+        tags.append('nodefrag')
+    return tags
+
+
+def config_token(c, d, affinity=None, skip_smt=False, afpacket=DEFAULT_AF_PACKET):
+    """
+    Name of a config as it appears in file names, e.g. "2c4d_af-nosmt-cqm-r4096". Test names use
+    the token with "_" replaced by "-", which dataparser.runname parses back.
+    """
+    token = '%dc%dd' % (c, d)
+    if affinity == 'autofp':
+        token += '_af'
+    elif affinity == 'workers':
+        token += '_afw'
+    tags = afpacket_tags(afpacket)
+    if affinity is not None and skip_smt:
+        tags.insert(0, 'nosmt')
+    return '-'.join([token] + tags)
+
+
+def _cpu_list(cpus):
+    seen = []
+    for cpu in cpus:
+        if cpu not in seen:
+            seen.append(cpu)
+    return ', '.join(str(i) for i in seen)
+
+
+def _yes_no(b):
+    return 'yes' if b else 'no'
+
+
+def render(template, c, d, management_cpus=None, receive_cpus=None, worker_cpus=None, afpacket=DEFAULT_AF_PACKET):
+    content = template
     content = content.replace('<AF_PACKET_THREADS>', str(c))
     content = content.replace('<PCAP_THREADS>', str(c))
     content = content.replace('<WORKER_THREADS>', str(d))
-    with open('suricata_%dc%dd.yaml' % (c, d), 'w') as f:
-        content2 = content.replace('<ENABLE_CPU_AFFINITY>', 'no', 1)
-        f.write(content2)
-    with open('suricata_%dc%dd_af.yaml' % (c, d), 'w') as f:
-        content3 = content.replace('<ENABLE_CPU_AFFINITY>', 'yes', 1)
-        f.write(content3)
+    content = content.replace('<CLUSTER_TYPE>', 'cluster_' + afpacket.cluster_type)
+    content = content.replace('<DEFRAG>', _yes_no(afpacket.defrag))
+    content = content.replace('<USE_MMAP>', _yes_no(afpacket.capture_mode != 'nommap'))
+    ring_opts = []
+    if afpacket.capture_mode == 'v3':
+        ring_opts.append('tpacket-v3: yes')
+    if afpacket.ring_size is not None:
+        ring_opts.append('ring-size: %d' % afpacket.ring_size)
+    if afpacket.block_size is not None:
+        ring_opts.append('block-size: %d' % afpacket.block_size)
+    lines = []
+    for line in content.split('\n'):
+        if line.strip() == '<AF_PACKET_RING_OPTS>':
+            indent = line[:line.index('<')]
+            lines.extend(indent + opt for opt in ring_opts)
+        else:
+            lines.append(line)
+    content = '\n'.join(lines)
+    if management_cpus is None:
+        content = content.replace('<ENABLE_CPU_AFFINITY>', 'no', 1)
+        for placeholder in ('<MANAGEMENT_CPUS>', '<RECEIVE_CPUS>', '<WORKER_CPUS>'):
+            content = content.replace(placeholder, '"all"')
+    else:
+        content = content.replace('<ENABLE_CPU_AFFINITY>', 'yes', 1)
+        content = content.replace('<MANAGEMENT_CPUS>', _cpu_list(management_cpus))
+        content = content.replace('<RECEIVE_CPUS>', _cpu_list(receive_cpus))
+        content = content.replace('<WORKER_CPUS>', _cpu_list(worker_cpus))
+    return content
+
+
+def afpacket_matrix(cluster_types=(DEFAULT_AF_PACKET.cluster_type,), ring_sizes=(None,), block_sizes=(None,),
+                    capture_modes=(DEFAULT_AF_PACKET.capture_mode,), defrags=(True,)):
+    """ All valid AfPacketOpts in the product of the given values. Block size only applies to tpacket-v3. """
+    matrix = []
+    for opts in itertools.product(cluster_types, ring_sizes, block_sizes, capture_modes, defrags):
+        opts = AfPacketOpts(*opts)
+        if opts.cluster_type not in CLUSTER_TYPES:
+            raise ValueError('Unknown cluster type "%s".' % opts.cluster_type)
+        if opts.capture_mode not in CAPTURE_MODES:
+            raise ValueError('Unknown capture mode "%s".' % opts.capture_mode)
+        if opts.block_size is not None and opts.capture_mode != 'v3':
+            continue
+        if opts.ring_size is not None and opts.capture_mode == 'nommap':
+            continue
+        matrix.append(opts)
+    return matrix
+
+
+def check_overwrite(paths, force):
+    """ Raise FileExistsError if any of the paths exists, unless force is True. """
+    existing = [p for p in paths if os.path.exists(p)]
+    if existing and not force:
+        raise FileExistsError('%d file(s) exist, e.g. "%s". Pass --force to overwrite them.'
+                              % (len(existing), existing[0]))
+
+
+def generate_configs(template, topology, nics, confs, runmodes, skip_smt=False, outdir=DEFAULT_OUTDIR,
+                     afpacket_opts=(DEFAULT_AF_PACKET,), force=False):
+    """
+    Write the YAML files. Returns a list of dicts describing every config written.
+    In autofp runmode, c capture threads and d worker threads get disjoint cores. In workers
+    runmode every capture thread is a worker, so the worker set is the c capture cores.
+    Nothing is written if a file exists and force is False.
+    """
+    configs = []
+    contents = []
+    for (c, d), afpacket in itertools.product(confs, afpacket_opts):
+        placements = [(None, None, [], [])]
+        for runmode in runmodes:
+            if runmode == 'autofp':
+                mgmt, (capture_cpus, worker_cpus) = place_threads(topology, nics, (c, d), skip_smt)
+            else:
+                mgmt, (capture_cpus,) = place_threads(topology, nics, (c,), skip_smt)
+                worker_cpus = capture_cpus
+            placements.append((runmode, mgmt, capture_cpus, worker_cpus))
+        for (runmode, mgmt, capture_cpus, worker_cpus) in placements:
+            token = config_token(c, d, runmode, skip_smt, afpacket)
+            config_file = 'suricata_%s.yaml' % token
+            contents.append(render(template, c, d, mgmt, capture_cpus, worker_cpus, afpacket))
+            configs.append({
+                'conf': token.replace('_', '-'),
+                'config_file': config_file,
+                'runmode': runmode,
+                'capture_threads': c,
+                'worker_threads': d,
+                'management_cpus': mgmt or [],
+                'capture_cpus': capture_cpus,
+                'worker_cpus': worker_cpus,
+                'af_packet': afpacket._asdict(),
+            })
+    paths = [os.path.join(outdir, conf['config_file']) for conf in configs]
+    check_overwrite(paths, force)
+    os.makedirs(outdir, exist_ok=True)
+    for path, content in zip(paths, contents):
+        with open(path, 'w') as f:
+            f.write(content)
+        print('Generated "%s".' % path)
+    return configs
+
+
+def generate_testcases(configs, nics, runmodes, instances, trace, stat_delay_sec=2, reboot=True):
+    """
+    Build SuricataTestCase entries, as dicts, for the tcpreplay sweep over the given configs.
+    A None entry asks suricata_main to reboot the receiver.
+    """
+    tests = []
+    for runmode in runmodes:
+        for num_instances in instances:
+            for conf in configs:
+                if conf['runmode'] not in (None, runmode):
+                    continue
+                tests.append({
+                    'name': '%s_%s_%s_%d_%dnics' % (conf['conf'], os.path.basename(trace), runmode,
+                                                    num_instances, len(nics)),
+                    'stat_delay_sec': stat_delay_sec,
+                    'suricata_config_file': conf['config_file'],
+                    'enable_suricata': True,
+                    'iperf_nics': list(nics),
+                    'iperf_instances': num_instances,
+                    'iperf_server_args': [],
+                    'iperf_client_args': [],
+                    'suricata_wrapper_cmd': [],
+                    'suricata_runmode': runmode,
+                    'test_method': 'tcpreplay',
+                    'tcpreplay_tracefile': trace,
+                    'enable_vtune': False,
+                    'capture_cpus': conf['capture_cpus'],
+                    'worker_cpus': conf['worker_cpus'],
+                })
+                tests[-1].update(conf['af_packet'])
+            if reboot:
+                tests.append(None)
+    return tests
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate Suricata configs and the matching test cases.')
+    parser.add_argument('--template', type=str, default=os.path.join(BASE_DIR, 'suricata_template.yaml'),
+                        help='Template to generate configs from.')
+    parser.add_argument('--outdir', type=str, default=DEFAULT_OUTDIR,
+                        help='Directory to write the configs to. Default: "generated" under the directory of this '
+                             'script, apart from the hand-written configs.')
+    parser.add_argument('--force', default=False, action='store_true',
+                        help='If present, overwrite existing configs and test case file.')
+    parser.add_argument('--topology', type=str, default=None,
+                        help='Read the host topology from this JSON file instead of /sys.')
+    parser.add_argument('--dump-topology', type=str, default=None,
+                        help='Write the topology of this host to the given file and exit.')
+    parser.add_argument('--nics', type=str, default='enp5s0f1,enp5s0f2',
+                        help='Capture NICs, separated by a comma. Default: "enp5s0f1,enp5s0f2".')
+    parser.add_argument('--skip-smt', default=False, action='store_true',
+                        help='If present, use only one hardware thread of every physical core.')
+    parser.add_argument('--confs', type=str, default=None,
+                        help='Configs to generate, e.g. "1c1d,2c4d". Default: all.')
+    parser.add_argument('--runmodes', type=str, default='autofp,workers',
+                        help='Runmodes to generate affinity configs and test cases for. Default: "autofp,workers".')
+    parser.add_argument('--cluster-types', type=str, default=DEFAULT_AF_PACKET.cluster_type,
+                        help='AF_PACKET cluster types to sweep, among %s. Default: "flow".' % ','.join(CLUSTER_TYPES))
+    parser.add_argument('--ring-sizes', type=str, default='default',
+                        help='AF_PACKET ring sizes, in packets, to sweep. "default" leaves it to Suricata. Default: "default".')
+    parser.add_argument('--block-sizes', type=str, default='default',
+                        help='tpacket-v3 block sizes, in bytes, to sweep. "default" leaves it to Suricata. Default: "default".')
+    parser.add_argument('--capture-modes', type=str, default=DEFAULT_AF_PACKET.capture_mode,
+                        help='AF_PACKET capture modes to sweep, among %s. Default: "mmap".' % ','.join(CAPTURE_MODES))
+    parser.add_argument('--defrag', type=str, default='yes',
+                        help='Values of AF_PACKET defrag to sweep, e.g. "yes,no". Default: "yes".')
+    parser.add_argument('--testcases', type=str, default='testcases.json',
+                        help='Name of the test case file, relative to outdir. Default: "testcases.json".')
+    parser.add_argument('--instances', type=str, default='16,8,4',
+                        help='Numbers of tcpreplay instances per NIC, separated by a comma. Default: "16,8,4".')
+    parser.add_argument('--trace', type=str, default='traces/snort.log.1425823194',
+                        help='Trace file for tcpreplay.')
+    args = parser.parse_args()
+
+    nics = [n.strip() for n in args.nics.split(',') if n.strip()]
+    if args.dump_topology is not None:
+        with open(args.dump_topology, 'w') as f:
+            json.dump(read_topology(nics), f, indent=2, sort_keys=True)
+        return 0
+
+    topology = load_topology(args.topology) if args.topology is not None else read_topology(nics)
+    if args.confs is None:
+        confs = ALL_CONFS
+    else:
+        confs = []
+        for conf in args.confs.split(','):
+            c, d = conf.strip().rstrip('d').split('c')
+            confs.append((int(c), int(d)))
+    runmodes = [r.strip() for r in args.runmodes.split(',') if r.strip()]
+    afpacket_opts = afpacket_matrix(
+        cluster_types=[v.strip() for v in args.cluster_types.split(',')],
+        ring_sizes=[None if v.strip() == 'default' else int(v) for v in args.ring_sizes.split(',')],
+        block_sizes=[None if v.strip() == 'default' else int(v) for v in args.block_sizes.split(',')],
+        capture_modes=[v.strip() for v in args.capture_modes.split(',')],
+        defrags=[v.strip() == 'yes' for v in args.defrag.split(',')])
+    with open(args.template, 'r') as f:
+        template = f.read()
+
+    testcases_path = os.path.join(args.outdir, args.testcases)
+    try:
+        check_overwrite([testcases_path], args.force)
+        configs = generate_configs(template, topology, nics, confs, runmodes, args.skip_smt, args.outdir,
+                                   afpacket_opts, args.force)
+    except FileExistsError as e:
+        print('Error: ' + str(e), file=sys.stderr)
+        return 1
+    tests = generate_testcases(configs, nics, runmodes, [int(i) for i in args.instances.split(',')], args.trace)
+    with open(testcases_path, 'w') as f:
+        json.dump(tests, f, indent=2)
+    print('Saved %d test cases to "%s".' % (len([t for t in tests if t is not None]), testcases_path))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,4 @@
 #!/bin/bash
 
-rsync -zrvpE ./*.yaml root@ohio:/etc/suricata/
+# Copy the configs of the given directory, e.g. "generated", to the receiver. Default: the hand-written ones.
+rsync -zrvpE "${1:-.}"/*.yaml root@ohio:/etc/suricata/
@@ -1,12 +1,15 @@
 #!/usr/bin/python3
 
-from collections import namedtuple
+import argparse
+import json
 import logging
 import os
 import time
 
 from . import models
+from . import netns
 from . import suricata_test
+from .dataparser import runname
 
 nrepeat = 1
 swappiness = 5
@@ -28,21 +31,38 @@ all_receiver_nics = (
   models.RemoteNic(nic='enp5s0f3', ip='192.168.0.11'),
 )
 
-SuricataTestCase = namedtuple('SuricataTestCase',
-                              ('name',                  # Name of the test.
-                               'stat_delay_sec',        # Interval between polling resource usage.
-                               'suricata_config_file',  # Config file to run Suricata with.
-                               'enable_suricata',       # Spawn Suricata in the test.
-                               'iperf_nics',            # A set of NICs to use for iperf server.
-                               'iperf_instances',       # Number of iperf pairs to run.
-                               'iperf_server_args',     # Command-line arguments for iperf server-side.
-                               'iperf_client_args',     # Command-line arguments for iperf client-side.
-                               'suricata_wrapper_cmd',  # Wrapper command to run Suricata (e.g., vtune).
-                               'suricata_runmode',      # Runmode of Suricata. Either workers (default) or autofp.
-                               'test_method',           # Either "tcpreplay" or "iperf".
-                               'tcpreplay_tracefile',   # Trace file for tcpreplay.
-                               'enable_vtune',          # Enable vtune or not.
-                               ))
+# Single-host mode (--local): the receiver NICs are veth pairs between two network namespaces of this
+# host, one per NIC above, and the runs are committed to a local directory.
+local_topology = models.LocalTopology(receiver_ns='suricata_receiver',
+                                      sender_ns='suricata_sender',
+                                      nnics=len(all_receiver_nics))
+
+local_data_repo = models.DataRepository(repo_host=None,
+                                        repo_user=None,
+                                        repo_dir='/var/tmp/suricata_data')
+
+SuricataTestCase = models.SuricataTestCase
+
+
+def load_testcases(path):
+    """
+    Load the test cases emitted by suricata_configs/repl.py. NICs are given by name in the file.
+    :param str path: Path to the test case file.
+    :return: A list of SuricataTestCase, with None for reboots.
+    """
+    nics_by_name = {n.nic: n for n in all_receiver_nics}
+    tests = []
+    with open(path, 'r') as f:
+        for entry in json.load(f):
+            if entry is None:
+                tests.append(None)
+                continue
+            entry['iperf_nics'] = tuple(nics_by_name[n] for n in entry['iperf_nics'])
+            for k in ('iperf_server_args', 'iperf_client_args', 'suricata_wrapper_cmd', 'capture_cpus', 'worker_cpus'):
+                entry[k] = tuple(entry[k])
+            tests.append(SuricataTestCase(**entry))
+    return tests
+
 
 all_tests = []
 
@@ -187,23 +207,49 @@ for recv_nics in (all_receiver_nics[:2], ):
             all_tests.append(None) # Reboot.
 
 
-def runtest(testcase, iter_id):
+def build_manifest(testcase, iter_id, start_time, test_inst, repo=data_repo):
+    """
+    Describe the run: every SuricataTestCase field plus the parameters analyses select runs by,
+    so that they need not be recovered from the directory name. Host info and the result are
+    added by the tester.
+    """
+    fields = testcase._asdict()
+    fields['iperf_nics'] = [nic._asdict() for nic in testcase.iperf_nics]
+    conf = runname.conf_from_config_file(testcase.suricata_config_file)
+    params = dict(runname.parse_conf(conf))
+    params.update({
+        'conf': conf,
+        'trace_file': runname.trace_label(testcase.tcpreplay_tracefile) if testcase.test_method == 'tcpreplay' else testcase.test_method,
+        'runmode': testcase.suricata_runmode,
+        'ninstances': testcase.iperf_instances,
+        'nnics': len(testcase.iperf_nics),
+    })
+    return {
+        'manifest_version': 1,
+        'run': {'name': test_inst, 'iter_id': iter_id, 'start_time': start_time},
+        'params': params,
+        'testcase': fields,
+        'data_repo': repo._asdict(),
+    }
+
+
+def runtest(testcase, iter_id, receiver=receiver_host, sender=sender_host, repo=data_repo, topology=None):
     """
     :param SuricataTestCase testcase: 
+    :param models.LocalTopology topology: The namespaces to run in, or None to run on the hosts.
     :return: 
     """
     logging.info('Start test case "%s" iteration %d.', testcase.name, iter_id)
     start_time = int(time.time())
     test_inst = testcase.name + '_' + str(iter_id) + '_' + str(start_time)
-    local_tmpdir = os.path.join(sender_host.tmpdir_root, test_inst)
-    remote_tmpdir = os.path.join(receiver_host.tmpdir_root, test_inst)
-    repo_dir = os.path.join(data_repo.repo_dir, test_inst)
-    tester = suricata_test.SuricataTest(remote_host=receiver_host.host,
-                                        remote_user=receiver_host.user,
+    local_tmpdir = os.path.join(sender.tmpdir_root, test_inst)
+    remote_tmpdir = os.path.join(receiver.tmpdir_root, test_inst)
+    tester = suricata_test.SuricataTest(remote_host=receiver.host,
+                                        remote_user=receiver.user,
                                         remote_nics=testcase.iperf_nics,
                                         local_tmpdir=local_tmpdir,
                                         remote_tmpdir=remote_tmpdir,
-                                        data_repo=data_repo._replace(),
+                                        data_repo=repo._replace(),
                                         swappiness=swappiness,
                                         stat_delay_sec=testcase.stat_delay_sec,
                                         enable_suricata=testcase.enable_suricata,
@@ -215,16 +261,66 @@ def runtest(testcase, iter_id):
                                         iperf_client_args=testcase.iperf_client_args,
                                         test_method=testcase.test_method,
                                         tcpreplay_tracefile=testcase.tcpreplay_tracefile,
-                                        enable_vtune=testcase.enable_vtune)
+                                        enable_vtune=testcase.enable_vtune,
+                                        capture_cpus=testcase.capture_cpus,
+                                        adaptive_duration=testcase.adaptive_duration,
+                                        min_duration_sec=testcase.min_duration_sec,
+                                        max_duration_sec=testcase.max_duration_sec,
+                                        counter_interval_sec=testcase.counter_interval_sec,
+                                        compression=testcase.compression,
+                                        raw_logs=testcase.raw_logs,
+                                        raw_dir=receiver.raw_dir,
+                                        local_topology=topology,
+                                        manifest=build_manifest(testcase, iter_id, start_time, test_inst, repo))
     tester.run()
     logging.info('Completed test case "%s" iteration %d.', testcase.name, iter_id)
 
 
+def run_local(data_dir, tests=all_tests):
+    """
+    Run the test cases on this host. The NICs of every test case are replaced with the veth pairs
+    of the same index in all_receiver_nics, and reboots are skipped.
+    """
+    nics = netns.setup(local_topology)
+    veth_by_nic = dict(zip(all_receiver_nics, nics))
+    # Both ends share the file system, so they get a tmpdir of their own.
+    receiver = receiver_host._replace(host=local_topology.receiver_ns,
+                                      tmpdir_root=os.path.join(receiver_host.tmpdir_root, local_topology.receiver_ns),
+                                      raw_dir=os.path.join(receiver_host.raw_dir, local_topology.receiver_ns))
+    sender = sender_host._replace(tmpdir_root=os.path.join(sender_host.tmpdir_root, local_topology.sender_ns))
+    repo = local_data_repo._replace(repo_dir=os.path.abspath(data_dir))
+    os.makedirs(repo.repo_dir, exist_ok=True)
+    try:
+        for i in range(0, nrepeat):
+            for t in tests:
+                if t is None:
+                    logging.info('Skipping reboot in single-host mode.')
+                else:
+                    t = t._replace(iperf_nics=tuple(veth_by_nic[n] for n in t.iperf_nics))
+                    runtest(t, i, receiver, sender, repo, local_topology)
+    finally:
+        netns.teardown(local_topology)
+
+
 def main():
+    parser = argparse.ArgumentParser(description='Run the Suricata test cases.')
+    parser.add_argument('--local', default=False, action='store_true',
+                        help='If present, run on this host only, with the receiver and sender in network namespaces '
+                             'connected by veth pairs. Needs root.')
+    parser.add_argument('--data-dir', type=str, default=local_data_repo.repo_dir,
+                        help='Directory to commit the runs to in single-host mode. Default: %(default)s.')
+    parser.add_argument('--testcases', type=str, default=None,
+                        help='Run the test cases of this file, generated by suricata_configs/repl.py, instead of '
+                             'the ones defined in this script.')
+    args = parser.parse_args()
     logging.basicConfig(level=logging.INFO,
                         format='[%(asctime)-15s] %(levelname)s: %(threadName)s: %(message)s')
+    tests = load_testcases(args.testcases) if args.testcases is not None else all_tests
+    if args.local:
+        run_local(args.data_dir, tests)
+        return
     for i in range(0, nrepeat):
-        for t in all_tests:
+        for t in tests:
             if t is None:
                 suricata_test.SuricataTest.reboot_remote_host(receiver_host.host, receiver_host.user)
             else:
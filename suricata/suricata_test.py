@@ -6,9 +6,11 @@
 # @author   Xiangyu Bu <bu1@purdue.edu>
 
 import concurrent.futures
+import json
 import logging
 import os
 import random
+import shutil
 import signal
 import spur
 import subprocess
@@ -16,6 +18,8 @@ import sys
 import time
 
 from . import suricata_base
+from .dataparser import catalog
+from .dataparser import steadystate
 
 
 class SuricataTest(suricata_base.SuritacaTestBase):
@@ -23,8 +27,10 @@ class SuricataTest(suricata_base.SuritacaTestBase):
     def __init__(self, remote_host, remote_user, remote_nics, local_tmpdir, remote_tmpdir, data_repo,
                  swappiness=5, stat_delay_sec=1, enable_suricata=True, suricata_config_file='suricata.yaml', suricata_runmode='workers',
                  iperf_instances=2, iperf_server_args=(), iperf_client_args=(), suricata_wrapper_cmd=(),
-                 test_method='iperf', tcpreplay_tracefile=None, enable_vtune=False):
-        super().__init__(remote_host, remote_user, local_tmpdir, remote_tmpdir, data_repo)
+                 test_method='iperf', tcpreplay_tracefile=None, enable_vtune=False, capture_cpus=(),
+                 adaptive_duration=False, min_duration_sec=10, max_duration_sec=300, counter_interval_sec=None,
+                 manifest=None, compression='auto', raw_logs='upload', raw_dir=None, local_topology=None):
+        super().__init__(remote_host, remote_user, local_tmpdir, remote_tmpdir, data_repo, local_topology)
         self.adjust_swappiness(swappiness)
         self.stat_delay_sec = stat_delay_sec
         self.suricata_config_file = suricata_config_file
@@ -38,18 +44,44 @@ class SuricataTest(suricata_base.SuritacaTestBase):
         self.test_method = test_method
         self.tcpreplay_tracefile = tcpreplay_tracefile
         self.enable_vtune = enable_vtune
+        self.capture_cpus = list(capture_cpus)
+        self.irqbalance_stopped = False
+        # In adaptive mode, traffic runs until the steady-state detector has enough stable samples.
+        self.adaptive_duration = adaptive_duration and enable_suricata
+        self.min_duration_sec = min_duration_sec
+        self.max_duration_sec = max_duration_sec
+        self.traffic_stopped = False
+        # Poll counters through the Suricata command socket at this interval. None to disable.
+        self.counter_interval_sec = counter_interval_sec
+        # Description of the run, completed with host info and the result and saved as manifest.json.
+        self.manifest = manifest
+        # resmon compresses its outputs on the fly; the Suricata logs are compressed after the run. None to disable.
+        self.compression = compression
+        # Method of the receiver resmon, which the steady-state detector reads while it runs.
+        self.resmon_compression = None
+        # "upload" sends the raw logs with the run. "lazy" and "drop" reduce the run on the receiver first.
+        self.raw_logs = raw_logs
+        self.raw_dir = raw_dir
+        self.raw_path = None
 
     def pre_cleanup(self):
         self.simple_call(['sudo', 'pkill', '-9', 'iperf3'])
         self.simple_call(['sudo', 'pkill', '-15', 'resmon'])
+        self.simple_call(['sudo', 'pkill', '-15', 'suricounters'])
         self.simple_call(['sudo', 'pkill', '-9', 'Suricata-Main'])
-        subprocess.call(['sudo', 'pkill', '-9', 'iperf3'])
-        subprocess.call(['sudo', 'pkill', '-9', 'tcpreplay'])
+        subprocess.call(self.sender_cmd(['sudo', 'pkill', '-9', 'iperf3']))
+        subprocess.call(self.sender_cmd(['sudo', 'pkill', '-9', 'tcpreplay']))
+        subprocess.call(self.sender_cmd(['pkill', '-15', 'resmon']))
         if self.enable_vtune:
             # self.simple_call(['source', '/opt/intel/vtune_amplifier_xe_2017.2.0.499904/amplxe-vars.sh'])
             self.simple_call(['sudo', 'bash', '-c', 'echo 0 | tee /proc/sys/kernel/yama/ptrace_scope'])
 
     def post_cleanup(self):
+        if len(self.saved_nic_settings):
+            self.restore_nic_settings()
+        if self.irqbalance_stopped:
+            self.start_irqbalance()
+            self.irqbalance_stopped = False
         self.close()
 
     def test_iperf(self):
@@ -78,13 +110,17 @@ class SuricataTest(suricata_base.SuritacaTestBase):
             for (remote_nic, port, _) in iperf_server_procs:
                 cmd = ['iperf3', '-J', '-p', str(port), '-c', remote_nic.ip,
                        '--logfile', os.path.join(self.local_tmpdir, 'iperf_client_%s_%d.json' % (remote_nic.nic, port))] + self.iperf_client_args
-                f = executor.submit(subprocess.call, cmd)
+                if self.adaptive_duration:
+                    # The last --time wins. The client is interrupted once Suricata is steady.
+                    cmd.extend(['--time', str(self.max_duration_sec)])
+                f = executor.submit(subprocess.call, self.sender_cmd(cmd))
                 all_clients[f] = (remote_nic.ip, port)
             for future in concurrent.futures.as_completed(all_clients):
                 ip, port = all_clients[future]
                 try:
                     retval = future.result()
-                    result += retval
+                    if not self.traffic_stopped:
+                        result += retval
                     logging.info('Iperf client to %s:%d returned %d.\n' % (ip, port, retval))
                 except Exception as e:
                     logging.error('Iperf client to %s:%d gives exception %s.\n' % (ip, port, e))
@@ -106,27 +142,197 @@ class SuricataTest(suricata_base.SuritacaTestBase):
                 for i in range(0, self.iperf_instances):
                     cmd = ['sudo', 'tcpreplay', '-i', remote_nic.nic, '-q',
                            os.path.join(os.path.dirname(os.path.abspath(__file__)), self.tcpreplay_tracefile)]
-                    f = executor.submit(subprocess.call, cmd)
+                    if self.adaptive_duration:
+                        # Loop the trace until Suricata is steady.
+                        cmd.insert(-1, '--loop=0')
+                    # tcpreplay reports the packets it sent, which the drop attribution starts from.
+                    log_path = os.path.join(self.local_tmpdir, 'tcpreplay_%s_%d.log' % (remote_nic.nic, i))
+                    f = executor.submit(self.call_logged, self.sender_cmd(cmd), log_path)
                     all_clients[f] = (remote_nic.nic, i)
             for future in concurrent.futures.as_completed(all_clients):
                 nic, inst = all_clients[future]
                 try:
                     retval = future.result()
-                    result += retval
+                    if not self.traffic_stopped:
+                        result += retval
                     logging.info('tcpreplay to %s:%d returned %d.\n' % (nic, inst, retval))
                 except Exception as e:
                     logging.error('tcpreplay to %s:%d gives exception %s.\n' % (nic, inst, e))
         logging.info('Tcpreplay client finished.')
         return result
 
+    @staticmethod
+    def call_logged(cmd, log_path):
+        """ Run the command with its stdout and stderr written to log_path. Returns its return code. """
+        with open(log_path, 'w') as log:
+            return subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+
+    def run_traffic(self):
+        if self.test_method == 'iperf':
+            return self.test_iperf()
+        elif self.test_method == 'tcpreplay':
+            return self.test_tcpreplay()
+        raise ValueError('Unknown test method "%s".' % self.test_method)
+
+    def stop_traffic(self):
+        """ Interrupt the traffic generators. Their non-zero return codes are ignored afterwards. """
+        self.traffic_stopped = True
+        subprocess.call(self.sender_cmd(['sudo', 'pkill', '-INT', 'iperf3']))
+        subprocess.call(self.sender_cmd(['sudo', 'pkill', '-INT', 'tcpreplay']))
+
+    def poll_live_stats(self):
+        """ Read the latest Suricata stats record and Suricata CPU usage on the receiver. Returns None if not ready. """
+        _, eve_line = self.output_call(['bash', '-c', 'tac %s | grep -m 1 \'"event_type":"stats"\'' %
+                                        os.path.join(self.remote_tmpdir, 'eve.json')])
+        _, ps_lines = self.output_call(['bash', '-c', '{0} | head -n 1; {0} | tail -n 1'.format(
+                                        self.read_resmon_cmd(os.path.join(self.remote_tmpdir, 'psstat.suricata.csv')))])
+        try:
+            stats = json.loads(eve_line)['stats']
+            header, row = [[v.strip() for v in l.split(',')] for l in ps_lines.strip().split('\n')]
+            return {
+                'uptime': stats['uptime'],
+                'timestamp': int(row[0]),
+                'kernel_packets': stats['capture']['kernel_packets'],
+                'decoder_pkts': stats['decoder']['pkts'],
+                'cpu': float(row[header.index('%CPU')]),
+            }
+        except (ValueError, KeyError, IndexError):
+            return None
+
+    def spawn_sender_resmon(self):
+        """ Start resmon on the sender. Returns its process, or None if resmon is not installed there. """
+        if shutil.which('resmon') is None:
+            logging.warning('resmon is not installed on the sender. The run has no sender series.')
+            return None
+        logging.info('Spawning sender resmon.')
+        try:
+            methods = subprocess.run(self.sender_cmd(['resmon', '--compress-methods']),
+                                     stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout
+            return subprocess.Popen(self.sender_cmd(['resmon',
+                                                     '--delay', str(self.stat_delay_sec),
+                                                     '--outfile', 'sysstat.sender.csv',
+                                                     '--nic', ','.join(n.nic for n in self.remote_nics),
+                                                     '--nic-outfile', 'sender.netstat.{nic}.csv'] +
+                                                    self.resmon_compress_args(methods.split())),
+                                    cwd=self.local_tmpdir)
+        except OSError as e:
+            logging.warning('Failed to spawn sender resmon: %s. The run has no sender series.', e)
+            return None
+
+    def resmon_compress_method(self, available):
+        """
+        Method resmon compresses its outputs with, given the methods the installed resmon reports:
+        zstd if the compression is "auto" or "zstd" and resmon supports it, else gzip.
+        """
+        if self.compression is None:
+            return None
+        if self.compression in ('auto', 'zstd') and 'zstd' in available:
+            return 'zstd'
+        return 'gzip'
+
+    def resmon_compress_args(self, available):
+        method = self.resmon_compress_method(available)
+        return ['--compress', method] if method is not None else []
+
+    def receiver_resmon_methods(self):
+        """ Methods the receiver resmon supports and the receiver can read back while it runs. """
+        retval, out = self.output_call(['resmon', '--compress-methods'])
+        methods = out.split() if retval == 0 else []
+        if 'zstd' in methods and self.simple_call(['which', 'zstd']) != 0:
+            methods.remove('zstd')
+        return methods
+
+    def read_resmon_cmd(self, path):
+        """ Shell command printing a receiver resmon output as it is being written. """
+        # The stream has no end yet, which the decompressors complain about.
+        if self.resmon_compression == 'zstd':
+            return 'zstd -dcq %s.zst 2>/dev/null' % path
+        if self.resmon_compression == 'gzip':
+            return 'gzip -dc %s.gz 2>/dev/null' % path
+        return 'cat %s' % path
+
+    def wait_for_steady_state(self, traffic_future):
+        """
+        Watch live Suricata counters and CPU usage until the steady-state detector has enough stable
+        samples, then stop the traffic. The measurement window is saved to steady_state.json.
+        """
+        detector = steadystate.SteadyStateDetector()
+        timestamps = dict()
+        prev = None
+        start_time = time.time()
+        reason = 'traffic_finished'
+        while not traffic_future.done():
+            time.sleep(self.stat_delay_sec)
+            elapsed = time.time() - start_time
+            curr = self.poll_live_stats()
+            if curr is not None and (prev is None or curr['uptime'] > prev['uptime']):
+                if prev is not None:
+                    dt = curr['uptime'] - prev['uptime']
+                    detector.add(curr['uptime'], {
+                        'kernel_pps': (curr['kernel_packets'] - prev['kernel_packets']) / dt,
+                        'decoder_pps': (curr['decoder_pkts'] - prev['decoder_pkts']) / dt,
+                        'cpu': curr['cpu'],
+                    })
+                    timestamps[curr['uptime']] = curr['timestamp']
+                prev = curr
+            if detector.is_done() and elapsed >= self.min_duration_sec:
+                reason = 'steady'
+                break
+            if elapsed >= self.max_duration_sec:
+                reason = 'max_duration'
+                break
+        if not traffic_future.done():
+            logging.info('Stopping traffic after %d seconds (%s).', time.time() - start_time, reason)
+            self.stop_traffic()
+        window = detector.steady_window()
+        if window is None:
+            logging.warning('Suricata did not reach steady state.')
+        info = {
+            'reason': reason,
+            'steady': window is not None,
+            'window': detector.window,
+            'cv_threshold': detector.cv_threshold,
+            'min_samples': detector.min_samples,
+            'duration_sec': int(time.time() - start_time),
+            'start_uptime': window[0] if window else None,
+            'end_uptime': window[1] if window else None,
+            'start_ts': timestamps[window[0]] if window else None,
+            'end_ts': timestamps[window[1]] if window else None,
+        }
+        steadystate.save_window(self.local_tmpdir, info)
+
     def run(self):
+        try:
+            self.run_test()
+        except BaseException:
+            # Leave the NICs and irqbalance as they were even if the test breaks.
+            self.post_cleanup()
+            raise
+
+    def run_test(self):
         logging.info('Initialing NICs.')
+        if self.capture_cpus:
+            self.irqbalance_stopped = self.stop_irqbalance()
+        nic_layout = dict()
         for remote_nic in self.remote_nics:
-            self.setup_nic(remote_nic.nic, is_local=False)
+            layout = self.setup_nic(remote_nic.nic, is_local=False, capture_cpus=self.capture_cpus)
+            if layout is not None:
+                nic_layout[remote_nic.nic] = layout
         logging.info('Initializing temp directories.')
         self.delete_tmpdir()
         self.create_tmpdir()
+        if len(nic_layout):
+            # Keep the applied layout with the results so that the run can be reproduced.
+            self.save_remote_json('nic_layout.json', {'irqbalance_stopped': self.irqbalance_stopped,
+                                                      'nics': nic_layout})
         self.pre_cleanup()
+        if self.manifest is not None:
+            self.manifest['receiver'] = self.remote_host_info()
+            self.manifest['sender'] = self.local_host_info()
+            if self.local_topology is not None:
+                self.manifest['local_topology'] = self.local_topology._asdict()
+        # Sender and receiver samples are put on one timeline by the offset between their clocks.
+        clock = {'start': self.measure_clock_offset()}
         
         if self.enable_suricata:
             logging.info('Spawning resmon and suricata.')
@@ -152,35 +358,81 @@ class SuricataTest(suricata_base.SuritacaTestBase):
                     'PATH': '/opt/intel/vtune_amplifier_xe_2017.2.0.499904/bin64:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin:/snap/bin'
                 }
             logging.info('Suricata command: "%s"', ' '.join(suricata_cmd))
-            self.sysmon_proc = self.shell.spawn(['sudo', 'resmon',
-                                                 '--delay', str(self.stat_delay_sec),
-                                                 '--outfile', 'sysstat.receiver.csv',
-                                                 '--ps-cmd', '--ps-cmd-outfile', 'psstat.suricata.csv',
-                                                 '--'] + suricata_cmd, **suricata_cmd_args)
+            methods = self.receiver_resmon_methods()
+            self.resmon_compression = self.resmon_compress_method(methods)
+            resmon_cmd = ['sudo', 'resmon',
+                          '--delay', str(self.stat_delay_sec),
+                          '--outfile', 'sysstat.receiver.csv',
+                          '--nic', ','.join(n.nic for n in self.remote_nics),
+                          '--ps-cmd', '--ps-cmd-outfile', 'psstat.suricata.csv'] + self.resmon_compress_args(methods)
+            if self.adaptive_duration:
+                # The steady-state detector reads the latest samples while resmon runs.
+                resmon_cmd.append('--flush')
+            self.sysmon_proc = self.shell.spawn(resmon_cmd + ['--'] + suricata_cmd, **suricata_cmd_args)
             time.sleep(1)
             if not self.sysmon_proc.is_running():
                 logging.critical('Test failed!')
                 self.post_cleanup()
                 return
             self.wait_for_suricata()
+            if self.counter_interval_sec is not None:
+                logging.info('Spawning counter monitor.')
+                self.counter_proc = self.shell.spawn(['sudo', 'suricounters',
+                                                      '--interval', str(self.counter_interval_sec),
+                                                      '--outfile', 'suricounters'],
+                                                     cwd=self.remote_tmpdir, store_pid=True, allow_error=True)
         
-        if self.test_method == 'iperf':
-            test_result = self.test_iperf()
-        elif self.test_method == 'tcpreplay':
-            test_result = self.test_tcpreplay()
+        sender_sysmon_proc = self.spawn_sender_resmon()
+        self.traffic_stopped = False
+        try:
+            if self.adaptive_duration:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                    traffic = executor.submit(self.run_traffic)
+                    self.wait_for_steady_state(traffic)
+                    test_result = traffic.result()
+            else:
+                test_result = self.run_traffic()
+        finally:
+            if sender_sysmon_proc is not None:
+                sender_sysmon_proc.send_signal(signal.SIGTERM)
+                sender_sysmon_proc.wait()
+            clock['end'] = self.measure_clock_offset()
+            with open(os.path.join(self.local_tmpdir, 'clock.json'), 'w') as f:
+                json.dump(clock, f, indent=2, sort_keys=True)
 
         if self.enable_suricata:
             if self.enable_vtune:
-                subprocess.call(['ssh', '%s@%s' % (self.remote_user, self.remote_host), 'pkill', '-15', 'Suricata-Main'])
+                self.simple_call(['pkill', '-15', 'Suricata-Main'])
             # self.sysmon_proc.send_signal(signal.SIGTERM)
             # self.sysmon_proc.wait_for_result()
-            subprocess.call(['ssh', '%s@%s' % (self.remote_user, self.remote_host), 'pkill', '-15', 'resmon'])
-            while subprocess.call(['ssh', '%s@%s' % (self.remote_user, self.remote_host), 'ps', '-p', str(self.sysmon_proc.pid)]) == 0:
+            if self.counter_interval_sec is not None:
+                self.simple_call(['sudo', 'pkill', '-15', 'suricounters'])
+            self.simple_call(['pkill', '-15', 'resmon'])
+            while self.simple_call(['ps', '-p', str(self.sysmon_proc.pid)]) == 0:
                 logging.info('Waiting for 1 second for resmon to stop.')
                 time.sleep(1)
+            if self.raw_logs != 'upload':
+                self.raw_path = self.reduce_remote_run(self.raw_logs, self.raw_dir)
+            if self.compression is not None:
+                method = self.compress_remote_logs(self.compression)
+                if self.raw_path is not None:
+                    self.compress_remote_logs(method, self.raw_path)
+
+        if self.manifest is not None:
+            self.manifest['run']['end_time'] = int(time.time())
+            self.manifest['run']['result'] = test_result
+            # Where fetch_raw_logs.py finds the raw logs kept on the receiver.
+            # In single-host mode, they are on this host.
+            self.manifest['raw_logs'] = {'mode': self.raw_logs,
+                                         'host': self.remote_host if self.local_topology is None else None,
+                                         'user': self.remote_user, 'dir': self.raw_path}
+            with open(os.path.join(self.local_tmpdir, catalog.MANIFEST_FILE), 'w') as f:
+                json.dump(self.manifest, f, indent=2, sort_keys=True)
 
         if test_result == 0:
-            self.commit_local_dir(self.local_tmpdir, self.data_repo.repo_user, self.data_repo.repo_host, self.data_repo.repo_dir)
-            self.commit_remote_dir(self.remote_tmpdir, self.data_repo.repo_user, self.data_repo.repo_host, self.data_repo.repo_dir)
+            self.commit_local_dir(self.local_tmpdir, self.data_repo.repo_user, self.data_repo.repo_host, self.data_repo.repo_dir,
+                                  compress=self.compression is None)
+            self.commit_remote_dir(self.remote_tmpdir, self.data_repo.repo_user, self.data_repo.repo_host, self.data_repo.repo_dir,
+                                   compress=self.compression is None)
             self.delete_tmpdir()
         self.post_cleanup()
@@ -12,6 +12,8 @@ import time
 
 import spur
 
+from . import netns
+
 
 class TestBase:
 
@@ -29,6 +31,11 @@ class TestBase:
     def simple_call(self, cmd):
         return self.simple_cmd(self.shell, cmd)
 
+    def output_call(self, cmd):
+        """ Run the command and return its return code and stdout as str. """
+        result = self.shell.run(cmd, allow_error=True)
+        return result.return_code, result.output.decode('utf-8', 'replace')
+
     def adjust_swappiness(self, swappiness):
         self.simple_call(['sudo', 'sysctl', '-w', 'vm.swappiness=' + str(swappiness)])
         self.simple_call(['sysctl', 'vm.swappiness'])
@@ -37,11 +44,19 @@ class TestBase:
         if hasattr(self, '_shell'):
             del self._shell
 
-    def commit_local_dir(self, dir, remote_user, remote_host, remote_dir):
-        subprocess.call(['rsync', '-zvrpE', dir, '%s@%s:%s/' % (remote_user, remote_host, remote_dir)])
+    @staticmethod
+    def rsync_dest(remote_user, remote_host, remote_dir):
+        """ rsync destination of a directory, local if remote_host is None. """
+        if remote_host is None:
+            return remote_dir + '/'
+        return '%s@%s:%s/' % (remote_user, remote_host, remote_dir)
+
+    # rsync compresses the transfer only if asked to; runs whose large files are compressed already skip it.
+    def commit_local_dir(self, dir, remote_user, remote_host, remote_dir, compress=False):
+        subprocess.call(['rsync', '-vrpEz' if compress else '-vrpE', dir, self.rsync_dest(remote_user, remote_host, remote_dir)])
 
-    def commit_remote_dir(self, dir, remote_user, remote_host, remote_dir):
-        self.simple_call(['rsync', '-zvrpE', dir, '%s@%s:%s/' % (remote_user, remote_host, remote_dir)])
+    def commit_remote_dir(self, dir, remote_user, remote_host, remote_dir, compress=False):
+        self.simple_call(['rsync', '-vrpEz' if compress else '-vrpE', dir, self.rsync_dest(remote_user, remote_host, remote_dir)])
 
     @classmethod
     def reboot_remote_host(cls, host, user, wait_sec=30):
@@ -60,6 +75,11 @@ class TestBase:
                              missing_host_key=spur.ssh.MissingHostKey.accept,
                              load_system_host_keys=True, look_for_private_keys=True)
 
+    @classmethod
+    def get_netns_shell(cls, ns):
+        logging.info('Obtaining shell in network namespace "%s"...' % ns)
+        return netns.NetnsShell(ns)
+
     @classmethod
     def simple_cmd(cls, shell, cmd):
         return shell.run(cmd, allow_error=True).return_code
@@ -0,0 +1,81 @@
+import collections
+import unittest
+
+import numpy as np
+
+from suricata.dataparser import align
+
+
+def matrix(*rows):
+    return np.array(rows, dtype=np.float64)
+
+
+class ResampleTest(unittest.TestCase):
+
+    def test_linear_interpolates_inside_the_run_only(self):
+        keys = np.array([2.0, 4.0, 8.0])
+        out = align.resample_linear(keys, matrix([10, 20, 60]), np.arange(0.0, 11.0, 1.0))
+        np.testing.assert_array_equal(out[0], [np.nan, np.nan, 10, 15, 20, 30, 40, 50, 60, np.nan, np.nan])
+
+    def test_linear_with_repeated_keys(self):
+        keys = np.array([1.0, 2.0, 2.0, 3.0])
+        out = align.resample_linear(keys, matrix([1, 2, 5, 6]), np.array([1.0, 2.0, 2.5, 3.0]))
+        np.testing.assert_array_equal(out[0], [1, 5, 5.5, 6])
+
+    def test_linear_with_fewer_than_two_samples(self):
+        grid = np.array([3.0, 4.0, 5.0])
+        # A single sample only counts at its own key.
+        out = align.resample_linear(np.array([4.0]), matrix([7], [8]), grid)
+        np.testing.assert_array_equal(out, [[np.nan, 7, np.nan], [np.nan, 8, np.nan]])
+        out = align.resample_linear(np.empty(0), np.empty((2, 0)), grid)
+        self.assertEqual(out.shape, (2, 3))
+        self.assertTrue(np.isnan(out).all())
+
+    def test_nearest_tolerance(self):
+        keys = np.array([1.0, 2.1, 4.0])
+        grid = np.array([0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+        out = align.resample_nearest(keys, matrix([1, 2, 4]), grid, 0.5)
+        # 3.0 is 0.9 from 2.1 and 1.0 from 4.0; 0.0 and 5.0 are 1.0 away from the ends.
+        np.testing.assert_array_equal(out[0], [np.nan, 1, 2, np.nan, 4, np.nan, np.nan])
+        out = align.resample_nearest(keys, matrix([1, 2, 4]), grid, 1.0)
+        # Up to the tolerance, grid points outside the run take the sample at its end.
+        np.testing.assert_array_equal(out[0], [1, 1, 2, 2, 4, 4, np.nan])
+
+    def test_nearest_with_fewer_than_two_samples(self):
+        out = align.resample_nearest(np.array([4.0]), matrix([7]), np.array([3.0, 4.0, 6.0]), 1.0)
+        np.testing.assert_array_equal(out[0], [7, 7, np.nan])
+        out = align.resample_nearest(np.empty(0), np.empty((1, 0)), np.array([3.0, 4.0]), 1.0)
+        self.assertTrue(np.isnan(out).all())
+
+
+class AlignerTest(unittest.TestCase):
+
+    def run_table(self, uptime, **columns):
+        run = collections.OrderedDict([('uptime', np.array(uptime))])
+        for name, values in columns.items():
+            run[name] = np.array(values)
+        return run
+
+    def test_runs_with_different_columns(self):
+        runs = [self.run_table([0, 8, 16], pkts=[0, 80, 160], drops=[0, 1, 2]),
+                self.run_table([4, 12, 20, 28], pkts=[40, 120, 200, 280], alerts=[1, 1, 2, 2],
+                               version=np.array(['4.0'] * 4))]
+        step, aligned = align.Aligner('uptime', 'linear').align(runs)
+        self.assertEqual(step, 8.0)
+        np.testing.assert_array_equal(aligned[0]['uptime'], [0, 8, 16, 24])
+        # Every run keeps its own numeric columns, on the same grid.
+        self.assertEqual(list(aligned[0]), ['uptime', 'pkts', 'drops'])
+        self.assertEqual(list(aligned[1]), ['uptime', 'pkts', 'alerts'])
+        np.testing.assert_array_equal(aligned[0]['pkts'], [0, 80, 160, np.nan])
+        np.testing.assert_array_equal(aligned[1]['pkts'], [np.nan, 80, 160, 240])
+
+    def test_runs_without_samples_are_skipped(self):
+        runs = [self.run_table([], pkts=[]), self.run_table([5], pkts=[50]), {'pkts': np.array([1])}]
+        step, aligned = align.Aligner('uptime', 'nearest', step=2.0).align(runs)
+        self.assertEqual(len(aligned), 1)
+        np.testing.assert_array_equal(aligned[0]['uptime'], [4])
+        np.testing.assert_array_equal(aligned[0]['pkts'], [50])
+
+
+if __name__ == '__main__':
+    unittest.main()
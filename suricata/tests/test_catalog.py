@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from suricata.dataparser import catalog
+
+
+RUN_NAME = '2c4d_snort.log_workers_8_2nics_0_1500000000'
+
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, RUN_NAME))
+        os.mkdir(os.path.join(self.root, 'notes'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_skipped_directories_are_read_again_only_once_changed(self):
+        with catalog.Catalog(self.root) as runs, \
+                mock.patch.object(catalog, 'entry_from_dirname', wraps=catalog.entry_from_dirname) as read:
+            nchanged, nremoved, skipped = runs.update(1)
+            self.assertEqual((nchanged, nremoved), (1, 0))
+            self.assertEqual([path for path, _ in skipped], ['notes'])
+            self.assertEqual(read.call_count, 2)
+
+            self.assertEqual(runs.update(1), (0, 0, []))
+            self.assertEqual(read.call_count, 2)
+
+            st = os.stat(os.path.join(self.root, 'notes'))
+            os.utime(os.path.join(self.root, 'notes'), ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+            self.assertEqual([path for path, _ in runs.update(1)[2]], ['notes'])
+            self.assertEqual(read.call_count, 3)
+            self.assertEqual([e.path for e in runs.select()], [RUN_NAME])
+
+    def test_read_only_root_uses_the_user_cache_dir(self):
+        cache_home = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_home)
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': cache_home}), \
+                mock.patch.object(os, 'access', return_value=False):
+            path = catalog.default_db_path(self.root)
+            with catalog.Catalog(self.root) as runs:
+                runs.update(1)
+                self.assertEqual(runs.db_path, path)
+        self.assertTrue(path.startswith(cache_home))
+        self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(os.path.join(self.root, catalog.DEFAULT_DB_NAME)))
+        self.assertEqual(catalog.default_db_path(self.root), os.path.join(self.root, catalog.DEFAULT_DB_NAME))
+
+
+if __name__ == '__main__':
+    unittest.main()
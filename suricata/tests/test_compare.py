@@ -0,0 +1,72 @@
+import math
+import unittest
+
+import numpy as np
+
+from suricata.dataparser import compare
+
+
+def brute_force(old, new, relative, nresamples, alpha, seed):
+    """
+    Resample the repeats with the draws of bootstrap_change, take the median of every resample and
+    the change between every pair of old and new resamples. bootstrap_change draws indices into the
+    sorted repeats.
+    """
+    rng = np.random.default_rng(seed)
+    draws = dict()
+    for n in (len(old), len(new)):
+        if n not in draws:
+            draws[n] = rng.integers(0, n, size=(nresamples, n))
+    medians_old = np.median(np.sort(old)[draws[len(old)]], axis=1)
+    medians_new = np.median(np.sort(new)[draws[len(new)]], axis=1)
+    changes = np.sort(compare._change(medians_old[:, None], medians_new[None, :], relative).ravel())
+    # The smallest change whose cumulative share reaches the quantile.
+    return tuple(changes[math.ceil(q * len(changes)) - 1] for q in (alpha / 2, 1 - alpha / 2))
+
+
+class BootstrapChangeTest(unittest.TestCase):
+
+    def assert_matches_brute_force(self, old, new, relative=True, nresamples=300, alpha=0.1, seed=7):
+        change, low, high = compare.bootstrap_change([np.array(old, dtype=np.float64)],
+                                                     [np.array(new, dtype=np.float64)],
+                                                     relative, nresamples, alpha, np.random.default_rng(seed))
+        expected_low, expected_high = brute_force(old, new, relative, nresamples, alpha, seed)
+        np.testing.assert_allclose([low[0], high[0]], [expected_low, expected_high])
+        return change[0], low[0], high[0]
+
+    def test_odd_repeats(self):
+        self.assert_matches_brute_force([10.0, 12.0, 9.0, 11.0, 30.0], [8.0, 7.5, 9.5, 8.0, 7.0])
+
+    def test_even_repeats(self):
+        self.assert_matches_brute_force([10.0, 12.0, 9.0, 11.0], [8.0, 7.5, 9.5, 8.0, 7.0, 6.0])
+
+    def test_same_number_of_repeats(self):
+        self.assert_matches_brute_force([1.0, 2.0, 3.0, 4.0, 5.0, 6.0], [2.0, 2.5, 3.0, 4.5, 6.0, 9.0])
+
+    def test_absolute(self):
+        self.assert_matches_brute_force([0.0, 0.01, 0.0, 0.02], [0.05, 0.04, 0.06], relative=False)
+
+    def test_relative_from_zero(self):
+        # Most resamples of the old campaign have a median of 0, so their relative change is infinite.
+        change, low, high = self.assert_matches_brute_force([0.0, 0.0, 0.0, 1.0, 2.0], [3.0, 4.0, 5.0])
+        self.assertEqual(change, np.inf)
+        self.assertFalse(np.isnan(low) or np.isnan(high))
+        self.assertGreater(low, 0)
+        verdict = compare.classify(np.array([change]), np.array([low]), np.array([high]), better=-1)
+        self.assertEqual(verdict[0], 'regression')
+
+    def test_relative_zero_to_zero(self):
+        change, low, high = self.assert_matches_brute_force([0.0, 0.0, 0.0], [0.0, 0.0])
+        self.assertEqual((change, low, high), (0.0, 0.0, 0.0))
+
+    def test_median_pairs(self):
+        for nrepeats in (2, 3, 4, 5):
+            lower, upper, weights = compare.median_pairs(nrepeats, 1000, np.random.default_rng(1))
+            self.assertAlmostEqual(weights.sum(), 1.0)
+            self.assertTrue(np.all(lower <= upper))
+            if nrepeats % 2:
+                np.testing.assert_array_equal(lower, upper)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import collections
+import math
+import unittest
+
+import numpy as np
+
+from suricata.dataparser import drops
+
+
+RATE = 1000
+
+
+def lossless_table(duration=44, stats_interval=8):
+    """
+    Joined table of a run where every stage sees the same RATE packets per sec. The NIC monitor
+    samples every sec from the start, Suricata writes its first stats record stats_interval sec later.
+    """
+    grid = np.arange(duration + 1, dtype=np.float64)
+    packets = RATE * grid
+    suricata = np.where(grid >= stats_interval, packets, np.nan)
+    zeros = np.zeros(len(grid))
+    return collections.OrderedDict([
+        ('Timestamp', grid),
+        ('sender.net.eth1.sent.pkts', packets),
+        ('net.eth1.recv.pkts', packets),
+        ('net.eth1.drop.in', zeros),
+        ('net.eth1.err.in', zeros),
+        ('eve.capture.kernel_packets', suricata),
+        ('eve.capture.kernel_drops', np.where(grid >= stats_interval, 0.0, np.nan)),
+        ('eve.decoder.pkts', suricata),
+    ])
+
+
+class AttributeTest(unittest.TestCase):
+
+    def assert_lossless(self, row):
+        for stage in drops.STAGES:
+            self.assertEqual(row['loss.' + stage], 0.0, stage)
+        self.assertEqual(row['loss_ratio'], 0.0)
+        self.assertIsNone(row['dominant'])
+
+    def test_no_loss_when_every_stage_sees_the_same_packets(self):
+        total, windows = drops.attribute_table(lossless_table(), sent=44 * RATE, window_sec=10)
+        self.assert_lossless(total)
+        self.assertEqual(total['nic_rx'], 44 * RATE)
+        self.assertEqual(total['kernel_packets'], 44 * RATE)
+        self.assertEqual(len(windows), 5)
+        for row in windows:
+            self.assert_lossless(row)
+
+    def test_total_ends_at_the_last_stats_record(self):
+        # The NIC monitors run on after the last stats record. The packets reported sent cover the
+        # whole run, so the sender NIC counter is used instead.
+        table = lossless_table()
+        for name in ('eve.capture.kernel_packets', 'eve.capture.kernel_drops', 'eve.decoder.pkts'):
+            table[name][-4:] = np.nan
+        total, _ = drops.attribute_table(table, sent=44 * RATE)
+        self.assert_lossless(total)
+        self.assertEqual(total['end'], 40.0)
+        self.assertEqual(total['sent'], 40 * RATE)
+        self.assertEqual(total['sent_reported'], 44 * RATE)
+
+    def test_window_before_the_first_stats_record(self):
+        # The NIC counts packets before Suricata writes its first stats record. The window only
+        # covers the part where both have samples.
+        _, windows = drops.attribute_table(lossless_table(stats_interval=8), window_sec=10)
+        self.assertEqual((windows[0]['start'], windows[0]['end']), (8.0, 10.0))
+        self.assertEqual(windows[0]['nic_rx'], 2 * RATE)
+
+    def test_missing_counters_are_nan(self):
+        table = lossless_table()
+        del table['eve.decoder.pkts']
+        total, _ = drops.attribute_table(table)
+        self.assertTrue(math.isnan(total['loss.suricata']))
+        self.assertEqual(total['loss.capture'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
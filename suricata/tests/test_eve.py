@@ -0,0 +1,83 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from suricata.dataparser import eve
+
+
+def compact(obj):
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def stats_record(i):
+    return {'timestamp': '2018-01-01T00:00:%02d.000000+0000' % i, 'event_type': 'stats',
+            'stats': {'uptime': 8 * i,
+                      'capture': {'kernel_packets': 1000 * i, 'kernel_drops': 3 * i},
+                      'decoder': {'pkts': 997 * i, 'bytes': 1500 * 997 * i},
+                      'detect': {'alert': i}}}
+
+
+def alert_record(i):
+    # The stats marker is quoted inside the alert, so a byte search finds it too.
+    return {'timestamp': '2018-01-01T00:00:%02d.500000+0000' % i, 'event_type': 'alert',
+            'alert': {'signature': 'ET POLICY ' + 'x' * (7 * i % 23)},
+            'metadata': {'event_type': 'stats', 'stats': {'uptime': 10 ** 6}}}
+
+
+class EveParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'eve.json')
+        lines = []
+        for i in range(40):
+            lines.append(compact(alert_record(i)))
+            lines.append(compact({'event_type': 'flow', 'flow': {'pkts_toserver': i}}))
+            lines.append(compact(stats_record(i)))
+        # A later record with the same uptime replaces the earlier one.
+        lines.append(compact(stats_record(39)))
+        # The last record has no line break after it.
+        data = '\n'.join(lines).encode('utf-8')
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        # Byte offsets inside the marker of a stats record.
+        self.inside_stats_marker = set()
+        offset = 0
+        for line in lines:
+            if line.startswith('{"timestamp"') and json.loads(line)['event_type'] == 'stats':
+                pos = offset + line.index(eve.STATS_MARKER.decode('utf-8'))
+                self.inside_stats_marker.update(range(pos + 1, pos + len(eve.STATS_MARKER)))
+            offset += len(line) + 1
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assert_same(self, expected, actual):
+        self.assertEqual(list(expected), list(actual))
+        for name in expected:
+            self.assertEqual(expected[name].dtype, actual[name].dtype, name)
+            np.testing.assert_array_equal(expected[name], actual[name], name)
+
+    def test_mmap_workers_match_line_reader(self):
+        expected = eve.EveParser(use_mmap=False).parse(self.path)
+        self.assertEqual(len(expected['uptime']), 40)
+        # Besides a few worker counts whose ranges start mid-record, the first one whose ranges
+        # split the marker of a stats record.
+        split_marker = next(w for w in range(2, 100)
+                            if any(start in self.inside_stats_marker
+                                   for start, _ in eve.EveStatsExtractor(w).split(self.path, w)))
+        for workers in (1, 2, 3, 7, split_marker):
+            self.assert_same(expected, eve.EveParser(use_mmap=True, workers=workers).parse(self.path))
+
+    def test_with_timestamp(self):
+        records = eve.EveStatsExtractor(workers=3).extract(self.path, with_timestamp=True)
+        self.assertEqual(len(records), 41)
+        self.assertEqual(records[0], (stats_record(0)['timestamp'], stats_record(0)['stats']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+
+from suricata.dataparser import eve
+from suricata.dataparser import statschema
+
+
+THREADS_SCHEMA = {
+    'uptime': 'key',
+    'threads': {'*': {'capture': {'kernel_packets': 'avg'}}},
+}
+
+
+def thread(packets):
+    return {'capture': {'kernel_packets': packets}, 'decoder': {'pkts': packets}}
+
+
+class ExtendTest(unittest.TestCase):
+
+    def parse(self, schema, records):
+        return eve.EveParser(schema=schema).parse_records(records)
+
+    def test_counter_added_under_an_existing_key(self):
+        records = [{'uptime': 8, 'decoder': {'pkts': 10}, 'detect': {'alert': 0}},
+                   {'uptime': 16, 'decoder': {'pkts': 20, 'invalid': 1}, 'detect': {'alert': 0}}]
+        data = self.parse(statschema.ALL_NUMERIC, records)
+        self.assertEqual(list(data), ['uptime', 'decoder.pkts', 'detect.alert', 'decoder.invalid'])
+        np.testing.assert_array_equal(data['decoder.invalid'], [np.nan, 1])
+
+    def test_counter_added_deeper(self):
+        records = [{'uptime': 8, 'app_layer': {'flow': {'http': 1}}},
+                   {'uptime': 16, 'app_layer': {'flow': {'http': 2}, 'tx': {'http': 3}}},
+                   {'uptime': 24, 'app_layer': {'flow': {'http': 3}, 'tx': {'http': 4, 'tls': 1}}}]
+        data = self.parse(statschema.ALL_NUMERIC, records)
+        self.assertEqual(list(data), ['uptime', 'app_layer.flow.http', 'app_layer.tx.http', 'app_layer.tx.tls'])
+        np.testing.assert_array_equal(data['app_layer.tx.tls'], [np.nan, np.nan, 1])
+
+    def test_thread_renamed_with_the_same_thread_count(self):
+        records = [{'uptime': 8, 'threads': {'W#01-eth0': thread(10), 'FM#01': {'flow_mgr': {'new_pruned': 0}}}},
+                   {'uptime': 16, 'threads': {'W#02-eth0': thread(20), 'FM#01': {'flow_mgr': {'new_pruned': 0}}}}]
+        for schema, expected in ((THREADS_SCHEMA, ['threads.W#01-eth0.capture.kernel_packets',
+                                                   'threads.W#02-eth0.capture.kernel_packets']),
+                                 (statschema.ALL_NUMERIC, ['threads.W#01-eth0.capture.kernel_packets',
+                                                           'threads.W#01-eth0.decoder.pkts',
+                                                           'threads.FM#01.flow_mgr.new_pruned',
+                                                           'threads.W#02-eth0.capture.kernel_packets',
+                                                           'threads.W#02-eth0.decoder.pkts'])):
+            data = self.parse(schema, records)
+            self.assertEqual(list(data)[1:], expected)
+            np.testing.assert_array_equal(data['threads.W#02-eth0.capture.kernel_packets'], [np.nan, 20])
+
+    def test_same_layout_keeps_the_schema(self):
+        compiled = statschema.CompiledSchema(THREADS_SCHEMA, {'uptime': 8, 'threads': {'W#01': thread(1)}})
+        self.assertIs(compiled.extend({'uptime': 16, 'threads': {'W#01': thread(2)}}), compiled)
+        # Another layout without new columns keeps the schema and takes the layout as the known one.
+        other = {'uptime': 24, 'threads': {'W#01': thread(3)}, 'flow': {'memuse': 1}}
+        self.assertIs(compiled.extend(other), compiled)
+        self.assertEqual(compiled.signature, compiled.shape(other))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from suricata.dataparser import counters
+
+
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'tools')
+
+_spec = importlib.util.spec_from_file_location('suricounters', os.path.join(TOOLS_DIR, 'suricounters.py'))
+suricounters = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(suricounters)
+
+
+def reply(message, ret='OK'):
+    return json.dumps({'return': ret, 'message': message}, ensure_ascii=False).encode('utf-8')
+
+
+class FakeSuricata:
+    """
+    Stand-in for the Suricata command socket. Each connection answers the version handshake, then
+    one command per action of the script: ('send', [chunks]) sends the reply in separate recv
+    chunks, ('drop', data) sends data and closes the connection.
+    """
+
+    def __init__(self, path, script):
+        self.script = list(script)
+        self.connections = 0
+        self.commands = []
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(4)
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.close()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            with conn:
+                try:
+                    self.handle(conn)
+                except OSError:
+                    pass
+
+    def handle(self, conn):
+        lines = conn.makefile('rb')
+        if json.loads(lines.readline()) != {'version': suricounters.PROTOCOL_VERSION}:
+            return
+        conn.sendall(reply('0.1'))
+        while self.script:
+            line = lines.readline()
+            if not line:
+                return
+            self.commands.append(json.loads(line)['command'])
+            action, data = self.script.pop(0)
+            if action == 'drop':
+                conn.sendall(data)
+                return
+            for chunk in data:
+                conn.sendall(chunk)
+                time.sleep(0.05)
+
+
+class CounterMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmpdir, 'suricata-command.socket')
+        self.prefix = os.path.join(self.tmpdir, 'suricounters')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def monitor(self, script, polls):
+        fake = FakeSuricata(self.socket_path, script)
+        stderr = io.StringIO()
+        try:
+            with contextlib.redirect_stderr(stderr):
+                with suricounters.CounterMonitor(self.socket_path, self.prefix, connect_timeout=5) as cm:
+                    for _ in range(polls):
+                        cm.poll_stat()
+        finally:
+            fake.close()
+        return fake, stderr.getvalue()
+
+    def test_reconnect_and_padding(self):
+        # The name of the first thread has a two-byte character split across recv chunks.
+        first = reply({'uptime': 1, 'threads': {'W#01-é': {'capture': {'kernel_packets': 10}}}})
+        split = first.index('é'.encode('utf-8')) + 1
+        second = reply({'uptime': 2, 'threads': {'W#02-eth0': {'capture': {'kernel_packets': 20}}}})
+        script = [
+            ('send', [first[:split], first[split:-3], first[-3:]]),
+            ('send', [reply('Unknown command', ret='NOK')]),
+            ('drop', second[:20]),
+            ('send', [second]),
+        ]
+        fake, stderr = self.monitor(script, polls=4)
+
+        self.assertEqual(fake.commands, ['dump-counters'] * 4)
+        # The error reply keeps the connection, the dropped one is reconnected.
+        self.assertEqual(fake.connections, 2)
+        self.assertEqual(stderr.count('Warning: dump-counters failed'), 2)
+
+        parsed = counters.CounterParser().parse(self.prefix + '.json')
+        self.assertEqual(list(parsed), ['Timestamp', 'threads.W#01-é.capture.kernel_packets', 'uptime',
+                                        'threads.W#02-eth0.capture.kernel_packets'])
+        self.assertEqual(len(parsed['Timestamp']), 2)
+        self.assertEqual(list(parsed['uptime']), [1, 2])
+        # Counters that are missing from a row are -1.
+        self.assertEqual(list(parsed['threads.W#01-é.capture.kernel_packets']), [10, -1])
+        self.assertEqual(list(parsed['threads.W#02-eth0.capture.kernel_packets']), [-1, 20])
+
+    def test_non_dict_message_is_skipped(self):
+        script = [
+            ('send', [reply('no counters yet')]),
+            ('send', [reply({'uptime': 3})]),
+        ]
+        fake, stderr = self.monitor(script, polls=2)
+        self.assertEqual(fake.connections, 1)
+        self.assertIn('Warning: dump-counters returned no counters', stderr)
+        parsed = counters.CounterParser().parse(self.prefix + '.bin')
+        self.assertEqual(list(parsed['uptime']), [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+#!/usr/bin/python3
+
+"""
+bench_resmon.py
+
+Benchmark of the cost of one poll of every resmon monitor, to know how fast resmon can sample
+before it disturbs what it measures.
+
+A synthetic process tree is spawned for every size to measure: a root process with --procs
+child processes, each running --threads threads that sleep, or spin if --busy is given. Then
+every monitor is polled --polls times, --interval sec apart, against it:
+
+  system    SystemMonitor.poll_stat, whose cost grows with the number of cores
+  nic       NetworkInterfaceMonitor.poll_stat of loopback and, with --veth, of veth pairs created for
+            the benchmark (needs root)
+  process   ProcessSetMonitor.poll_stat of the root of the tree, whose cost grows with the tree
+
+The wall time and the CPU time (user + system) of this process are taken around every poll, and
+their mean, p50, p99 and max are reported per monitor and tree size, with the number of cores of
+the host. Output goes to /dev/null, so the cost of writing is left out. The results are printed
+as a table and written as JSON lines with --output, one object per monitor and size, to track
+regressions across versions and hosts.
+
+Example usage:
+
+$ bench_resmon --procs 1 10 100 --threads 1 8 --polls 200 --output bench.jsonl
+$ sudo bench_resmon --veth 16 --busy --procs 10 --threads 4
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+import psutil
+
+from resmon import NetworkInterfaceMonitor, ProcessSetMonitor, SystemMonitor
+
+
+VETH_PREFIX = 'rmbench'
+
+
+def spin():
+    while True:
+        pass
+
+
+def child_main(nthreads, busy):
+    """ Body of a process of the tree: run the threads and wait to be killed. """
+    for _ in range(nthreads - 1):
+        threading.Thread(target=spin if busy else threading.Event().wait, daemon=True).start()
+    if busy:
+        spin()
+    threading.Event().wait()
+
+
+def child_cmd(nthreads, busy):
+    return [sys.executable, os.path.abspath(__file__), '--child', str(nthreads)] + (['--busy'] if busy else [])
+
+
+class ProcessTree:
+    """ A root process with nprocs children of nthreads threads each. """
+
+    def __init__(self, nprocs, nthreads, busy=False):
+        # The children are started by the root, so that they are in its tree.
+        script = ('import subprocess, threading\n'
+                  'procs = [subprocess.Popen(%r) for _ in range(%d)]\n'
+                  'threading.Event().wait()\n' % (child_cmd(nthreads, busy), nprocs))
+        self.root = subprocess.Popen([sys.executable, '-c', script])
+        # Wait for the tree to be complete.
+        root = psutil.Process(self.root.pid)
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            children = root.children()
+            if len(children) == nprocs and all(c.num_threads() >= nthreads for c in children):
+                break
+            time.sleep(0.05)
+        self.nprocs = len(root.children(recursive=True))
+
+    def close(self):
+        for c in psutil.Process(self.root.pid).children(recursive=True):
+            c.kill()
+        self.root.kill()
+        self.root.wait()
+
+
+def create_veths(n):
+    """ Create n veth pairs and return the names of their first ends. Needs root. """
+    names = []
+    for i in range(n):
+        name = '%s%d' % (VETH_PREFIX, i)
+        if subprocess.call(['ip', 'link', 'add', name, 'type', 'veth', 'peer', 'name', name + 'p'],
+                           stderr=subprocess.DEVNULL) != 0:
+            print('Warning: failed to create veth pair "%s". Use %d veth pairs.' % (name, i), file=sys.stderr)
+            break
+        subprocess.call(['ip', 'link', 'set', name, 'up'])
+        subprocess.call(['ip', 'link', 'set', name + 'p', 'up'])
+        names.append(name)
+    return names
+
+
+def delete_veths(names):
+    for name in names:
+        # Deleting one end deletes the pair.
+        subprocess.call(['ip', 'link', 'del', name])
+
+
+def percentile(sorted_values, p):
+    if len(sorted_values) == 0:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))]
+
+
+def measure(poll, npolls, interval):
+    """ Call poll npolls times. Return the lists of wall and CPU times, in ms, of every call. """
+    wall = []
+    cpu = []
+    for _ in range(npolls):
+        time.sleep(interval)
+        c0 = time.process_time()
+        w0 = time.perf_counter()
+        poll()
+        wall.append((time.perf_counter() - w0) * 1e3)
+        cpu.append((time.process_time() - c0) * 1e3)
+    return wall, cpu
+
+
+def summarize(monitor, wall, cpu, **params):
+    wall = sorted(wall)
+    cpu = sorted(cpu)
+    result = {'monitor': monitor, 'ncpu': psutil.cpu_count(), 'host': platform.node(), 'polls': len(wall)}
+    result.update(params)
+    result.update({
+        'wall_mean_ms': sum(wall) / len(wall),
+        'wall_p50_ms': percentile(wall, 50),
+        'wall_p99_ms': percentile(wall, 99),
+        'wall_max_ms': wall[-1],
+        'cpu_mean_ms': sum(cpu) / len(cpu),
+        'cpu_p99_ms': percentile(cpu, 99),
+    })
+    return result
+
+
+def print_result(r):
+    print('%-8s procs=%-5s threads=%-4s nics=%-4s ncpu=%-4d wall mean %8.3f p50 %8.3f p99 %8.3f max %8.3f ms, '
+          'cpu mean %8.3f p99 %8.3f ms' % (
+              r['monitor'], r.get('procs', '-'), r.get('threads', '-'), r.get('nics', '-'), r['ncpu'],
+              r['wall_mean_ms'], r['wall_p50_ms'], r['wall_p99_ms'], r['wall_max_ms'], r['cpu_mean_ms'],
+              r['cpu_p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the cost of one poll of every resmon monitor.')
+    parser.add_argument('--procs', type=int, nargs='+', default=[1, 10, 100],
+                        help='Child processes of the synthetic trees to measure. Default: %(default)s.')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8],
+                        help='Threads of every child process. Default: %(default)s.')
+    parser.add_argument('--busy', default=False, action='store_true',
+                        help='If present, the threads of the tree spin instead of sleeping.')
+    parser.add_argument('--veth', type=int, default=0,
+                        help='Number of veth pairs to create and monitor besides loopback. Needs root. Default: 0.')
+    parser.add_argument('--polls', type=int, default=100, help='Polls per measurement. Default: %(default)s.')
+    parser.add_argument('--interval', type=float, default=0.01,
+                        help='Interval, in sec, between the polls. Default: %(default)s.')
+    parser.add_argument('--monitors', type=str, nargs='+', choices=('system', 'nic', 'process'),
+                        default=['system', 'nic', 'process'], help='Monitors to measure. Default: all.')
+    parser.add_argument('--output', '-o', type=str, default=None,
+                        help='File to append the results to, as one JSON object per line.')
+    parser.add_argument('--child', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        child_main(args.child, args.busy)
+        return 0
+
+    results = []
+    veths = create_veths(args.veth) if 'nic' in args.monitors and args.veth > 0 else []
+    # The monitors print to stderr when they start and close.
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    try:
+        if 'system' in args.monitors:
+            with SystemMonitor(os.devnull) as m:
+                results.append(summarize('system', *measure(m.poll_stat, args.polls, args.interval)))
+        if 'nic' in args.monitors:
+            nics = ['lo'] + veths
+            with NetworkInterfaceMonitor(os.devnull, nics) as m:
+                results.append(summarize('nic', *measure(m.poll_stat, args.polls, args.interval), nics=len(nics)))
+        if 'process' in args.monitors:
+            for nprocs in args.procs:
+                for nthreads in args.threads:
+                    tree = ProcessTree(nprocs, nthreads, args.busy)
+                    try:
+                        with ProcessSetMonitor(os.devnull, pids={tree.root.pid}) as m:
+                            results.append(summarize('process', *measure(m.poll_stat, args.polls, args.interval),
+                                                     procs=tree.nprocs + 1, threads=nthreads, busy=args.busy))
+                    finally:
+                        tree.close()
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+        delete_veths(veths)
+    for r in results:
+        print_result(r)
+    if args.output is not None:
+        with open(args.output, 'a') as f:
+            for r in results:
+                f.write(json.dumps(r, sort_keys=True) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
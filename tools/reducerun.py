@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+
+"""
+reducerun.py
+
+Run reducer shrinks a run directory on the receiver before it is sent to the data repository.
+
+It extracts the stats records of eve.json into "eve.stats.json", which has the line format of
+eve.json so the parsers read it in place of the full file, and writes "summary.json" with the
+counter deltas and rates of the run and the statistics of every resmon column. The raw logs
+(eve.json, alert and protocol logs, pcaps) are then moved to another directory, from which they
+can be uploaded later, or deleted.
+
+Only the standard library is used, so the tool runs wherever resmon does.
+
+Example usage:
+
+$ reducerun /tmp/2c4d_snort.log_workers_8_1nics_0_1493306210
+$ reducerun --raw move --raw-dir /var/tmp/suricata_raw /tmp/2c4d_snort.log_workers_8_1nics_0_1493306210
+"""
+
+import argparse
+import csv
+import fnmatch
+import gzip
+import io
+import json
+import mmap
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+
+
+STATS_MARKER = b'"event_type":"stats"'
+
+STATS_FILE = 'eve.stats.json'
+
+SUMMARY_FILE = 'summary.json'
+
+# Raw logs, possibly compressed already. stats.log and suricata.log are small and stay with the run.
+RAW_PATTERNS = ('eve.json*', 'fast.log*', 'http.log*', 'dns.log*', 'tls.log*', 'files-json.log*',
+                'drop.log*', 'unified2.alert*', '*.pcap*')
+
+RESMON_PATTERNS = ('*.csv', '*.csv.gz', '*.csv.zst')
+
+
+class ZstdReader(io.RawIOBase):
+    """ Reads the output of "zstd -dc". Closing it waits for zstd, and raises if zstd failed. """
+
+    def __init__(self, path):
+        self.path = path
+        self._proc = subprocess.Popen(['zstd', '-dcq', path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self._proc.stdout.readinto(b)
+        self._eof = self._eof or n == 0
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._proc.stdout.close()
+            error = self._proc.stderr.read().decode('utf-8', 'replace').strip()
+            self._proc.stderr.close()
+            # zstd is killed by SIGPIPE if the file was not read to its end, which is no error.
+            if self._proc.wait() != 0 and self._eof:
+                super().close()
+                raise OSError('zstd failed to decompress "%s": %s' % (self.path, error))
+        super().close()
+
+
+def open_binary(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        return io.BufferedReader(ZstdReader(path))
+    return open(path, 'rb')
+
+
+def iter_stats_lines(path):
+    """ Yield the lines of the stats records of an eve.json file, without the newline. """
+    if path.endswith('.gz') or path.endswith('.zst'):
+        with open_binary(path) as f:
+            for line in f:
+                if STATS_MARKER in line:
+                    yield line.rstrip(b'\n')
+        return
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            pos = m.find(STATS_MARKER)
+            while pos != -1:
+                line_start = m.rfind(b'\n', 0, pos) + 1
+                line_end = m.find(b'\n', pos)
+                if line_end == -1:
+                    line_end = len(m)
+                yield m[line_start:line_end]
+                pos = m.find(STATS_MARKER, line_end)
+
+
+def flatten(obj, prefix=''):
+    """ Numeric leaves of a stats object as {dotted name: value}. Per-thread counters are left out. """
+    flat = dict()
+    for key, value in obj.items():
+        if prefix == '' and key == 'threads':
+            continue
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def reduce_eve(rundir, eve_path):
+    """ Write the stats records to eve.stats.json and return the summary of the counters. """
+    first = last = None
+    nrecords = 0
+    with open(os.path.join(rundir, STATS_FILE), 'wb') as out:
+        for line in iter_stats_lines(eve_path):
+            ev = json.loads(line.decode('utf-8'))
+            # The marker may be quoted inside another record, e.g. in an alert payload.
+            if ev.get('event_type') != 'stats':
+                continue
+            out.write(line + b'\n')
+            nrecords += 1
+            if first is None:
+                first = ev['stats']
+            last = ev['stats']
+    if nrecords == 0:
+        return {'records': 0}
+    first_flat, last_flat = flatten(first), flatten(last)
+    duration = last.get('uptime', 0) - first.get('uptime', 0)
+    counters = dict()
+    for name, value in last_flat.items():
+        if name == 'uptime':
+            continue
+        delta = value - first_flat.get(name, 0)
+        counters[name] = {'first': first_flat.get(name), 'last': value, 'delta': delta,
+                          'rate': delta / duration if duration > 0 else None}
+    return {'records': nrecords, 'first_uptime': first.get('uptime'), 'last_uptime': last.get('uptime'),
+            'counters': counters}
+
+
+def summarize_csv(path):
+    """ Statistics of every numeric column of a resmon CSV. """
+    with io.TextIOWrapper(open_binary(path), encoding='utf-8', newline='') as f:
+        reader = csv.reader(f, skipinitialspace=True)
+        try:
+            header = next(reader)
+        except (StopIteration, EOFError):
+            return {'rows': 0, 'columns': {}}
+        rows = []
+        try:
+            for row in reader:
+                if len(row) == len(header):
+                    rows.append(row)
+        except EOFError:
+            # The stream of a monitor that got killed has no end.
+            pass
+    columns = dict()
+    for name, values in zip(header, zip(*rows)):
+        try:
+            values = [float(v) for v in values]
+        except ValueError:
+            continue
+        columns[name] = {'mean': statistics.mean(values), 'median': statistics.median(values),
+                         'min': min(values), 'max': max(values), 'first': values[0], 'last': values[-1]}
+    return {'rows': len(rows), 'columns': columns}
+
+
+def matching_files(rundir, patterns):
+    names = []
+    for name in sorted(os.listdir(rundir)):
+        if os.path.isfile(os.path.join(rundir, name)) and any(fnmatch.fnmatch(name, p) for p in patterns):
+            names.append(name)
+    return names
+
+
+def dir_size(rundir):
+    return sum(os.path.getsize(os.path.join(rundir, n)) for n in os.listdir(rundir)
+               if os.path.isfile(os.path.join(rundir, n)))
+
+
+def reduce_run(rundir, raw='keep', raw_dir=None):
+    """
+    :param raw: What to do with the raw logs: "keep" them in the run directory, "move" them to
+        raw_dir/<run directory name>, or "drop" them.
+    :return: The summary, also saved as summary.json in the run directory.
+    """
+    size_before = dir_size(rundir)
+    summary = {'version': 1, 'run': os.path.basename(os.path.normpath(rundir)), 'eve': None, 'resmon': dict()}
+    eve_files = matching_files(rundir, ('eve.json', 'eve.json.gz', 'eve.json.zst'))
+    if len(eve_files) > 0:
+        summary['eve'] = reduce_eve(rundir, os.path.join(rundir, eve_files[0]))
+    for name in matching_files(rundir, RESMON_PATTERNS):
+        summary['resmon'][name] = summarize_csv(os.path.join(rundir, name))
+    raw_files = matching_files(rundir, RAW_PATTERNS)
+    summary['raw'] = {'action': raw, 'files': raw_files,
+                      'bytes': sum(os.path.getsize(os.path.join(rundir, n)) for n in raw_files)}
+    if raw == 'move':
+        dest = os.path.join(raw_dir, summary['run'])
+        os.makedirs(dest, exist_ok=True)
+        for name in raw_files:
+            shutil.move(os.path.join(rundir, name), os.path.join(dest, name))
+        summary['raw']['dir'] = dest
+    elif raw == 'drop':
+        for name in raw_files:
+            os.remove(os.path.join(rundir, name))
+    summary['bytes_before'] = size_before
+    summary['bytes_after'] = dir_size(rundir)
+    with open(os.path.join(rundir, SUMMARY_FILE), 'w') as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reduce a Suricata run directory to its stats and summary.')
+    parser.add_argument('rundir', type=str, help='Run directory to reduce.')
+    parser.add_argument('--raw', type=str, choices=('keep', 'move', 'drop'), default='keep',
+                        help='What to do with the raw logs. Default: keep them in the run directory.')
+    parser.add_argument('--raw-dir', type=str, default=None,
+                        help='Directory to move the raw logs to, into a subdirectory named after the run.')
+    args = parser.parse_args()
+    if args.raw == 'move' and args.raw_dir is None:
+        parser.error('--raw move needs --raw-dir.')
+    summary = reduce_run(args.rundir, args.raw, args.raw_dir)
+    print('Reduced "%s" from %d to %d bytes.' % (args.rundir, summary['bytes_before'], summary['bytes_after']),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
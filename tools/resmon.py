@@ -15,11 +15,14 @@ Example usage:
 $ resmon -d 1 --ps-cmd -- sleep 30
 $ resmon --nic eth0,eth1
 $ resmon --ps-pids 1 2 3
+$ resmon --compress gzip -o sysstat.csv    # Writes sysstat.csv.gz.
 
 @author	Xiangyu Bu <bu1@purdue.edu>
 """
 
 import argparse
+import gzip
+import io
 import os
 import sched
 import signal
@@ -27,16 +30,38 @@ import sys
 import time
 import psutil
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESS_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def open_outfile(name, compress=None):
+    """
+    Open an output file, compressed on the fly if compress is "gzip" or "zstd", in which case the
+    suffix of the format is appended to the name. Flushing ends a compressed block, so a reader
+    of the file sees every flushed line.
+    """
+    if compress is None:
+        return open(name, 'w')
+    name += COMPRESS_SUFFIXES[compress]
+    if compress == 'gzip':
+        return gzip.open(name, 'wt')
+    return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(name, 'wb')), encoding='utf-8')
+
 
 class SystemMonitor:
 
-    def __init__(self, outfile_name=None, flush=False):
+    def __init__(self, outfile_name=None, flush=False, compress=None):
         print('System monitor started.', file=sys.stderr)
         ncores = self.ncores = psutil.cpu_count()
         if outfile_name is None:
             self.outfile = sys.stdout
         else:
-            self.outfile = open(outfile_name, 'w')
+            self.outfile = open_outfile(outfile_name, compress)
         self.flush = flush
         self.outfile.write(
             'Timestamp,  Uptime, NCPU, %CPU, ' + ', '.join(['%CPU' + str(i) for i in range(ncores)]) +
@@ -89,11 +114,12 @@ class SystemMonitor:
 
 class NetworkInterfaceMonitor:
 
-    def __init__(self, outfile_pattern='netstat.{nic}.csv', nics=[], flush=False):
+    def __init__(self, outfile_pattern='netstat.{nic}.csv', nics=[], flush=False, compress=None):
         print('NIC monitor started.', file=sys.stderr)
         all_nics = psutil.net_if_stats()
         self.nic_files = dict()
         self.flush = flush
+        self.compress = compress
         for nic_name in nics:
             nic_name = nic_name.strip()
             if nic_name not in all_nics:
@@ -125,7 +151,7 @@ class NetworkInterfaceMonitor:
         print('NIC monitor closed.', file=sys.stderr)
 
     def create_new_logfile(self, pattern, nic_name):
-        f = open(pattern.format(nic=nic_name), 'w')
+        f = open_outfile(pattern.format(nic=nic_name), self.compress)
         f.write(
             'Timestamp,  Uptime, NIC, sent.B, recv.B, sent.pkts, recv.pkts, err.in, err.out, drop.in, drop.out\n')
         return f
@@ -161,7 +187,7 @@ class ProcessSetMonitor:
 
     KEYS = sorted(BASE_STAT.keys())
 
-    def __init__(self, outfile_name, cmd=None, pids=None, flush=False):
+    def __init__(self, outfile_name, cmd=None, pids=None, flush=False, compress=None):
 
         if cmd is None and pids is None:
             raise ValueError('ProcessSetMonitor needs either a command or a set of PIDs to start.')
@@ -171,7 +197,7 @@ class ProcessSetMonitor:
         if outfile_name is None:
             self.outfile = sys.stdout
         else:
-            self.outfile = open(outfile_name, 'w')
+            self.outfile = open_outfile(outfile_name, compress)
 
         self._has_child = False
         if cmd is not None:
@@ -297,6 +323,13 @@ def main():
     parser.add_argument('--ps-pid-outfile',
                         type=str, nargs='?', default='psstat_pid.csv',
                         help='File to store process monitor output for the PIDs. Default: "psstat_pid.csv".')
+    parser.add_argument('--compress',
+                        type=str, choices=sorted(COMPRESS_SUFFIXES.keys()), default=None,
+                        help='Compress the output files on the fly and append ".gz" or ".zst" to their names. '
+                             'zstd needs the zstandard module. Default: no compression.')
+    parser.add_argument('--compress-methods',
+                        default=False, action='store_true',
+                        help='If present, print the --compress methods available here and exit.')
     
     if '--' in sys.argv:
         # Parse the target command.
@@ -313,18 +346,26 @@ def main():
             args.ps_cmd = False
         ps_cmd = None
 
+    if args.compress_methods:
+        print(' '.join(m for m in sorted(COMPRESS_SUFFIXES) if m != 'zstd' or zstandard is not None))
+        return
+
+    if args.compress == 'zstd' and zstandard is None:
+        print('Warning: module zstandard is not installed. Use gzip instead.', file=sys.stderr)
+        args.compress = 'gzip'
+
     signal.signal(signal.SIGTERM, sigterm)
 
     try:
         chprio(-20)
         scheduler = sched.scheduler(time.time, time.sleep)
-        sm = SystemMonitor(args.outfile, args.flush)
+        sm = SystemMonitor(args.outfile, args.flush, args.compress)
 
         enable_nic_mon = args.nic is not None
         if enable_nic_mon:
             try:
                 nm = NetworkInterfaceMonitor(
-                    args.nic_outfile, args.nic.split(','), args.flush)
+                    args.nic_outfile, args.nic.split(','), args.flush, args.compress)
             except ValueError as e:
                 print('Error: ' + str(e), file=sys.stderr)
                 enable_nic_mon = False
@@ -332,12 +373,12 @@ def main():
         if args.ps_pids is not None:
             pm_pid = ProcessSetMonitor(
                         outfile_name=args.ps_pid_outfile, pids=args.ps_pids, 
-                        flush=args.flush)
+                        flush=args.flush, compress=args.compress)
 
         if args.ps_cmd:
             pm_cmd = ProcessSetMonitor(
                         outfile_name=args.ps_cmd_outfile, cmd=ps_cmd, 
-                        flush=args.flush)
+                        flush=args.flush, compress=args.compress)
 
         ts = time.time()
         while True:
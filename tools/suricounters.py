@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+
+"""
+suricounters.py
+
+Counter collector polls "dump-counters" through the unix command socket of a running Suricata
+at a sub-second rate, much faster than the "stats" events Suricata writes to eve.json.
+
+Every counter, including the per-thread ones, is flattened to a dotted name like
+"threads.W#01-eth0.capture.kernel_packets". Samples are stored as fixed-width binary rows in
+"<outfile>.bin": an epoch timestamp (float64, comparable to the Timestamp column of resmon)
+followed by one int64 per counter. The column names are in "<outfile>.json". Whenever new
+counters show up (e.g., threads that started late), a new segment with the wider column list
+begins at the current offset of the .bin file.
+
+Example usage:
+
+$ suricounters -i 0.2 -s /var/run/suricata/suricata-command.socket -o suricounters
+"""
+
+import argparse
+import codecs
+import json
+import sched
+import signal
+import socket
+import struct
+import sys
+import time
+
+
+DEFAULT_SOCKET = '/var/run/suricata/suricata-command.socket'
+
+PROTOCOL_VERSION = '0.1'
+
+
+class SuricataSocketError(Exception):
+    pass
+
+
+class SuricataSocket:
+    """ Client of the Suricata unix command socket protocol. """
+
+    def __init__(self, path=DEFAULT_SOCKET, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self.sock = None
+        self._buf = ''
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connect(self):
+        """ Connect and negotiate the protocol version. """
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        try:
+            self.sock.connect(self.path)
+            self._send({'version': PROTOCOL_VERSION})
+            reply = self._recv()
+        except (OSError, ValueError, SuricataSocketError):
+            self.close()
+            raise
+        if reply.get('return') != 'OK':
+            self.close()
+            raise SuricataSocketError('Protocol version %s rejected: %s' % (PROTOCOL_VERSION, reply))
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self._buf = ''
+        self._utf8.reset()
+
+    def command(self, name, arguments=None):
+        """
+        Run a command and return the "message" of the reply. After an error on the socket, e.g. a
+        timeout in the middle of a reply, the rest of that reply could not be told from the next
+        one, so the connection is closed and the next command connects again.
+        """
+        cmd = {'command': name}
+        if arguments is not None:
+            cmd['arguments'] = arguments
+        if self.sock is None:
+            self.connect()
+        try:
+            self._send(cmd)
+            reply = self._recv()
+        except (OSError, ValueError, SuricataSocketError):
+            self.close()
+            raise
+        if reply.get('return') != 'OK':
+            raise SuricataSocketError('Command "%s" failed: %s' % (name, reply.get('message')))
+        return reply.get('message')
+
+    def _send(self, obj):
+        self.sock.sendall(json.dumps(obj).encode('utf-8') + b'\n')
+
+    def _recv(self):
+        """
+        Read until a complete JSON object is buffered. Replies are not length-prefixed, so decoding
+        is attempted whenever the buffer may end with a complete object.
+        """
+        while True:
+            text = self._buf.lstrip()
+            if text.rstrip().endswith('}'):
+                try:
+                    obj, end = self._decoder.raw_decode(text)
+                    self._buf = text[end:]
+                    return obj
+                except ValueError:
+                    pass
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise SuricataSocketError('Connection closed by Suricata.')
+            self._buf += self._utf8.decode(chunk)
+
+
+def flatten(obj, prefix='', out=None):
+    """ Flatten the numeric leaves of nested dicts into {"a.b.c": value}. """
+    if out is None:
+        out = dict()
+    for key, value in obj.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            flatten(value, name + '.', out)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[name] = int(value)
+    return out
+
+
+class CounterMonitor:
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, outfile_prefix='suricounters', flush=False, connect_timeout=60):
+        print('Counter monitor started.', file=sys.stderr)
+        self.client = SuricataSocket(socket_path)
+        self.bin_path = outfile_prefix + '.bin'
+        self.header_path = outfile_prefix + '.json'
+        self.outfile = open(self.bin_path, 'wb')
+        self.flush = flush
+        self.columns = []
+        self.segments = []
+        self.row_struct = None
+        self.starttime = time.time()
+        self._wait_for_socket(connect_timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not hasattr(self, 'closed'):
+            self.close()
+
+    def _wait_for_socket(self, timeout):
+        """ Suricata creates the socket only after it is initialized. """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.client.connect()
+                return
+            except (OSError, ValueError, SuricataSocketError) as e:
+                self.client.close()
+                if time.time() > deadline:
+                    raise SuricataSocketError('Cannot connect to "%s": %s' % (self.client.path, e))
+                time.sleep(0.5)
+
+    def close(self):
+        self.client.close()
+        self.outfile.close()
+        self.write_header()
+        self.closed = True
+        print('Counter monitor closed.', file=sys.stderr)
+
+    def write_header(self):
+        with open(self.header_path, 'w') as f:
+            json.dump({'format': 'little-endian rows of float64 timestamp and int64 counters',
+                       'starttime': self.starttime,
+                       'segments': self.segments}, f, indent=2)
+
+    def start_segment(self, names):
+        self.columns = self.columns + sorted(n for n in names if n not in self.columns)
+        self.row_struct = struct.Struct('<d%dq' % len(self.columns))
+        self.segments.append({'offset': self.outfile.tell(), 'columns': ['Timestamp'] + self.columns})
+        self.write_header()
+
+    def poll_stat(self):
+        timestamp = time.time()
+        try:
+            message = self.client.command('dump-counters')
+        except (OSError, ValueError, SuricataSocketError) as e:
+            print('Warning: dump-counters failed: %s' % e, file=sys.stderr)
+            return
+        if not isinstance(message, dict):
+            print('Warning: dump-counters returned no counters: %r' % (message,), file=sys.stderr)
+            return
+        counters = flatten(message)
+        if self.row_struct is None or not set(counters).issubset(self.columns):
+            self.start_segment(counters.keys())
+        # Counters that disappeared, e.g. of an exited thread, are written as -1.
+        self.outfile.write(self.row_struct.pack(timestamp, *[counters.get(name, -1) for name in self.columns]))
+        if self.flush:
+            self.outfile.flush()
+
+
+def sigterm(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Poll Suricata counters through its unix command socket.')
+    parser.add_argument('--interval', '-i',
+                        type=float, default=0.2, help='Interval, in sec, to poll the counters. Default: 0.2.')
+    parser.add_argument('--socket', '-s',
+                        type=str, default=DEFAULT_SOCKET, help='Path to the Suricata command socket.')
+    parser.add_argument('--outfile', '-o',
+                        type=str, default='suricounters',
+                        help='Prefix of the output files "<outfile>.bin" and "<outfile>.json". Default: "suricounters".')
+    parser.add_argument('--flush', '-f',
+                        default=False, action='store_true',
+                        help='If present, flush the output file after each sample is written.')
+    parser.add_argument('--connect-timeout',
+                        type=float, default=60, help='Seconds to wait for the socket to appear. Default: 60.')
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGTERM, sigterm)
+
+    try:
+        cm = CounterMonitor(args.socket, args.outfile, args.flush, args.connect_timeout)
+    except SuricataSocketError as e:
+        print('Error: ' + str(e), file=sys.stderr)
+        return 1
+
+    try:
+        scheduler = sched.scheduler(time.time, time.sleep)
+        ts = time.time()
+        while True:
+            ts = ts + args.interval
+            scheduler.enterabs(time=ts, priority=0, action=CounterMonitor.poll_stat, argument=(cm,))
+            scheduler.run()
+    except KeyboardInterrupt:
+        cm.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())